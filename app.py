@@ -1,312 +1,1318 @@
+import time
+# Streamlit re-runs this whole file on every interaction; each run is timed from here
+SCRIPT_STARTED, SCRIPT_CPU_STARTED = time.perf_counter(), time.thread_time()
+
 import streamlit as st
-import openai
+import asyncio
+import itertools
 import json
-from pypdf import PdfReader
-from datetime import datetime
+import logging
+import math
+import threading
+import uuid
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
 from dotenv import load_dotenv
 import re # Add regex import
-import traceback # Add for detailed exception logging
-import requests
 
-# Load environment variables
+# Load environment variables (before the local modules below read their settings)
 load_dotenv()
 
+from pdf_extraction import read_pdf_bytes, load_pdf_pages, iter_pdf_pages, read_text_budget
+from document_store import DocumentTooLargeError, get_document_store
+from llm_client import is_transport_error, post_chat_completion
+from history_store import get_history_store
+from dedup_index import get_dedup_index
+from learner_model import get_learner_model
+from question_bank import get_question_bank, quiz_output
+from quiz_schema import RESPONSE_FORMAT, generation_stats, parse_quiz_json
+from response_cache import fingerprint, get_response_cache
+from text_index import chunk_bounds, get_chunk_index, get_course_index, parse_page_range
+from prompt_budget import get_prompt_budget
+from request_scheduler import current_session, get_scheduler
+from instrumentation import (
+    get_logger, log_event, metrics, record_script_run, run_timer, start_exporters, timed, timer
+)
+
+log = get_logger("app")
+start_exporters()
+
 # Get API key
 api_key = os.getenv("OPENAI_API_KEY", "").strip().strip("'").strip('"')
 if not api_key:
     st.error("OpenAI API key not found in environment variables")
     st.stop()
 
-# Debug output (first/last 4 chars only for security)
-print(f"API Key loaded (first/last 4 chars): {api_key[:4]}...{api_key[-4:]}")
+# Quizzes pre-generated per session while the current one is taken, and the process-wide
+# worker limit for pre-generation
+PREGENERATE_BUFFER = int(os.getenv("PREGENERATE_BUFFER", "1"))
+PREGENERATE_WORKERS = int(os.getenv("PREGENERATE_WORKERS", "4"))
+# Pre-generation from every session shares one scheduler queue, so it only takes a turn
+# alongside each session waiting for a quiz it asked for
+PREGENERATE_QUEUE = "pregenerate"
+# Seconds a click waits for a queued quiz's first question before generating a fresh one
+PREGENERATE_TAKE_TIMEOUT = 0.5
 
-# Initialize the OpenAI client with base URL and default headers
-client = openai.OpenAI(
-    api_key=api_key,
-    base_url="https://api.openai.com/v1",
-    default_headers={
-        "OpenAI-Project": "proj_iS6x3Kfdco6oQtaB4Ue4mHS2",
-        "Authorization": f"Bearer {api_key}",
-        "User-Agent": "PostmanRuntime/7.36.3",
-        "Accept": "*/*",
-        "Accept-Encoding": "identity",
-        "Connection": "keep-alive"
-    }
-)
+# Model, and response format: "text" (parsed with parse_quiz) or "json" (structured
+# output validated against a schema; needs a model that supports json_schema, e.g. gpt-4o-mini)
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+QUIZ_RESPONSE_FORMAT = os.getenv("QUIZ_RESPONSE_FORMAT", "text").strip().lower()
+JSON_MAX_RETRIES = int(os.getenv("QUIZ_JSON_MAX_RETRIES", "2"))
 
-# Load quiz history
-def load_quiz_history():
-    try:
-        with open("quiz_history.json", "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return {"history": []}
-
-# Save new quiz to history
-def save_quiz_to_history(quiz_content, topic, difficulty):
-    history = load_quiz_history()
-    history["history"].append({
-        "timestamp": datetime.now().isoformat(),
-        "topic": topic,
-        "difficulty": difficulty,
-        "quiz": quiz_content
-    })
-    with open("quiz_history.json", "w") as file:
-        json.dump(history, file, indent=4)
-
-# Extract text from uploaded textbook PDF
+
+# Uploaded documents indexed concurrently in the background, across sessions (extraction
+# itself runs in the shared process pool)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "4"))
+
+# Quizzes are generated as several small concurrent requests
+QUESTIONS_PER_REQUEST = int(os.getenv("QUESTIONS_PER_REQUEST", "2"))
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+
+# Seconds to admit no requests after a 429 that came without a Retry-After header
+RATE_LIMIT_PAUSE = 5.0
+
+# Banked questions looked at per quiz question before the rest is generated instead
+BANK_MAX_CANDIDATES = 20
+
+# Extra rounds a quiz may spend replacing questions dropped as near-duplicates
+DEDUP_MAX_RETRIES = int(os.getenv("DEDUP_MAX_RETRIES", "2"))
+# A cached response is only served if at most this share of its questions repeat ones the
+# learner has already seen; otherwise a fresh one is requested
+CACHED_REPEAT_SHARE = 0.5
+
+# "Adaptive" picks the level (and, unless the student narrows the content, the chapter) from
+# the learner model; the others are used as chosen
+ADAPTIVE = "Adaptive"
+DIFFICULTY_OPTIONS = [ADAPTIVE, "Beginner", "Intermediate", "Advanced"]
+
+# End of imports and settings; the rest of the file only defines functions until main() runs
+SCRIPT_SETUP_DONE = time.perf_counter()
+
+# Shared history store; quizzes saved before questions were stored structurally are parsed once
+def history_store():
+    return get_history_store(parse_legacy=parse_quiz)
+
+# Token budget per request for the configured model, built (with its tokenizer) on the first
+# prompt rather than when the app is imported. Textbook chunks are selected (or, before the
+# upload is indexed, pages extracted) up to roughly what one prompt can hold, and cut to the
+# exact token budget per request.
+def prompt_budget():
+    return get_prompt_budget(OPENAI_MODEL)
+
+# Per-learner, per-topic ability estimates; rebuilt from the saved answers when its parameters change
+def learner_model():
+    return get_learner_model(lambda: history_store().answers())
+
+# Save new quiz to the learner's history along with its parsed questions and their answers,
+# mark its questions as seen for dedup, and update the learner's ratings with each answer (in
+# the order they are stored)
+def save_quiz_to_history(quiz_content, topic, difficulty, questions=None, user_answers=None, learner=None):
+    with timer("history_io", op="append"):
+        history_store().append(topic, difficulty, quiz_content, questions=questions, user_answers=user_answers,
+                               learner=learner)
+    if learner is None:
+        return
+    if questions:
+        dedup_index().record(learner, topic, questions)
+    with timer("learner_update"):
+        for position in sorted(user_answers or {}):
+            answer_info = user_answers[position]
+            learner_model().record(learner, topic, difficulty, answer_info["correct"], answer_info.get("attempts"))
+
+# Questions from the offline bank (build_question_bank.py) for this selection and level, in
+# random order; nothing when there is no bank or the student asked for keywords, which bank
+# chunks aren't matched against
+def bank_candidates(doc_ids, difficulty, focus=None, page_range=None, chapter=None):
+    bank = get_question_bank()
+    if bank is None or focus:
+        return ()
+    if chapter:
+        doc_ids, page_range = [chapter["doc_id"]], chapter["pages"]
+    return bank.draw(doc_ids, difficulty, page_range)
+
+# Adaptive mode's chapter: the one the learner is weakest on (topics are chapter titles)
+def adaptive_chapter(learner, chapters):
+    index = learner_model().weakest(learner, [chapter["title"][:80] for chapter in chapters])
+    return None if index is None else chapters[index]
+
+# Adaptive mode practises the weakest chapter unless the student narrowed the content, and
+# only takes a queued quiz whose chapter and level it would still pick.
+# Returns (chapter, the chapters it was picked from or None, filter for queued quizzes or None).
+def adaptive_selection(learner, difficulty, chapter, focus_topic, page_range, chapters):
+    if difficulty != ADAPTIVE:
+        return chapter, None, None
+    adaptive_chapters = None
+    if chapter is None and not focus_topic and not page_range and chapters:
+        adaptive_chapters = chapters
+        chapter = adaptive_chapter(learner, chapters)
+    target_topic = chapter["title"][:80] if chapter else None
+
+    def accept(job):
+        return (job.difficulty == learner_model().recommend_difficulty(learner, job.topic)
+                and target_topic in (None, job.topic))
+    return chapter, adaptive_chapters, accept
+
+# Extract text from uploaded textbook PDF (served from the on-disk cache when this file was seen before)
 def extract_text_from_pdf(pdf_file):
     try:
-        pdf_reader = PdfReader(pdf_file)
-        text = ""
-        for page in pdf_reader.pages:
-            text += page.extract_text() or ""
-        return text
+        with timer("pdf_extraction", mode="full"):
+            _, pages = load_pdf_pages(read_pdf_bytes(pdf_file))
+            return "".join(pages)
     except Exception as e:
+        log.exception("pdf_read_failed")
         st.error(f"Error reading PDF: {e}")
         return ""
 
-# --- Refined Quiz Parsing Function ---
+# Most specific outline entry covering a page of a document, else the document's title
+def outline_topic(outline, page):
+    topic = None
+    for title, first_page, _ in outline["entries"]: # In page order
+        if first_page > page:
+            break
+        topic = title
+    return topic or outline["title"]
+
+# Top-level outline entries of each document, as chapters a quiz can be restricted to
+def course_chapters(doc_ids):
+    store = get_document_store()
+    chapters = []
+    for doc_id in doc_ids:
+        outline = store.outline(doc_id)
+        top_level = min((level for _, _, level in outline["entries"]), default=0)
+        starts = [(title, page) for title, page, level in outline["entries"] if level == top_level]
+        for position, (title, first_page) in enumerate(starts):
+            last_page = starts[position + 1][1] - 1 if position + 1 < len(starts) else outline["page_count"]
+            label = f"{title} (p. {first_page}-{max(first_page, last_page)})"
+            chapters.append({
+                "doc_id": doc_id,
+                "title": title,
+                "pages": (first_page, max(first_page, last_page)),
+                "label": f"{outline['title']} · {label}" if len(doc_ids) > 1 else label
+            })
+    return chapters
+
+# Opening pages of each document, extracting only as many as its share of max_chars needs
+# (a 1,000-page book costs the same as a 10-page one). Returns (text, topic).
+def leading_course_text(doc_ids, max_chars):
+    store = get_document_store()
+    share = max_chars // len(doc_ids)
+    parts = []
+    with timer("pdf_extraction", mode="budget"):
+        for doc_id in doc_ids:
+            text = read_text_budget(iter_pdf_pages(store.pdf_bytes(doc_id)), share)[:share]
+            parts.append(f"[{store.name(doc_id)}]\n{text.strip()}" if len(doc_ids) > 1 else text)
+    return "\n\n".join(parts), os.path.splitext(store.name(doc_ids[0]))[0][:80]
+
+# Pick textbook content from the course index and name its topic. A chapter restricts content
+# to that chapter; focus keywords pick the best-matching chunks across all documents; otherwise
+# every document contributes in proportion to its size. Until the documents are indexed, a
+# quiz on the whole course is served from their opening pages instead of waiting for the
+# index; a narrowed one waits. Returns (text, topic).
+def select_course_content(doc_ids, focus=None, page_range=None, chapter=None, max_chars=None):
+    max_chars = prompt_budget().content_chars() if max_chars is None else max_chars
+    try:
+        if not (focus or page_range or chapter) and ingest_pending(doc_ids):
+            return leading_course_text(doc_ids, max_chars)
+        wait_for_ingest(doc_ids)
+        store = get_document_store()
+        with timer("course_index"):
+            # Each document's index is built once; the course index just combines them
+            course = get_course_index(doc_ids, store.pages)
+        document = None
+        if chapter:
+            document, page_range = doc_ids.index(chapter["doc_id"]), chapter["pages"]
+        with timer("chunk_select"):
+            chunk_ids = course.select(focus, page_range, max_chars, document=document)
+
+        outlines = [store.outline(doc_id) for doc_id in doc_ids]
+        parts = []
+        topics = Counter()
+        for chunk_id in chunk_ids:
+            position, _ = course.locate(chunk_id)
+            first_page, last_page = int(course.page_first[chunk_id]), int(course.page_last[chunk_id])
+            source = f"Pages {first_page}-{last_page}"
+            if len(doc_ids) > 1:
+                source = f"{outlines[position]['title']}, {source.lower()}"
+            parts.append(f"[{source}]\n{course.chunk_text(chunk_id).strip()}")
+            topics[outline_topic(outlines[position], first_page)] += 1
+
+        if chapter:
+            topic = chapter["title"]
+        else:
+            topic = focus or (topics.most_common(1)[0][0] if topics else "General")
+        return "\n\n".join(parts), topic[:80]
+    except Exception as e:
+        log.exception("pdf_index_failed")
+        st.error(f"Error indexing PDF: {e}")
+        return "", None
+
+# --- Quiz Parsing ---
+# Precompiled patterns for the single-pass parser. Markers are matched case-insensitively
+# at the start of a (stripped) line; options may be written "A." or "A)".
+MARKER_RE = re.compile(
+    r"^(?:(?P<question>question)(?:\s*\d+)?|(?P<options>options)|(?:correct\s+)?(?P<answer>answer)|(?P<explanation>explanation))"
+    r"\s*:\s*(?P<rest>.*)$",
+    re.IGNORECASE
+)
+OPTION_RE = re.compile(r"^\(?([A-Da-d])[.)]\s*(.*)$")
+ANSWER_LETTER_RE = re.compile(r"^\(?([A-Da-d])\)?(?:[.):]|\s*$|\s+[-–])")
+QUESTION_NUMBER_RE = re.compile(r"^\d+[.)]\s*")
+MARKER_INITIALS = frozenset("QqOoAaEeCc")
+
+# Keep a finished block only if it has question text, four options, an answer and an explanation
+def _append_if_valid(questions, question_text, options, answer, explanation_lines):
+    explanation = "\n".join(explanation_lines).strip()
+    if question_text and len(options) == 4 and answer and explanation:
+        questions.append({
+            "question": question_text,
+            "options": options,
+            "answer": answer,
+            "explanation": explanation
+        })
+
+# Single-pass state machine over the lines of the model output. Produces the same records
+# as the block-splitting parser on the requested format, and also accepts lowercase markers,
+# "A)" options, and answers or explanations on the same line as their marker.
+@timed("quiz_parse", format="text")
 def parse_quiz(quiz_text):
     questions = []
-    # Use regex that matches Question: at start (^) OR after newline (\n)
-    # Filter out any empty strings resulting from the split
-    question_blocks = [block for block in re.split(r"(?:^|\n)Question:\s*(?:\d+\.\s*)?", quiz_text.strip()) if block.strip()]
+    blocks = 0
+    state = None # None (preamble), "question", "options", "answer", "explanation"
+    question_text, options, answer, explanation_lines = "", {}, None, []
 
-    print(f"[Parser] Found {len(question_blocks)} potential question blocks.") # Debug print
+    for line in quiz_text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
 
-    for i, block in enumerate(question_blocks):
-        print(f"\n[Parser] Processing Block {i+1}") # Debug print
-        try:
-            # Use splitlines() and strip each line immediately
-            lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
-            if not lines:
-                print("[Parser] Block empty after stripping/splitting lines.") # Debug print
+        # One regex call classifies marker lines; everything else is content for the current state
+        marker = MARKER_RE.match(line) if line[0] in MARKER_INITIALS else None
+        # Inside an explanation only a new question ends it: "Correct answer: B ..." is explanation text
+        if marker and state == "explanation" and not marker.group("question"):
+            marker = None
+        if marker:
+            rest = marker.group("rest").strip()
+            if marker.group("question"):
+                if state is not None:
+                    _append_if_valid(questions, question_text, options, answer, explanation_lines)
+                blocks += 1
+                state = "question"
+                question_text, options, answer, explanation_lines = QUESTION_NUMBER_RE.sub("", rest, count=1), {}, None, []
+            elif state is None:
                 continue
-
-            question_text = lines[0] # Already stripped
-            print(f"[Parser] Question: '{question_text}'") # Debug print
-
-            options_dict = {}
-            options_start_index = -1
-            answer_start_index = -1
-            explanation_start_index = -1
-
-            # Find marker indices
-            for idx, line in enumerate(lines):
-                # Check against already stripped lines
-                if line.startswith("Options:"): options_start_index = idx + 1
-                elif line.startswith("Answer:"): answer_start_index = idx
-                elif line.startswith("Explanation:"): explanation_start_index = idx
-
-            print(f"[Parser] Indices - Opts:{options_start_index}, Ans:{answer_start_index}, Expl:{explanation_start_index}") # Debug print
-
-            # Extract Options
-            if options_start_index != -1 and answer_start_index != -1 and options_start_index <= answer_start_index:
-                option_lines = lines[options_start_index:answer_start_index]
-                for line in option_lines:
-                    match = re.match(r"^([A-D])\.\s*(.*)", line) # Match already stripped line
-                    if match:
-                        options_dict[match.group(1)] = match.group(2).strip() # Ensure value is stripped too
-                print(f"[Parser] Options Found: {options_dict}") # Debug print
-            else:
-                 print("[Parser] Markers for options/answer not found correctly or in wrong order.") # Debug print
-
-            # Extract Answer
-            correct_answer = None
-            if answer_start_index != -1:
-                # Get the next line after "Answer:" if it exists
-                if answer_start_index + 1 < len(lines):
-                    answer_line = lines[answer_start_index + 1]
-                    # Try matching Letter.Text or just Letter
-                    match_letter_dot = re.match(r"^([A-D])\.", answer_line)
-                    match_letter_only = re.match(r"^([A-D])$", answer_line)
-
-                    if match_letter_dot:
-                        correct_answer = match_letter_dot.group(1)
-                    elif match_letter_only:
-                        correct_answer = match_letter_only.group(1)
-                    print(f"[Parser] Answer Line: '{answer_line}', Parsed: '{correct_answer}'") # Debug print
-                else:
-                    print("[Parser] No line found after Answer: marker.") # Debug print
-            else:
-                print("[Parser] Answer marker not found.") # Debug print
-
-            # Extract Explanation
-            explanation = ""
-            if explanation_start_index != -1 and explanation_start_index < len(lines) - 1:
-                # Join lines *after* the explanation marker (lines are already stripped)
-                explanation = '\n'.join(lines[explanation_start_index+1:]).strip() # Re-join stripped lines
-                print(f"[Parser] Explanation Found (len: {len(explanation)}): '{explanation[:50]}...'" )# Debug print
-            elif explanation_start_index != -1:
-                 print("[Parser] Explanation marker found, but no text after it.") # Debug print
+            elif marker.group("options"):
+                state = "options"
+            elif marker.group("answer"):
+                state = "answer"
+                # Only the marker line's remainder, or else the next line, holds the answer
+                if rest:
+                    letter = ANSWER_LETTER_RE.match(rest)
+                    answer = letter.group(1).upper() if letter else None
+                    state = "after_answer"
             else:
-                 print("[Parser] Explanation marker not found.") # Debug print
-
-            # Final Validation
-            valid_question = bool(question_text)
-            valid_options = len(options_dict) == 4
-            valid_answer = bool(correct_answer)
-            valid_explanation = bool(explanation)
-
-            if valid_question and valid_options and valid_answer and valid_explanation:
-                questions.append({
-                    "question": question_text,
-                    "options": options_dict,
-                    "answer": correct_answer,
-                    "explanation": explanation
-                })
-                print(f"[Parser] -> Block {i+1} Added.") # Debug print
-            else:
-                # More detailed validation failure log (prints to terminal)
-                fail_reasons = []
-                if not valid_question: fail_reasons.append("Missing Question Text")
-                if not valid_options: fail_reasons.append(f"Incorrect Option Count ({len(options_dict)}) ")
-                if not valid_answer: fail_reasons.append("Missing Answer")
-                if not valid_explanation: fail_reasons.append("Missing Explanation")
-                print(f"[Parser] -> Block {i+1} Failed Validation: {', '.join(fail_reasons)}") # Debug print
-
-        except Exception as e:
-            print(f"[Parser] -> EXCEPTION parsing block {i+1}: {e}") # Debug print
-            print(traceback.format_exc()) # Print full traceback to terminal
+                state = "explanation"
+                if rest:
+                    explanation_lines.append(rest)
+            continue
+        if state is None:
             continue
 
-    print(f"[Parser] Finished. Total questions parsed successfully: {len(questions)}") #Debug print
+        if state == "question":
+            if not question_text:
+                question_text = QUESTION_NUMBER_RE.sub("", line, count=1)
+            elif OPTION_RE.match(line):
+                # Options listed without an "Options:" marker
+                state = "options"
+        if state == "options":
+            option = OPTION_RE.match(line)
+            if option:
+                options[option.group(1).upper()] = option.group(2).strip()
+        elif state == "answer":
+            letter = ANSWER_LETTER_RE.match(line)
+            answer = letter.group(1).upper() if letter else None
+            state = "after_answer"
+        elif state == "explanation":
+            explanation_lines.append(line)
+
+    if state is not None:
+        _append_if_valid(questions, question_text, options, answer, explanation_lines)
+
+    log_event(log, logging.DEBUG, "quiz_parsed", questions=len(questions), blocks=blocks)
     return questions
-# --- End Refined Quiz Parsing Function ---
+# --- End Quiz Parsing ---
 
-# Generate quiz questions using OpenAI
-def generate_quiz(textbook_content, quiz_history, difficulty, topic):
-    try:
-        # Limit the size of the textbook content sent to the API
-        max_chars = 15000
-        truncated_textbook_content = textbook_content[:max_chars]
-        if len(textbook_content) > max_chars:
-            truncated_textbook_content += "\n... [Text truncated due to length]"
-
-        # Filter history based on the *detected topic* and limit the number of items
-        relevant_history = [
-            item for item in quiz_history.get("history", [])
-            if item.get("topic") == topic
-        ]
-        recent_relevant_history = relevant_history[-10:]
-
-        history_text = "\n".join([
-            f"Q: {item.get('quiz', '').splitlines()[0]} A: {item.get('quiz', '').split('Answer:')[-1].strip()}"
-            for item in recent_relevant_history
-        ])
-
-        # Define difficulty characteristics
-        difficulty_guidelines = {
-            "Beginner": """
+# Marks the start of a question block in streamed output
+QUESTION_START_RE = re.compile(r"^[ \t]*question(?:\s*\d+)?\s*:", re.IGNORECASE | re.MULTILINE)
+
+# Incremental parse_quiz for streamed output: a question is emitted as soon as the next
+# "Question:" marker arrives (i.e. its Explanation block has closed), the last one on close()
+class IncrementalQuizParser:
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        # The buffer only ever holds the unfinished tail, so this scan stays short
+        starts = [match.start() for match in QUESTION_START_RE.finditer(self.buffer)]
+        boundary = next((start for start in reversed(starts) if start > 0), None)
+        if boundary is None:
+            return []
+        complete, self.buffer = self.buffer[:boundary], self.buffer[boundary:]
+        return parse_quiz(complete)
+
+    def close(self):
+        remaining, self.buffer = self.buffer, ""
+        return parse_quiz(remaining) if remaining.strip() else []
+
+# Raised when the completions endpoint returns an error response
+class QuizGenerationError(Exception):
+    pass
+
+# Output format instructions for free-text and JSON responses
+TEXT_FORMAT_SPEC = """
+Format each question exactly as follows:
+Question:
+Options:
+A. Option A
+B. Option B
+C. Option C
+D. Option D
+Answer:
+Explanation:
+"""
+JSON_FORMAT_SPEC = """
+Respond with a JSON object of the form {"questions": [...]} where each question has
+"question" (text), "options" (an object with keys "A", "B", "C", "D"), "answer" (one of
+"A", "B", "C", "D") and "explanation" (text).
+"""
+
+# Difficulty characteristics included in the prompt
+DIFFICULTY_GUIDELINES = {
+    "Beginner": """
 - Focus on basic concept recognition and definitions
 - Questions should test understanding of fundamental terms and ideas
 - Use straightforward language and avoid complex terminology
 - Options should be clearly distinct from each other
 - Explanations should be simple and educational
 """,
-            "Intermediate": """
+    "Intermediate": """
 - Test application of concepts and relationships between ideas
 - Include some technical terminology appropriate to the subject
 - Questions may require connecting multiple concepts
 - Options can be more nuanced but still distinct
 - Explanations should provide deeper insight into the topic
 """,
-            "Advanced": """
+    "Advanced": """
 - Test deep understanding and analysis of complex concepts
 - Include detailed technical terminology and advanced concepts
 - Questions should require critical thinking and synthesis of information
 - Options may include subtle differences that test thorough understanding
 - Explanations should explore underlying principles and connections
 """
-        }
+}
 
-        prompt = f"""
+SYSTEM_PROMPT = "You are a helpful AI tutor specializing in creating educational assessments that match the student's skill level."
+
+AVOID_INTRO = "\n\nThe student has already seen these questions; do not repeat or closely paraphrase them:\n"
+
+# The fixed parts of a prompt (everything but textbook content and questions to avoid).
+# Their token counts go through the tokenizer's cache, which lives in prompt_budget and so
+# survives Streamlit re-running this file; building the strings themselves is cheap.
+# Returns (text before the content, text after it, their tokens plus the system message's).
+def prompt_template(difficulty, num_questions, json_output):
+    head = f"""
 You are an AI tutor helping students prepare for exams. You're creating a {difficulty} level quiz.
 
 For this {difficulty} level:
-{difficulty_guidelines[difficulty]}
+{DIFFICULTY_GUIDELINES[difficulty]}
 
 The student provided the following textbook content (potentially truncated):
-{truncated_textbook_content}
-
-The student's past quiz history for the topic '{topic}' includes (most recent):
-{history_text if history_text else "No relevant history found."}
+"""
+    tail = f"""
 
-Please generate 5 questions that match the {difficulty} level guidelines above. For each question:
+Please generate {num_questions} question{'s' if num_questions != 1 else ''} that match the {difficulty} level guidelines above. For each question:
 - Ensure the difficulty matches the specified guidelines
 - Make questions clear and unambiguous
 - Include four distinct options (A, B, C, D)
 - Provide a correct answer
 - Give a thorough explanation that helps the student learn
+{JSON_FORMAT_SPEC if json_output else TEXT_FORMAT_SPEC}"""
+    count = prompt_budget().tokenizer.count_cached
+    fixed_tokens = count(SYSTEM_PROMPT) + count(head) + count(tail)
+    return head, tail, fixed_tokens
 
-Format each question exactly as follows:
-Question:
-Options:
-A. Option A
-B. Option B
-C. Option C
-D. Option D
-Answer:
-Explanation:
-"""
-        
-        # Direct API call with proper headers for project API keys
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-            "OpenAI-Project": "proj_iS6x3Kfdco6oQtaB4Ue4mHS2",
-            "User-Agent": "PostmanRuntime/7.36.3",
-            "Accept": "*/*",
-            "Accept-Encoding": "identity",
-            "Connection": "keep-alive"
-        }
-        
-        data = {
-            "model": "gpt-3.5-turbo",
-            "messages": [
-                {"role": "system", "content": "You are a helpful AI tutor specializing in creating educational assessments that match the student's skill level."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.7
-        }
-        
-        # Debug print request details
-        print("\n----------- REQUEST HEADERS -----------")
-        print(headers)
-        print("\n----------- REQUEST BODY -----------")
-        print(json.dumps(data, indent=2))
-        print("--------------------------------------\n")
-        
-        response = requests.post(
-            "https://api.openai.com/v1/chat/completions",
-            headers=headers,
-            json=data,
-            timeout=30
-        )
-        
-        # Debug print response details
-        print("\n----------- RESPONSE STATUS -----------")
-        print(f"Status Code: {response.status_code}")
-        print("\n----------- RESPONSE BODY -----------")
-        print(response.text)
-        print("--------------------------------------\n")
-        
-        if response.status_code != 200:
-            error_detail = response.json().get('error', {}).get('message', 'Unknown error')
-            st.error(f"OpenAI API error ({response.status_code}): {error_detail}")
-            return None
-            
-        response_data = response.json()
-        return response_data['choices'][0]['message']['content']
-            
-    except requests.exceptions.RequestException as e:
-        st.error(f"Network error: {str(e)}")
+# Build the prompt for one quiz request of num_questions questions, within the prompt budget.
+# Repeats are caught by the dedup index rather than by listing past questions; `avoid` only
+# names the near-duplicates a regeneration is replacing, and content fills the rest.
+@timed("prompt_build")
+def build_quiz_prompt(textbook_content, difficulty, num_questions=5, json_output=False, avoid=None):
+    head, tail, fixed_tokens = prompt_template(difficulty, num_questions, json_output)
+    truncation_note = "\n... [Text truncated due to length]"
+    budget = prompt_budget()
+    avoid_tokens, content_tokens = budget.allocate(
+        fixed_tokens + budget.tokenizer.count_cached(AVOID_INTRO) + budget.tokenizer.count_cached(truncation_note)
+    )
+
+    avoid_text = ""
+    used_tokens = 0
+    if avoid:
+        kept, used_tokens = budget.fit_lines([f"- {question}" for question in avoid], avoid_tokens)
+        if kept:
+            avoid_text = AVOID_INTRO + "\n".join(kept)
+
+    # Limit the textbook content to what is left of the budget
+    content, truncated = budget.truncate(textbook_content, content_tokens + avoid_tokens - used_tokens)
+    if truncated:
+        content += truncation_note
+
+    return head + content + avoid_text + tail
+
+# Headers and body for a chat completion request (json_output asks for schema-conforming JSON)
+def build_completion_request(prompt, json_output=False):
+    # Direct API call with proper headers for project API keys
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "OpenAI-Project": "proj_iS6x3Kfdco6oQtaB4Ue4mHS2",
+        "User-Agent": "PostmanRuntime/7.36.3",
+        "Accept": "*/*",
+        "Accept-Encoding": "identity",
+        "Connection": "keep-alive"
+    }
+
+    data = {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.7,
+        # The output share of the token budget is enforced, not only reserved
+        "max_tokens": prompt_budget().output_tokens
+    }
+    if json_output:
+        data["response_format"] = RESPONSE_FORMAT
+    return headers, data
+
+# Prompt tokens of a request; the scheduler charges these plus the output budget up front
+# and settles to the real usage once the response is in
+def prompt_tokens(data):
+    return sum(prompt_budget().count(message["content"]) for message in data["messages"])
+
+# Stop admitting requests while the API is still rate limiting after the transport's retries
+def pause_if_rate_limited(response):
+    if response.status_code == 429:
+        try:
+            retry_after = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            retry_after = RATE_LIMIT_PAUSE
+        get_scheduler().pause(retry_after)
+
+# POST one chat completion request and return the message text (raises on failure).
+# Waits its turn in the process-wide scheduler first.
+def fetch_completion(headers, data):
+    # Only sizes are logged: headers carry the API key and bodies carry the textbook
+    prompt_chars = sum(len(message["content"]) for message in data["messages"])
+    scheduler = get_scheduler()
+    tokens = prompt_tokens(data)
+    ticket = scheduler.acquire(tokens + prompt_budget().output_tokens)
+    # Shared keep-alive session: pooled connections, retries with backoff on 429/5xx
+    try:
+        with timer("llm_request", stream="false"):
+            response = post_chat_completion(data, headers)
+    except Exception:
+        scheduler.settle(ticket, tokens)
+        raise
+    metrics.increment("llm_requests_total", status=response.status_code, stream="false")
+    log_event(log, logging.INFO, "llm_response", status=response.status_code, model=data["model"],
+              prompt_chars=prompt_chars, response_bytes=len(response.content))
+
+    if response.status_code != 200:
+        scheduler.settle(ticket, tokens)
+        pause_if_rate_limited(response)
+        error_detail = response.json().get('error', {}).get('message', 'Unknown error')
+        raise QuizGenerationError(f"OpenAI API error ({response.status_code}): {error_detail}")
+
+    response_data = response.json()
+    content = response_data['choices'][0]['message']['content']
+    scheduler.settle(ticket, (response_data.get("usage") or {}).get("total_tokens")
+                     or tokens + prompt_budget().count(content))
+    return content
+
+# A cached response to the request, or None. accept_cached(text) can turn one down (e.g. one
+# that mostly repeats questions the learner has seen); it then counts as a miss, and the fresh
+# response is cached as another variant.
+def cached_completion(cache, key, headers, data, accept_cached=None):
+    with timer("response_cache_lookup"):
+        cached, variants = cache.lookup(key)
+    if cached is not None and accept_cached is not None and not accept_cached(cached):
+        metrics.increment("response_cache_total", result="rejected")
         return None
+    metrics.increment("response_cache_total", result="hit" if cached is not None else "miss")
+    if cached is not None:
+        cache.maybe_refresh(key, variants, lambda: fetch_completion(headers, data))
+    return cached
+
+# Send one chat completion request, served from the response cache when an identical
+# request (same prompt and model parameters) was answered before
+def request_completion(prompt, json_output=False, use_cache=True, accept_cached=None):
+    headers, data = build_completion_request(prompt, json_output)
+    cache = get_response_cache() if use_cache else None
+    # Identical requests already in flight (e.g. a class on the same chapter) are sent once
+    key = fingerprint(data)
+    if cache is None:
+        return get_scheduler().merged(key, lambda: fetch_completion(headers, data))
+
+    cached = cached_completion(cache, key, headers, data, accept_cached)
+    if cached is not None:
+        return cached
+
+    def fetch_and_cache():
+        content = fetch_completion(headers, data)
+        cache.put(key, content)
+        return content
+    return get_scheduler().merged(key, fetch_and_cache)
+
+# Stream a chat completion, yielding content deltas as they arrive (raises on failure).
+# A cached response is yielded in one piece; a fresh one is cached once it completes.
+def stream_completion(prompt, use_cache=True, accept_cached=None):
+    headers, data = build_completion_request(prompt)
+    cache = get_response_cache() if use_cache else None
+    key = fingerprint(data)
+    if cache is not None:
+        cached = cached_completion(cache, key, headers, data, accept_cached)
+        if cached is not None:
+            yield cached
+            return
+
+    # Identical requests already in flight are sent once; joiners get the complete text
+    yield from get_scheduler().merged_stream(key, lambda: stream_deltas(headers, data, key, cache))
+
+# Send one streamed request once the scheduler admits it and yield its content deltas;
+# the text is cached once the stream completes
+def stream_deltas(headers, data, key, cache):
+    scheduler = get_scheduler()
+    tokens = prompt_tokens(data)
+    ticket = scheduler.acquire(tokens + prompt_budget().output_tokens)
+    data = dict(data, stream=True)
+    parts = []
+    start = time.perf_counter()
+    first_delta = None
+    try:
+        with post_chat_completion(data, headers, stream=True) as response:
+            metrics.increment("llm_requests_total", status=response.status_code, stream="true")
+            log_event(log, logging.INFO, "llm_stream_opened", status=response.status_code, model=data["model"])
+            if response.status_code != 200:
+                pause_if_rate_limited(response)
+                error_detail = response.json().get('error', {}).get('message', 'Unknown error')
+                raise QuizGenerationError(f"OpenAI API error ({response.status_code}): {error_detail}")
+
+            # Server-sent events: one "data: {json}" line per delta, terminated by "data: [DONE]"
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    metrics.observe("llm_request_seconds", time.perf_counter() - start, stream="true")
+                    if cache is not None and parts:
+                        cache.put(key, "".join(parts))
+                    break
+                choices = json.loads(payload).get("choices") or [{}]
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    if first_delta is None:
+                        first_delta = time.perf_counter() - start
+                        metrics.observe("llm_first_delta_seconds", first_delta)
+                    parts.append(delta)
+                    yield delta
+    finally:
+        scheduler.settle(ticket, tokens + (prompt_budget().count("".join(parts)) if parts else 0))
+
+# Stream one quiz request, handing each question to on_question as soon as it is complete.
+# Returns (raw output, questions) like a non-streamed request.
+def stream_quiz(prompt, num_questions, on_question, use_cache=True, accept_cached=None):
+    parser = IncrementalQuizParser()
+    raw_parts = []
+    questions = []
+
+    def emit(parsed):
+        for question in parsed:
+            if len(questions) < num_questions:
+                questions.append(question)
+                on_question(question)
+
+    for delta in stream_completion(prompt, use_cache, accept_cached):
+        raw_parts.append(delta)
+        emit(parser.feed(delta))
+    emit(parser.close())
+    return "".join(raw_parts), questions
+
+# Generate quiz questions using OpenAI
+def generate_quiz(textbook_content, difficulty, num_questions=5):
+    try:
+        prompt = build_quiz_prompt(textbook_content, difficulty, num_questions)
+        return request_completion(prompt)
     except Exception as e:
-        st.error(f"Error generating quiz: {str(e)}")
+        st.error(describe_generation_error(e))
+        return None
+
+# Generate questions in JSON mode: validate each question against the schema, then
+# re-request only as many questions as were invalid (up to JSON_MAX_RETRIES extra calls).
+# A response that isn't JSON at all falls back to the free-text parser.
+def generate_questions_json(textbook_content, difficulty, num_questions, max_retries=None, avoid=None,
+                            accept_cached=None):
+    max_retries = JSON_MAX_RETRIES if max_retries is None else max_retries
+    questions = []
+    raw_outputs = []
+    calls = 0
+    while len(questions) < num_questions and calls <= max_retries:
+        missing = num_questions - len(questions)
+        prompt = build_quiz_prompt(textbook_content, difficulty, missing, json_output=True, avoid=avoid)
+        # Retries bypass the cache, which may hold the very response being retried
+        quiz_output = request_completion(prompt, json_output=True, use_cache=calls == 0 and not avoid,
+                                         accept_cached=accept_cached)
+        raw_outputs.append(quiz_output)
+
+        with timer("quiz_parse", format="json"):
+            parsed = parse_quiz_json(quiz_output)
+        if parsed is None:
+            valid, invalid = parse_quiz(quiz_output), 0
+            generation_stats.record(json_decode_failures=1)
+        else:
+            valid, invalid = parsed
+        generation_stats.record(
+            responses=1,
+            parse_failures=int(len(valid) < missing),
+            invalid_questions=invalid,
+            retry_calls=int(calls > 0)
+        )
+        questions.extend(valid[:missing])
+        calls += 1
+    return "\n".join(raw_outputs), questions
+
+# Count free-text responses that yielded fewer questions than requested
+def record_text_parse(requested, parsed):
+    generation_stats.record(responses=1, parse_failures=int(len(parsed) < requested))
+
+# User-facing description of a failed (sub-)request
+def describe_generation_error(error):
+    if isinstance(error, QuizGenerationError):
+        return str(error)
+    if is_transport_error(error):
+        return f"Network error: {str(error)}"
+    return f"Error generating quiz: {str(error)}"
+
+# Split the textbook content into `parts` slices on paragraph boundaries, one per sub-request
+def split_textbook_content(textbook_content, parts):
+    content = textbook_content[:prompt_budget().content_chars()]
+    if parts <= 1 or not content.strip():
+        return [content]
+    bounds = chunk_bounds(content, math.ceil(len(content) / parts))
+    return [content[start:end] for start, end in bounds] or [content]
+
+# Run the sub-requests concurrently (at most max_concurrency in flight), parsing each as it lands.
+# With on_question, each sub-request is streamed and questions are delivered one by one.
+# Requests that name questions to avoid skip the response cache, which can only hold repeats;
+# accept_cached(text) can turn down other cached responses.
+async def _generate_quiz_batches(contents, difficulty, batch_sizes, max_concurrency, on_question=None, avoid=None,
+                                 accept_cached=None):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run_batch(content, count):
+        async with semaphore:
+            if QUIZ_RESPONSE_FORMAT == "json":
+                quiz_output, questions = await asyncio.to_thread(
+                    generate_questions_json, content, difficulty, count, avoid=avoid, accept_cached=accept_cached
+                )
+                for question in questions if on_question is not None else []:
+                    on_question(question)
+                return quiz_output, questions
+
+            prompt = build_quiz_prompt(content, difficulty, count, avoid=avoid)
+            if on_question is not None:
+                quiz_output, questions = await asyncio.to_thread(
+                    stream_quiz, prompt, count, on_question, not avoid, accept_cached
+                )
+            else:
+                quiz_output = await asyncio.to_thread(
+                    request_completion, prompt, use_cache=not avoid, accept_cached=accept_cached
+                )
+                questions = parse_quiz(quiz_output)[:count]
+        record_text_parse(count, questions)
+        return quiz_output, questions
+
+    return await asyncio.gather(
+        *(run_batch(contents[i % len(contents)], count) for i, count in enumerate(batch_sizes)),
+        return_exceptions=True
+    )
+
+# Generate a quiz as several small concurrent requests and merge the results.
+# Returns (questions, raw output, errors); failed sub-requests only cost their own questions.
+def generate_quiz_batched(textbook_content, difficulty, num_questions=5,
+                          questions_per_request=QUESTIONS_PER_REQUEST, max_concurrency=MAX_CONCURRENT_REQUESTS,
+                          on_question=None, avoid=None, accept_cached=None):
+    # No more questions per request than the output budget can hold
+    questions_per_request = prompt_budget().questions_per_request(max(1, questions_per_request))
+    batch_sizes = [questions_per_request] * (num_questions // questions_per_request)
+    if num_questions % questions_per_request:
+        batch_sizes.append(num_questions % questions_per_request)
+    contents = split_textbook_content(textbook_content, len(batch_sizes))
+
+    results = asyncio.run(_generate_quiz_batches(
+        contents, difficulty, batch_sizes, max(1, max_concurrency), on_question, avoid, accept_cached
+    ))
+
+    questions, raw_outputs, errors = [], [], []
+    for result in results:
+        if isinstance(result, Exception):
+            errors.append(result)
+            continue
+        quiz_output, batch_questions = result
+        raw_outputs.append(quiz_output)
+        questions.extend(batch_questions)
+    return questions, "\n\n".join(raw_outputs), errors
+
+# Checks generated questions against those each learner has already been shown on a topic
+def dedup_index():
+    return get_dedup_index(lambda learner, topic: history_store().questions(learner, topic))
+
+# Questions in a raw response of the configured format (JSON falls back to the free-text parser)
+def parse_quiz_output(quiz_output):
+    if QUIZ_RESPONSE_FORMAT == "json":
+        parsed = parse_quiz_json(quiz_output)
+        if parsed is not None:
+            return parsed[0]
+    return parse_quiz(quiz_output)
+
+# A quiz generated in a background thread. Questions are appended as they are parsed,
+# so the quiz can start on question 1 while the rest are still streaming in.
+# Near-duplicates of questions the learner has already been shown on the topic, or of `seen`
+# (questions shown but not saved yet), are dropped and regenerated.
+class QuizJob:
+    def __init__(self, num_questions, topic, session_id=None, learner=None, seen=()):
+        self.num_questions = num_questions
+        self.topic = topic
+        self.session_id = session_id # Scheduler queue its requests wait in
+        self.learner = learner
+        self.dedup = dedup_index().view(learner, topic, seen)
+        self.difficulty = None
+        self.questions = []
+        self.rejected = []
+        self.raw_output = ""
+        self.errors = []
+        self.done = False
+        self.future = None
+        self._condition = threading.Condition()
+
+    # Run on a dedicated thread, or on a shared executor (which bounds concurrent jobs).
+    # Questions from `banked` (an iterable, e.g. a question bank draw) are taken first, and only
+    # the rest are generated; a job the bank fills completely makes no API calls.
+    def start(self, textbook_content, difficulty, executor=None, banked=()):
+        self.difficulty = difficulty
+        taken = []
+        for question in itertools.islice(banked, self.num_questions * BANK_MAX_CANDIDATES):
+            if len(self.questions) >= self.num_questions:
+                break
+            if self._add_question(question):
+                taken.append(question)
+        if taken:
+            metrics.increment("bank_questions_total", len(taken))
+            self.raw_output = quiz_output(taken)
+        if len(self.questions) >= self.num_questions:
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+            return self
+
+        args = (textbook_content, difficulty)
+        if executor is not None:
+            self.future = executor.submit(self._run, *args)
+        else:
+            threading.Thread(target=self._run, args=args, daemon=True).start()
+        return self
+
+    # Drop a job that is still queued on its executor
+    def cancel(self):
+        if self.future is not None and self.future.cancel():
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    # Returns whether the question was taken
+    def _add_question(self, question):
+        with self._condition:
+            if len(self.questions) >= self.num_questions:
+                return False
+            with timer("dedup_check"):
+                unique = self.dedup.check_and_add(question)
+            if not unique:
+                self.rejected.append(question)
+                metrics.increment("dedup_rejected_total")
+                return False
+            self.questions.append(question)
+            self._condition.notify_all()
+            return True
+
+    # Serve a cached response only if it isn't mostly questions the learner has already seen
+    def accept_cached(self, quiz_output):
+        questions = parse_quiz_output(quiz_output)
+        return self.dedup.repeats(questions) <= len(questions) * CACHED_REPEAT_SHARE
+
+    def _run(self, textbook_content, difficulty):
+        if self.session_id is not None:
+            current_session.set(self.session_id) # Inherited by the sub-request threads
+        try:
+            raw_outputs = [self.raw_output]
+            avoid = None
+            for _ in range(DEDUP_MAX_RETRIES + 1):
+                rejected = len(self.rejected)
+                _, raw_output, errors = generate_quiz_batched(
+                    textbook_content, difficulty, self.num_questions - len(self.questions),
+                    on_question=self._add_question, avoid=avoid, accept_cached=self.accept_cached
+                )
+                raw_outputs.append(raw_output)
+                self.errors.extend(errors)
+                # Regenerate only the questions dropped as near-duplicates, naming them so they
+                # aren't repeated; short or failed responses are not retried here
+                if errors or len(self.rejected) == rejected or len(self.questions) >= self.num_questions:
+                    break
+                avoid = [question["question"] for question in self.rejected]
+            self.raw_output = "\n\n".join(output for output in raw_outputs if output)
+        except Exception as e:
+            self.errors.append(e)
+        finally:
+            for error in self.errors:
+                log_event(log, logging.WARNING, "generation_failed", error=describe_generation_error(error))
+            with self._condition:
+                self.done = True
+                self._condition.notify_all()
+
+    # Block until at least `count` questions exist or generation has finished
+    def wait_for(self, count, timeout=None):
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.questions) >= count or self.done, timeout)
+            return len(self.questions) >= count
+
+# Poll the background job while the student waits for the next question to arrive
+@st.fragment(run_every=1)
+def wait_for_next_question(job, available):
+    if len(job.questions) > available or job.done:
+        st.rerun()
+    st.info(queue_status("⏳ Generating the next question..."))
+
+# Where this session's next request stands in the shared request queue, else `message`
+def queue_status(message):
+    position = get_scheduler().queue_position(st.session_state.session_id)
+    if position:
+        return f"⏳ Waiting for the API: {position} request{'s' if position != 1 else ''} from other sessions ahead of yours..."
+    return message
+
+# Identity of an upload across reruns
+def upload_id(uploaded_file):
+    if uploaded_file is None:
         return None
+    return getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+
+@st.cache_resource
+def get_ingest_pool():
+    return ThreadPoolExecutor(max_workers=max(1, INGEST_WORKERS), thread_name_prefix="ingest")
+
+# Background ingestion per document id: running ones, and failed ones so they are reported
+# rather than retried on every rerun (successful ones are forgotten)
+@st.cache_resource
+def get_ingest_jobs():
+    return {}
+
+# Extract, index and outline one spilled document
+def ingest_document(doc_id):
+    store = get_document_store()
+    try:
+        # Extraction (on the first upload of a file) is timed apart from building its index
+        with timer("pdf_extraction", mode="full"):
+            pages = store.pages(doc_id)
+        with timer("chunk_index"):
+            get_chunk_index(doc_id, lambda: pages)
+        store.outline(doc_id)
+    except Exception:
+        log.exception("document_ingest_failed")
+        raise
+
+# Start ingesting documents in the background, unless they already are
+def ingest_documents(doc_ids):
+    jobs = get_ingest_jobs()
+    for doc_id in doc_ids:
+        if doc_id in jobs:
+            continue
+        job = jobs[doc_id] = get_ingest_pool().submit(ingest_document, doc_id)
+
+        def forget(job, doc_id=doc_id):
+            if job.exception() is None and jobs.get(doc_id) is job:
+                jobs.pop(doc_id, None)
+        job.add_done_callback(forget)
+
+# Whether any of the documents is still being ingested
+def ingest_pending(doc_ids):
+    jobs = get_ingest_jobs()
+    return any(not jobs[doc_id].done() for doc_id in doc_ids if doc_id in jobs)
+
+# Block until the documents' ingestion finished (failures were logged by the job)
+def wait_for_ingest(doc_ids):
+    jobs = get_ingest_jobs()
+    futures = [jobs[doc_id] for doc_id in doc_ids if doc_id in jobs]
+    if futures:
+        wait(futures)
+
+# Documents whose ingestion failed
+def ingest_failed(doc_ids):
+    jobs = get_ingest_jobs()
+    return {doc_id for doc_id in doc_ids if doc_id in jobs and jobs[doc_id].done() and jobs[doc_id].exception()}
+
+# Spill new uploads to the document store and start ingesting them in the background; session
+# state only keeps {upload_id, doc_id} per upload, and uploads removed from the widget (or that
+# could not be read) release their documents. Returns (document ids in upload order, error messages).
+def current_document_ids(uploaded_files):
+    store = get_document_store()
+    session_id = st.session_state.session_id
+    known = {
+        document["upload_id"]: document["doc_id"] for document in st.session_state.documents
+        if store.exists(document["doc_id"])
+    }
+    uploads = {upload_id(uploaded_file): uploaded_file for uploaded_file in uploaded_files or []}
+    new_uploads = [(key, uploaded_file) for key, uploaded_file in uploads.items() if key not in known]
+    keep = {doc_id for key, doc_id in known.items() if key in uploads}
+    errors = []
+
+    def add(item):
+        key, uploaded_file = item
+        try:
+            return key, store.add(uploaded_file, session_id, keep=keep)
+        except DocumentTooLargeError as e:
+            errors.append(f"{uploaded_file.name}: {e}")
+            return key, None
+
+    if new_uploads:
+        with st.spinner(f"Saving {len(new_uploads)} document{'s' if len(new_uploads) != 1 else ''}..."):
+            with ThreadPoolExecutor(max_workers=max(1, min(INGEST_WORKERS, len(new_uploads)))) as executor:
+                known.update({key: doc_id for key, doc_id in executor.map(add, new_uploads) if doc_id})
+        ingest_documents(list(dict.fromkeys(known.values())))
+
+    failed = ingest_failed(known.values())
+    for key in uploads:
+        if known.get(key) in failed:
+            errors.append(f"{uploads[key].name}: could not be read")
+    documents = [
+        {"upload_id": key, "doc_id": known[key]} for key in uploads if key in known and known[key] not in failed
+    ]
+    in_use = {document["doc_id"] for document in documents}
+    for document in st.session_state.documents:
+        if document["doc_id"] not in in_use:
+            store.release(session_id, document["doc_id"])
+    for doc_id in in_use:
+        store.touch(doc_id)
+    st.session_state.documents = documents
+    return list(dict.fromkeys(document["doc_id"] for document in documents)), errors
+
+# Reset the session for a new quiz driven by `job`
+def start_quiz(job):
+    st.session_state.quiz_job = job
+    st.session_state.current_topic = job.topic
+    st.session_state.current_difficulty = job.difficulty
+    st.session_state.quiz_questions = job.questions # Grows while the job streams
+    st.session_state.raw_quiz_output = "" # Taken from the job once it finishes
+    st.session_state.current_q_index = 0
+    st.session_state.user_answers = {}
+    st.session_state.attempts_left = 3
+    st.session_state.current_q_answered = False
+    st.session_state.quiz_started = True
+    st.session_state.quiz_complete = False
+    st.session_state.feedback_given = False
+
+# --- Background Pre-generation ---
+# Worker pool shared by all sessions, so pre-generation can't flood the API
+@st.cache_resource
+def get_pregeneration_pool():
+    return ThreadPoolExecutor(max_workers=PREGENERATE_WORKERS, thread_name_prefix="pregenerate")
+
+# Identity of the sidebar selection; queued quizzes are only valid for the same one
+def quiz_source_key(uploaded_files, difficulty, num_questions, focus_topic, page_range, chapter):
+    upload_ids = tuple(upload_id(uploaded_file) for uploaded_file in uploaded_files or [])
+    return (upload_ids, difficulty, num_questions, focus_topic, page_range, chapter and chapter["label"])
+
+# Drop queued quizzes generated for a different document or settings
+def drop_stale_pregenerated(source_key):
+    buffer = st.session_state.pregenerated
+    for entry in [entry for entry in buffer if entry["key"] != source_key]:
+        entry["job"].cancel()
+        buffer.remove(entry)
+
+# Top up this session's queue once the current quiz has finished generating. One job at a
+# time, so each queued quiz avoids the questions of the current one and of those queued before it.
+# Content is selected afresh for every job, so a quiz on the whole course (or a chapter or page
+# range) samples another part of it; adaptive quizzes also re-pick their chapter and level from
+# the learner model as it stands now.
+def refill_pregenerated():
+    source = st.session_state.quiz_source
+    job = st.session_state.quiz_job
+    buffer = st.session_state.pregenerated
+    if source is None or job is None or not job.done or len(buffer) >= PREGENERATE_BUFFER:
+        return
+    if any(not entry["job"].done for entry in buffer):
+        return
+    difficulty, chapter = source["difficulty"], source["chapter"]
+    if difficulty == ADAPTIVE and source["adaptive_chapters"]:
+        chapter = adaptive_chapter(st.session_state.learner_id, source["adaptive_chapters"])
+    text, topic = select_course_content(source["doc_ids"], source["focus"], source["page_range"], chapter)
+    if not text.strip():
+        return
+    if difficulty == ADAPTIVE:
+        difficulty = learner_model().recommend_difficulty(st.session_state.learner_id, topic)
+    banked = bank_candidates(source["doc_ids"], difficulty, source["focus"], source["page_range"], chapter)
+    seen = list(job.questions) + [question for entry in buffer for question in entry["job"].questions]
+    next_job = QuizJob(source["num_questions"], topic, PREGENERATE_QUEUE, st.session_state.learner_id, seen).start(
+        text, difficulty, executor=get_pregeneration_pool(), banked=banked
+    )
+    buffer.append({"key": source["key"], "job": next_job})
+
+# Next queued quiz for this selection that produced questions, or None. `accept` can reject
+# a queued quiz that no longer fits (e.g. adaptive mode would now pick something else). One
+# that has no question within PREGENERATE_TAKE_TIMEOUT (e.g. still waiting in the request
+# queue) is dropped too, so the click never blocks the script on it; the caller generates a
+# fresh quiz instead, showing where it stands in the queue.
+def take_pregenerated(source_key, accept=None):
+    buffer = st.session_state.pregenerated
+    while buffer:
+        entry = buffer.popleft()
+        if (entry["key"] == source_key and (accept is None or accept(entry["job"]))
+                and entry["job"].wait_for(1, timeout=PREGENERATE_TAKE_TIMEOUT)):
+            return entry["job"]
+        entry["job"].cancel()
+    return None
+# --- End Background Pre-generation ---
+
+# --- Quiz Views ---
+# The question and report views are fragments: a click inside one re-runs only that view, not
+# the sidebar, uploads and the rest of the script. Answers are recorded in button callbacks, so
+# the single re-run that follows a click already shows its outcome.
+
+# Keep the next quiz for this selection generating while the current one is taken
+def keep_pregenerating(source_key):
+    if st.session_state.quiz_source and st.session_state.quiz_source["key"] == source_key:
+        refill_pregenerated()
+
+# Record an answer to the current question (option button callback)
+def answer_question(option_key):
+    q_idx = st.session_state.current_q_index
+    q_data = st.session_state.quiz_questions[q_idx]
+    is_correct = (option_key == q_data["answer"])
+    attempts = 4 - st.session_state.attempts_left # Tries used, including this one
+    st.session_state.user_answers[q_idx] = {"selected": option_key, "correct": is_correct, "attempts": attempts}
+    if is_correct:
+        st.session_state.current_q_answered = True
+    else:
+        st.session_state.attempts_left -= 1
+        if st.session_state.attempts_left <= 0:
+            st.session_state.current_q_answered = True
+
+# Move on to the next question ("Next Question" callback)
+def next_question():
+    st.session_state.current_q_index += 1
+    st.session_state.attempts_left = 3 # Reset attempts for next question
+    st.session_state.current_q_answered = False # Reset answered status
+
+# The current question, its options and feedback, and the way on to the next question or results
+@st.fragment
+@run_timer("quiz_view", view="question")
+def quiz_question_view(source_key):
+    # The current quiz may have finished generating since the last run
+    keep_pregenerating(source_key)
+
+    # While the job is still streaming, count the questions it was asked for
+    job = st.session_state.quiz_job
+    total_questions = len(st.session_state.quiz_questions)
+    if job is not None and not job.done:
+        total_questions = max(total_questions, job.num_questions)
+
+    # Progress bar for quiz
+    progress = (st.session_state.current_q_index + 1) / total_questions
+    st.progress(progress)
+
+    # Question counter with emoji
+    st.markdown(f"### 📝 Question {st.session_state.current_q_index + 1} of {total_questions}")
+
+    # Current topic display
+    st.caption(f"Topic: {st.session_state.current_topic} · {st.session_state.current_difficulty}")
+
+    # Question display with better formatting
+    q_idx = st.session_state.current_q_index
+    q_data = st.session_state.quiz_questions[q_idx]
+
+    st.markdown(f"**{q_data['question']}**")
+    st.divider()
+
+    # Add CSS to ensure uniform button sizes
+    st.markdown("""
+        <style>
+        .stButton button {
+            width: 100%;
+            min-height: 80px;
+            white-space: normal;
+            height: auto;
+            text-align: left;
+            padding: 15px;
+        }
+        </style>
+        """, unsafe_allow_html=True)
+
+    # Create placeholder for feedback message
+    feedback_placeholder = st.empty()
+
+    # Display Options as Buttons
+    option_cols = st.columns(2) # Arrange options in 2 columns
+    for i, option_key in enumerate(q_data["options"]):
+        # Format option text with consistent padding
+        option_text = f"{option_key}. {q_data['options'][option_key]}"
+        option_cols[i % 2].button(
+            option_text,
+            key=f"q{q_idx}_opt{option_key}",
+            disabled=st.session_state.current_q_answered,
+            on_click=answer_question,
+            args=(option_key,)
+        )
+
+    # --- Display Feedback Message ---
+    if st.session_state.user_answers.get(q_idx):
+        last_answer_info = st.session_state.user_answers[q_idx]
+        if last_answer_info["correct"]:
+            feedback_placeholder.success(f"✅ Correct! The answer is {q_data['answer']}.")
+        elif st.session_state.attempts_left <= 0:
+            feedback_placeholder.error(f"❌ Incorrect. No attempts left. The correct answer was {q_data['answer']}.")
+        elif not st.session_state.current_q_answered:
+            feedback_placeholder.warning(f"❌ Incorrect. You have {st.session_state.attempts_left} attempt{'s' if st.session_state.attempts_left > 1 else ''} remaining. Try again!")
+
+    # --- Next Question Button ---
+    if st.session_state.current_q_answered:
+        st.write("---")  # Add a separator
+        if q_idx < len(st.session_state.quiz_questions) - 1:
+            col1, col2 = st.columns([1, 5])
+            col1.button("Next Question →", key=f"next_q{q_idx}", on_click=next_question)
+            col2.write("") # Empty column for spacing
+        elif job is not None and not job.done:
+            wait_for_next_question(job, len(st.session_state.quiz_questions))
+        else:
+            # Some sub-requests failed: the quiz is shorter than requested
+            if job is not None and job.errors and len(st.session_state.quiz_questions) < job.num_questions:
+                st.warning(
+                    f"Only {len(st.session_state.quiz_questions)} of {job.num_questions} questions could be generated "
+                    f"({describe_generation_error(job.errors[0])})."
+                )
+            col1, col2 = st.columns([1, 5])
+            if col1.button("Show Results 🎯", key=f"finish_q{q_idx}"):
+                st.session_state.quiz_complete = True
+                if job is not None:
+                    st.session_state.raw_quiz_output = job.raw_output
+                # Save the successful quiz to history NOW, before showing report
+                if st.session_state.raw_quiz_output:
+                    save_quiz_to_history(
+                        st.session_state.raw_quiz_output,
+                        st.session_state.current_topic,
+                        st.session_state.current_difficulty,
+                        questions=st.session_state.quiz_questions,
+                        user_answers=st.session_state.user_answers,
+                        learner=st.session_state.learner_id
+                    )
+                    st.session_state.raw_quiz_output = "" # Clear after saving
+                st.rerun() # The report replaces this view
+            col2.write("") # Empty column for spacing
+
+# Score, answers and explanations of the finished quiz. `selection` is the sidebar's
+# (difficulty, chapter, focus topic, page range, chapters), for starting the next quiz.
+@st.fragment
+@run_timer("quiz_view", view="report")
+def quiz_report_view(source_key, selection):
+    st.subheader("📊 Quiz Report")
+    correct_count = 0
+    total_questions = len(st.session_state.quiz_questions)
+
+    for idx, q_data in enumerate(st.session_state.quiz_questions):
+        st.divider()
+        st.write(f"**Question {idx + 1}:** {q_data['question']}")
+        user_answer_info = st.session_state.user_answers.get(idx)
+
+        if user_answer_info:
+            user_selected = user_answer_info['selected']
+            is_correct = user_answer_info['correct']
+
+            # Display options with correct/incorrect indicators
+            st.write("**Options:**")
+            for key, value in q_data['options'].items():
+                prefix = f"{key}. {value}"
+                if key == q_data['answer'] and key == user_selected:
+                    st.success(f"✅ {prefix} (Your correct answer)")
+                elif key == q_data['answer']:
+                    st.success(f"✅ {prefix} (Correct answer)")
+                elif key == user_selected:
+                    st.error(f"❌ {prefix} (Your answer)")
+                else:
+                    st.write(f"   {prefix}")
+
+            # Update score and show explanation
+            if is_correct:
+                correct_count += 1
+
+            # Always show explanation in report
+            st.info(f"**Explanation:** {q_data['explanation']}")
+        else:
+            st.warning("Answer not recorded for this question.")
+
+    # Display final score with percentage
+    st.divider()
+    score_percentage = (correct_count / total_questions) * 100
+    st.header(f"Final Score: {correct_count} out of {total_questions} ({score_percentage:.1f}%)")
+
+    # Add score-based feedback
+    if score_percentage == 100:
+        st.balloons()
+        st.success("🌟 Perfect score! Outstanding work!")
+    elif score_percentage >= 80:
+        st.success("🎉 Great job! You've shown excellent understanding!")
+    elif score_percentage >= 60:
+        st.info("👍 Good effort! Keep practicing to improve further.")
+    else:
+        st.warning("📚 Keep studying! Review the explanations to better understand the topics.")
+
+    # --- Feedback --- (Only if not already given)
+    if not st.session_state.feedback_given:
+        st.divider()
+        st.subheader("Was this quiz helpful?")
+        feedback = st.radio("Your feedback", ("👍 Yes", "👎 No"), key="final_feedback", index=None)
+        if feedback == "👍 Yes":
+            st.success("Glad it was helpful! The agent will continue learning.")
+            st.session_state.feedback_given = True
+        elif feedback == "👎 No":
+            st.warning("Thank you for the feedback! We'll use this to improve future quizzes.")
+            st.session_state.feedback_given = True
+    else:
+         st.write("Thank you for your feedback!")
+
+    # Allow starting over
+    st.divider()
+    if st.button("Start New Quiz with Same PDF"): # Re-generate with same text
+         # Use the quiz pre-generated in the background if there is one
+         _, _, accept = adaptive_selection(st.session_state.learner_id, *selection)
+         pregenerated_job = take_pregenerated(source_key, accept)
+         if pregenerated_job:
+             start_quiz(pregenerated_job)
+             st.rerun()
+         st.session_state.quiz_started = False
+         st.session_state.quiz_complete = False
+         st.session_state.quiz_questions = []
+         st.session_state.quiz_job = None
+         st.session_state.user_answers = {}
+         st.warning("Quiz reset. Click 'Generate New Quiz' in the sidebar to start again with the current settings.")
+         st.rerun()
+# --- End Quiz Views ---
 
 # Main Streamlit app
 def main():
@@ -348,6 +1354,15 @@ def main():
     st.write("Upload your textbook PDF, select difficulty, and get an interactive quiz!")
 
     # --- Initialize Session State --- (if keys don't exist)
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+    if 'learner_id' not in st.session_state:
+        # Whose history, dedup index and ratings this session uses; kept in the URL so a reload
+        # or bookmark carries on as the same learner
+        st.session_state.learner_id = st.query_params.get("learner") or uuid.uuid4().hex
+        st.query_params["learner"] = st.session_state.learner_id
+    if 'documents' not in st.session_state:
+        st.session_state.documents = [] # {"upload_id", "doc_id"} per spilled upload
     if 'quiz_started' not in st.session_state:
         st.session_state.quiz_started = False
     if 'quiz_complete' not in st.session_state:
@@ -369,7 +1384,15 @@ def main():
     if 'current_topic' not in st.session_state:
         st.session_state.current_topic = "General"
     if 'current_difficulty' not in st.session_state:
-        st.session_state.current_difficulty = "Beginner"
+        st.session_state.current_difficulty = "Beginner" # Level the current quiz uses
+    if 'selected_difficulty' not in st.session_state:
+        st.session_state.selected_difficulty = "Beginner" # Option chosen in the sidebar, e.g. Adaptive
+    if 'quiz_job' not in st.session_state:
+        st.session_state.quiz_job = None
+    if 'quiz_source' not in st.session_state:
+        st.session_state.quiz_source = None
+    if 'pregenerated' not in st.session_state:
+        st.session_state.pregenerated = deque()
     # --- End Session State Init ---
 
     # --- Sidebar for Controls ---
@@ -378,16 +1401,21 @@ def main():
         
         # File upload with better instructions
         st.markdown("### 1. Upload Your Material")
-        uploaded_file = st.file_uploader(
-            "Choose a PDF textbook",
+        uploaded_files = st.file_uploader(
+            "Choose PDF textbooks",
             type=["pdf"],
-            help="Upload a PDF file containing the study material",
+            accept_multiple_files=True,
+            help="Upload one textbook, or several PDFs of a course pack to quiz on them together",
             key="pdf_uploader"
         )
+        doc_ids, upload_errors = current_document_ids(uploaded_files)
+        for error in upload_errors:
+            st.error(error)
 
         # Difficulty selection with descriptions
         st.markdown("### 2. Select Difficulty")
         difficulty_descriptions = {
+            ADAPTIVE: "Picked from your results on each topic; practises your weakest chapter",
             "Beginner": "Basic concepts and definitions",
             "Intermediate": "Application and connections",
             "Advanced": "Deep analysis and synthesis"
@@ -395,51 +1423,122 @@ def main():
         
         difficulty = st.selectbox(
             "Choose your level",
-            ["Beginner", "Intermediate", "Advanced"],
-            index=["Beginner", "Intermediate", "Advanced"].index(st.session_state.current_difficulty),
+            DIFFICULTY_OPTIONS,
+            index=DIFFICULTY_OPTIONS.index(st.session_state.selected_difficulty),
             help="Select the difficulty level that matches your current understanding",
             key="difficulty_selector"
         )
         
         st.caption(f"*{difficulty_descriptions[difficulty]}*")
 
+        num_questions = st.slider(
+            "Number of questions",
+            min_value=5,
+            max_value=15,
+            value=5,
+            help="Larger quizzes are generated as several smaller requests in parallel",
+            key="num_questions"
+        )
+
+        # Optional focus: quiz on one chapter or on matching sections instead of a sample of the course
+        st.markdown("### 3. Focus (Optional)")
+        indexing = bool(doc_ids) and ingest_pending(doc_ids)
+        chapters = course_chapters(doc_ids) if doc_ids and not indexing else []
+        if indexing:
+            st.caption("*Indexing the upload: chapters appear once it is done, and a focused quiz waits for it*")
+        chapter = None
+        if chapters:
+            chapter = st.selectbox(
+                "Chapter",
+                [None] + chapters,
+                format_func=lambda option: option["label"] if option else "Whole course (sampled proportionally)",
+                help="Chapters come from the PDF bookmarks, or from chapter headings when there are none",
+                key="focus_chapter"
+            )
+        focus_topic = st.text_input(
+            "Topic or keywords",
+            help="Quiz on the sections of the textbook that best match these keywords",
+            key="focus_topic"
+        ).strip()
+        focus_pages = st.text_input(
+            "Page range",
+            placeholder="e.g. 120-180",
+            help="Only use these pages of each textbook (ignored when a chapter is chosen)",
+            key="focus_pages"
+        )
+        page_range = parse_page_range(focus_pages)
+        if focus_pages.strip() and not page_range:
+            st.caption("*Page range not recognised, using the whole textbook*")
+
+        # Queued quizzes for another document or settings are useless now
+        source_key = quiz_source_key(uploaded_files, difficulty, num_questions, focus_topic, page_range, chapter)
+        drop_stale_pregenerated(source_key)
+
         # Generate button with clear styling
-        st.markdown("### 3. Generate Quiz")
+        st.markdown("### 4. Generate Quiz")
         if st.button("🎯 Generate New Quiz", use_container_width=True):
-            if uploaded_file:
+            st.session_state.selected_difficulty = difficulty
+            chapter, adaptive_chapters, accept = adaptive_selection(
+                st.session_state.learner_id, difficulty, chapter, focus_topic, page_range, chapters
+            )
+
+            # A quiz pre-generated for exactly this selection starts instantly
+            pregenerated_job = take_pregenerated(source_key, accept) if doc_ids else None
+            if pregenerated_job:
+                start_quiz(pregenerated_job)
+                st.rerun()
+            elif doc_ids:
                 with st.spinner("Processing PDF..."):
-                    textbook_text = extract_text_from_pdf(uploaded_file)
+                    textbook_text, topic = select_course_content(doc_ids, focus_topic, page_range, chapter)
 
                     if textbook_text.strip():
-                        topic = textbook_text.split("\n")[0][:50].strip() if textbook_text else "General"
                         st.session_state.current_topic = topic
-                        st.session_state.current_difficulty = difficulty # Store selected difficulty
-                        quiz_history = load_quiz_history()
+                        if difficulty == ADAPTIVE:
+                            level = learner_model().recommend_difficulty(st.session_state.learner_id, topic)
+                        else:
+                            level = difficulty
+                        st.session_state.current_difficulty = level # Store the level actually used
 
                         with st.spinner("Generating quiz with AI..."):
-                            quiz_output = generate_quiz(textbook_text, quiz_history, difficulty, topic)
-
-                            if quiz_output:
-                                st.session_state.raw_quiz_output = quiz_output # Save raw for history
-                                parsed_questions = parse_quiz(quiz_output)
-                                if parsed_questions:
-                                    # --- Reset State for New Quiz ---
-                                    st.session_state.quiz_questions = parsed_questions
-                                    st.session_state.current_q_index = 0
-                                    st.session_state.user_answers = {}
-                                    st.session_state.attempts_left = 3
-                                    st.session_state.current_q_answered = False
-                                    st.session_state.quiz_started = True
-                                    st.session_state.quiz_complete = False
-                                    st.session_state.feedback_given = False
-                                    st.rerun() # Rerun to display the first question
-                                else:
-                                    st.error("Failed to parse the generated quiz. The format might be unexpected. Please try again.")
-                                    # --- Show the raw output for debugging ---
-                                    st.subheader("Raw AI Output (for debugging):")
-                                    st.text_area("Output", quiz_output, height=300)
-                                    # --- End debug display ---
-                                    st.session_state.quiz_started = False # Ensure quiz doesn't start
+                            # Generation carries on in the background; the quiz starts once question 1 is parsed
+                            # Banked questions first; only what the bank can't cover is generated
+                            banked = bank_candidates(doc_ids, level, focus_topic, page_range, chapter)
+                            job = QuizJob(num_questions, topic, st.session_state.session_id, st.session_state.learner_id).start(
+                                textbook_text, level, banked=banked
+                            )
+                            status = st.empty()
+                            while not job.wait_for(1, timeout=0.5) and not job.done:
+                                status.info(queue_status("⏳ Generating the first question..."))
+                            status.empty()
+
+                            if job.questions:
+                                # --- Reset State for New Quiz ---
+                                start_quiz(job)
+                                # Remembered so the next quiz can be pre-generated in the background
+                                st.session_state.quiz_source = {
+                                    "key": source_key,
+                                    "difficulty": difficulty,
+                                    "num_questions": num_questions,
+                                    "doc_ids": doc_ids,
+                                    "focus": focus_topic,
+                                    "page_range": page_range,
+                                    "chapter": chapter,
+                                    "adaptive_chapters": adaptive_chapters
+                                }
+                                st.rerun() # Rerun to display the first question
+                            elif job.rejected:
+                                st.warning("Every generated question repeated one you've already answered on this topic. Try another chapter or focus.")
+                                st.session_state.quiz_started = False
+                            elif job.raw_output:
+                                st.error("Failed to parse the generated quiz. The format might be unexpected. Please try again.")
+                                # --- Show the raw output for debugging ---
+                                st.subheader("Raw AI Output (for debugging):")
+                                st.text_area("Output", job.raw_output, height=300)
+                                # --- End debug display ---
+                                st.session_state.quiz_started = False # Ensure quiz doesn't start
+                            elif job.errors:
+                                st.error(f"AI failed to generate quiz: {describe_generation_error(job.errors[0])}")
+                                st.session_state.quiz_started = False
                             else:
                                 st.error("AI failed to generate quiz. Please check logs or API key and try again.")
                                 st.session_state.quiz_started = False
@@ -449,6 +1548,24 @@ def main():
             else:
                 st.warning("Please upload a PDF first.")
 
+        # How often responses fail to parse, and what JSON-mode retries cost (whole process)
+        with st.expander("📈 Generation stats"):
+            stats = generation_stats.snapshot()
+            st.caption(
+                f"Format: {QUIZ_RESPONSE_FORMAT} · Responses: {stats['responses']} · "
+                f"Parse failures: {stats['parse_failures']} ({stats['parse_failure_rate']:.0%}) · "
+                f"Invalid questions: {stats['invalid_questions']} · Retry calls: {stats['retry_calls']}"
+            )
+            # Mean time per instrumented step in this process
+            timings = metrics.snapshot()["histograms"]
+            if timings:
+                st.caption(" · ".join(
+                    f"{name.replace('_seconds', '')}: {timing['mean'] * 1000:.0f} ms ×{timing['count']}"
+                    for name, timing in timings.items()
+                ))
+
+    keep_pregenerating(source_key)
+
     # --- Main Quiz Area ---
     if not st.session_state.quiz_started:
         # Welcome screen with instructions
@@ -480,180 +1597,15 @@ def main():
             """)
 
     elif st.session_state.quiz_started and not st.session_state.quiz_complete:
-        # Progress bar for quiz
-        progress = (st.session_state.current_q_index + 1) / len(st.session_state.quiz_questions)
-        st.progress(progress)
-        
-        # Question counter with emoji
-        st.markdown(f"### 📝 Question {st.session_state.current_q_index + 1} of {len(st.session_state.quiz_questions)}")
-        
-        # Current topic display
-        st.caption(f"Topic: {st.session_state.current_topic}")
-        
-        # Question display with better formatting
-        q_idx = st.session_state.current_q_index
-        q_data = st.session_state.quiz_questions[q_idx]
-        
-        st.markdown(f"**{q_data['question']}**")
-        st.divider()
-
-        # Add CSS to ensure uniform button sizes
-        st.markdown("""
-            <style>
-            .stButton button {
-                width: 100%;
-                min-height: 80px;
-                white-space: normal;
-                height: auto;
-                text-align: left;
-                padding: 15px;
-            }
-            </style>
-            """, unsafe_allow_html=True)
-
-        # Create placeholder for feedback message
-        feedback_placeholder = st.empty()
-
-        # Display Options as Buttons
-        option_cols = st.columns(2) # Arrange options in 2 columns
-        option_keys = list(q_data["options"].keys())
-        
-        # Calculate max option length for consistent sizing
-        max_option_length = max(len(str(opt)) for opt in q_data["options"].values())
-        
-        for i, option_key in enumerate(option_keys):
-            col = option_cols[i % 2]
-            button_disabled = st.session_state.current_q_answered
-            
-            # Format option text with consistent padding
-            option_text = f"{option_key}. {q_data['options'][option_key]}"
-            
-            if col.button(option_text, key=f"q{q_idx}_opt{option_key}", disabled=button_disabled):
-                # --- Answer Submitted --- 
-                is_correct = (option_key == q_data["answer"])
-                st.session_state.user_answers[q_idx] = {"selected": option_key, "correct": is_correct}
-
-                if is_correct:
-                    feedback_placeholder.success(f"✅ Correct! The answer is {q_data['answer']}.")
-                    st.session_state.current_q_answered = True
-                else:
-                    st.session_state.attempts_left -= 1
-                    if st.session_state.attempts_left > 0:
-                        feedback_placeholder.warning(f"❌ Incorrect. You have {st.session_state.attempts_left} attempt{'s' if st.session_state.attempts_left > 1 else ''} remaining. Try again!")
-                    else:
-                        feedback_placeholder.error(f"❌ Incorrect. No attempts left. The correct answer was {q_data['answer']}.")
-                        st.session_state.current_q_answered = True
-                st.rerun()
-
-        # --- Display Persistent Feedback Message ---
-        if st.session_state.user_answers.get(q_idx):
-            last_answer_info = st.session_state.user_answers[q_idx]
-            if last_answer_info["correct"]:
-                feedback_placeholder.success(f"✅ Correct! The answer is {q_data['answer']}.")
-            elif st.session_state.attempts_left <= 0:
-                feedback_placeholder.error(f"❌ Incorrect. No attempts left. The correct answer was {q_data['answer']}.")
-            elif not st.session_state.current_q_answered:
-                feedback_placeholder.warning(f"❌ Incorrect. You have {st.session_state.attempts_left} attempt{'s' if st.session_state.attempts_left > 1 else ''} remaining. Try again!")
-
-        # --- Next Question Button --- 
-        if st.session_state.current_q_answered:
-            st.write("---")  # Add a separator
-            if q_idx < len(st.session_state.quiz_questions) - 1:
-                col1, col2 = st.columns([1, 5])
-                if col1.button("Next Question →", key=f"next_q{q_idx}"):
-                    st.session_state.current_q_index += 1
-                    st.session_state.attempts_left = 3 # Reset attempts for next question
-                    st.session_state.current_q_answered = False # Reset answered status
-                    st.rerun()
-                col2.write("") # Empty column for spacing
-            else:
-                col1, col2 = st.columns([1, 5])
-                if col1.button("Show Results 🎯", key=f"finish_q{q_idx}"):
-                    st.session_state.quiz_complete = True
-                    # Save the successful quiz to history NOW, before showing report
-                    if st.session_state.raw_quiz_output:
-                        save_quiz_to_history(st.session_state.raw_quiz_output, st.session_state.current_topic, st.session_state.current_difficulty)
-                        st.session_state.raw_quiz_output = "" # Clear after saving
-                    st.rerun()
-                col2.write("") # Empty column for spacing
+        quiz_question_view(source_key)
 
     # --- Quiz Complete / Report Area --- 
     elif st.session_state.quiz_complete:
-        st.subheader("📊 Quiz Report")
-        correct_count = 0
-        total_questions = len(st.session_state.quiz_questions)
-
-        for idx, q_data in enumerate(st.session_state.quiz_questions):
-            st.divider()
-            st.write(f"**Question {idx + 1}:** {q_data['question']}")
-            user_answer_info = st.session_state.user_answers.get(idx)
-
-            if user_answer_info:
-                user_selected = user_answer_info['selected']
-                is_correct = user_answer_info['correct']
-
-                # Display options with correct/incorrect indicators
-                st.write("**Options:**")
-                for key, value in q_data['options'].items():
-                    prefix = f"{key}. {value}"
-                    if key == q_data['answer'] and key == user_selected:
-                        st.success(f"✅ {prefix} (Your correct answer)")
-                    elif key == q_data['answer']:
-                        st.success(f"✅ {prefix} (Correct answer)")
-                    elif key == user_selected:
-                        st.error(f"❌ {prefix} (Your answer)")
-                    else:
-                        st.write(f"   {prefix}")
-
-                # Update score and show explanation
-                if is_correct:
-                    correct_count += 1
-                
-                # Always show explanation in report
-                st.info(f"**Explanation:** {q_data['explanation']}")
-            else:
-                st.warning("Answer not recorded for this question.")
-
-        # Display final score with percentage
-        st.divider()
-        score_percentage = (correct_count / total_questions) * 100
-        st.header(f"Final Score: {correct_count} out of {total_questions} ({score_percentage:.1f}%)")
-
-        # Add score-based feedback
-        if score_percentage == 100:
-            st.balloons()
-            st.success("🌟 Perfect score! Outstanding work!")
-        elif score_percentage >= 80:
-            st.success("🎉 Great job! You've shown excellent understanding!")
-        elif score_percentage >= 60:
-            st.info("👍 Good effort! Keep practicing to improve further.")
-        else:
-            st.warning("📚 Keep studying! Review the explanations to better understand the topics.")
-
-        # --- Feedback --- (Only if not already given)
-        if not st.session_state.feedback_given:
-            st.divider()
-            st.subheader("Was this quiz helpful?")
-            feedback = st.radio("Your feedback", ("👍 Yes", "👎 No"), key="final_feedback", index=None)
-            if feedback == "👍 Yes":
-                st.success("Glad it was helpful! The agent will continue learning.")
-                st.session_state.feedback_given = True
-            elif feedback == "👎 No":
-                st.warning("Thank you for the feedback! We'll use this to improve future quizzes.")
-                st.session_state.feedback_given = True
-        else:
-             st.write("Thank you for your feedback!")
-
-        # Allow starting over
-        st.divider()
-        if st.button("Start New Quiz with Same PDF"): # Re-generate with same text
-             st.session_state.quiz_started = False
-             st.session_state.quiz_complete = False
-             st.session_state.quiz_questions = []
-             st.session_state.user_answers = {}
-             st.warning("Quiz reset. Click 'Generate New Quiz' in the sidebar to start again with the current settings.")
-             st.rerun()
-
+        quiz_report_view(source_key, (difficulty, chapter, focus_topic, page_range, chapters))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    try:
+        main()
+    finally:
+        # Also when the run ends early through st.rerun() or st.stop()
+        record_script_run(SCRIPT_STARTED, SCRIPT_SETUP_DONE, SCRIPT_CPU_STARTED)
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""End-to-end benchmark: N simulated users each extracting, generating, parsing, deduplicating and saving quizzes.
+
+Drives the app's own functions headlessly (no Streamlit UI) against synthetic PDFs and the
+local stub server, with a temporary history database and caches. Reports p50/p95 latency per
+step, session throughput, parse yield and peak RSS.
+
+With --rpm the stub enforces a requests-per-minute limit and the app's scheduler is told
+the same limit, to check that throughput stays near it without a storm of 429s.
+
+Usage: python benchmarks/bench_end_to_end.py [--users 4] [--sessions 5] [--pages 50]
+                                             [--latency 0.5] [--malformed-rate 0.1] [--rpm 120]
+"""
+import argparse
+import io
+import math
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import StubServer  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+
+STEPS = ("extract", "generate", "parse", "dedup", "history_save", "session")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+# Peak resident set size in MB for this process and for its (extraction worker) children
+def peak_rss_mb():
+    if resource is None:
+        return None, None
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KiB elsewhere
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6
+    return own, children
+
+
+# Point the app at the stub and at throwaway storage; must run before `app` is imported
+def configure_environment(base_url, workdir, response_cache, rpm):
+    os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["QUIZ_HISTORY_DB"] = os.path.join(workdir, "history.sqlite3")
+    os.environ["QUIZ_HISTORY_JSON"] = os.path.join(workdir, "history.json")
+    os.environ["PDF_CACHE_DIR"] = os.path.join(workdir, "pdf_text")
+    os.environ["INDEX_CACHE_DIR"] = os.path.join(workdir, "chunk_index")
+    os.environ["RESPONSE_CACHE"] = "on" if response_cache else "off"
+    os.environ["RESPONSE_CACHE_PATH"] = os.path.join(workdir, "responses.sqlite3")
+    os.environ["METRICS_PORT"] = "0"
+    os.environ["METRICS_DUMP_PATH"] = ""
+    os.environ["RATE_LIMIT_RPM"] = str(rpm)
+
+
+# One simulated user: `sessions` quizzes, each on a fresh PDF so extraction is never a cache hit
+def run_user(app, user, args, pdfs):
+    learner = f"user-{user}"
+    app.current_session.set(learner)  # each simulated user queues like its own session
+    timings = {step: [] for step in STEPS}
+    requested = parsed = 0
+    for session in range(args.sessions):
+        topic = f"Synthetic topic {user}"
+        session_start = time.perf_counter()
+
+        start = time.perf_counter()
+        text = app.extract_text_from_pdf(io.BytesIO(pdfs[user * args.sessions + session]))
+        timings["extract"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        raw = app.generate_quiz(text, args.difficulty, args.questions)
+        timings["generate"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        questions = app.parse_quiz(raw or "")
+        timings["parse"].append(time.perf_counter() - start)
+        parsed += len(questions)
+
+        # The same check a quiz job makes on each question before showing it
+        start = time.perf_counter()
+        dedup = app.dedup_index().view(learner, topic)
+        questions = [question for question in questions if dedup.check_and_add(question)]
+        timings["dedup"].append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        answers = {i: {"selected": question["answer"], "correct": True} for i, question in enumerate(questions)}
+        app.save_quiz_to_history(raw or "", topic, args.difficulty, questions, answers, learner=learner)
+        timings["history_save"].append(time.perf_counter() - start)
+
+        timings["session"].append(time.perf_counter() - session_start)
+        requested += args.questions
+    return timings, requested, parsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=4, help="concurrent simulated users")
+    parser.add_argument("--sessions", type=int, default=5, help="quizzes per user")
+    parser.add_argument("--pages", type=int, default=50, help="pages per synthetic PDF")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--difficulty", default="Intermediate", choices=["Beginner", "Intermediate", "Advanced"])
+    parser.add_argument("--latency", type=float, default=0.5, help="stub seconds before the first byte")
+    parser.add_argument("--malformed-rate", type=float, default=0.1, help="fraction of stub responses damaged")
+    parser.add_argument("--response-cache", action="store_true", help="leave the response cache on")
+    parser.add_argument("--rpm", type=int, default=0, help="stub and scheduler requests-per-minute limit (0: none)")
+    args = parser.parse_args()
+
+    pdfs = [make_pdf(args.pages, seed=seed) for seed in range(args.users * args.sessions)]
+
+    with tempfile.TemporaryDirectory() as workdir, \
+            StubServer(latency=args.latency, malformed_rate=args.malformed_rate, rpm=args.rpm) as server:
+        configure_environment(server.base_url, workdir, args.response_cache, args.rpm)
+        import app  # reads its configuration at import time
+
+        wall_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.users) as executor:
+            results = list(executor.map(lambda user: run_user(app, user, args, pdfs), range(args.users)))
+        wall = time.perf_counter() - wall_start
+        stub_requests, stub_malformed, stub_limited = server.request_count, server.malformed_count, server.rate_limited_count
+
+    print(f"users={args.users} sessions/user={args.sessions} pages={args.pages} "
+          f"latency={args.latency}s malformed={args.malformed_rate:.0%}")
+    print(f"{'step':<14} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for step in STEPS:
+        values = [value for timings, _, _ in results for value in timings[step]]
+        print(f"{step:<14} {len(values):>5} {percentile(values, 0.5) * 1000:>9.1f} "
+              f"{percentile(values, 0.95) * 1000:>9.1f} {sum(values) / len(values) * 1000:>9.1f}")
+
+    sessions = args.users * args.sessions
+    requested = sum(result[1] for result in results)
+    parsed = sum(result[2] for result in results)
+    print(f"Throughput: {sessions / wall:.2f} quizzes/s ({sessions} in {wall:.2f} s)")
+    print(f"Parse yield: {parsed}/{requested} questions ({parsed / requested:.0%}); "
+          f"stub requests: {stub_requests}, malformed: {stub_malformed}, rate limited (429): {stub_limited}")
+    if args.rpm:
+        print(f"Request rate: {(stub_requests - stub_limited) / wall * 60:.0f}/min against a limit of {args.rpm}/min")
+    own, children = peak_rss_mb()
+    if own is not None:
+        print(f"Peak RSS: {own:.1f} MB (extraction workers: {children:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Benchmark serial vs. process-pool PDF extraction across page counts.
+
+Usage: python benchmarks/bench_extraction.py [--pages 10 50 200 800] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pdf_extraction import extract_pages, get_extraction_pool  # noqa: E402
+from synthetic_pdf import make_pdf  # noqa: E402
+
+
+def best_of(repeats, fn):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50, 200, 800])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    # Warm the pool so process start-up is not billed to the first measurement
+    pool = get_extraction_pool(args.workers)
+    list(pool.map(abs, range(args.workers)))
+
+    print(f"{'pages':>6} {'serial s':>10} {'parallel s':>11} {'speedup':>8}   (workers={args.workers})")
+    for page_count in args.pages:
+        pdf_bytes = make_pdf(page_count)
+        serial = best_of(args.repeats, lambda: extract_pages(pdf_bytes, workers=1))
+        parallel = best_of(args.repeats, lambda: extract_pages(pdf_bytes, workers=args.workers))
+        print(f"{page_count:>6} {serial:>10.3f} {parallel:>11.3f} {serial / parallel:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Measure per-request latency of bare requests.post vs. the shared pooled session.
+
+Runs against the local stub server, so the difference is connection set-up only (plain
+TCP here; against the real API each fresh connection also pays a TLS handshake).
+
+Usage: python benchmarks/bench_http_pool.py [--requests 200]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+
+from llm_client import create_session  # noqa: E402
+from stub_server import StubServer  # noqa: E402
+
+BODY = {"model": "stub", "messages": [{"role": "user", "content": "Please generate 2 questions"}]}
+
+
+def measure(post, url, count):
+    timings = []
+    for _ in range(count):
+        start = time.perf_counter()
+        response = post(url, json=BODY, timeout=10)
+        response.content  # read the body so the connection goes back to the pool
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        url = f"{server.base_url}/chat/completions"
+        session = create_session()
+        measure(session.post, url, 5)  # warm up both paths
+        measure(requests.post, url, 5)
+
+        results = {
+            "requests.post (new connection)": measure(requests.post, url, args.requests),
+            "pooled session (keep-alive)": measure(session.post, url, args.requests),
+        }
+
+    print(f"{'client':<32} {'mean ms':>8} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, timings in results.items():
+        p95 = statistics.quantiles(timings, n=20)[-1]
+        print(f"{name:<32} {statistics.mean(timings):>8.2f} {statistics.median(timings):>8.2f} {p95:>8.2f}")
+    saved = statistics.mean(results["requests.post (new connection)"]) - statistics.mean(results["pooled session (keep-alive)"])
+    print(f"Saved per request: {saved:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
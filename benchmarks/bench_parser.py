@@ -0,0 +1,197 @@
+"""Throughput of parse_quiz vs. the previous block-splitting parser over saved raw outputs.
+
+The corpus is a few known edge cases plus every raw quiz stored in the history database and
+any .txt files in --corpus-dir; with neither available it falls back to synthetic stub-server output.
+
+Usage: python benchmarks/bench_parser.py [--history-db quiz_history.sqlite3] [--corpus-dir DIR]
+"""
+import argparse
+import contextlib
+import glob
+import os
+import re
+import sqlite3
+import sys
+import time
+import traceback
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")  # app.py refuses to import without one
+
+from stub_server import make_quiz_text  # noqa: E402
+
+
+# The parser as it was before the single-pass rewrite, kept verbatim for comparison
+def legacy_parse_quiz(quiz_text):
+    questions = []
+    # Use regex that matches Question: at start (^) OR after newline (\n)
+    # Filter out any empty strings resulting from the split
+    question_blocks = [block for block in re.split(r"(?:^|\n)Question:\s*(?:\d+\.\s*)?", quiz_text.strip()) if block.strip()]
+
+    print(f"[Parser] Found {len(question_blocks)} potential question blocks.") # Debug print
+
+    for i, block in enumerate(question_blocks):
+        print(f"\n[Parser] Processing Block {i+1}") # Debug print
+        try:
+            # Use splitlines() and strip each line immediately
+            lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+            if not lines:
+                print("[Parser] Block empty after stripping/splitting lines.") # Debug print
+                continue
+
+            question_text = lines[0] # Already stripped
+            print(f"[Parser] Question: '{question_text}'") # Debug print
+
+            options_dict = {}
+            options_start_index = -1
+            answer_start_index = -1
+            explanation_start_index = -1
+
+            # Find marker indices
+            for idx, line in enumerate(lines):
+                # Check against already stripped lines
+                if line.startswith("Options:"): options_start_index = idx + 1
+                elif line.startswith("Answer:"): answer_start_index = idx
+                elif line.startswith("Explanation:"): explanation_start_index = idx
+
+            print(f"[Parser] Indices - Opts:{options_start_index}, Ans:{answer_start_index}, Expl:{explanation_start_index}") # Debug print
+
+            # Extract Options
+            if options_start_index != -1 and answer_start_index != -1 and options_start_index <= answer_start_index:
+                option_lines = lines[options_start_index:answer_start_index]
+                for line in option_lines:
+                    match = re.match(r"^([A-D])\.\s*(.*)", line) # Match already stripped line
+                    if match:
+                        options_dict[match.group(1)] = match.group(2).strip() # Ensure value is stripped too
+                print(f"[Parser] Options Found: {options_dict}") # Debug print
+            else:
+                 print("[Parser] Markers for options/answer not found correctly or in wrong order.") # Debug print
+
+            # Extract Answer
+            correct_answer = None
+            if answer_start_index != -1:
+                # Get the next line after "Answer:" if it exists
+                if answer_start_index + 1 < len(lines):
+                    answer_line = lines[answer_start_index + 1]
+                    # Try matching Letter.Text or just Letter
+                    match_letter_dot = re.match(r"^([A-D])\.", answer_line)
+                    match_letter_only = re.match(r"^([A-D])$", answer_line)
+
+                    if match_letter_dot:
+                        correct_answer = match_letter_dot.group(1)
+                    elif match_letter_only:
+                        correct_answer = match_letter_only.group(1)
+                    print(f"[Parser] Answer Line: '{answer_line}', Parsed: '{correct_answer}'") # Debug print
+                else:
+                    print("[Parser] No line found after Answer: marker.") # Debug print
+            else:
+                print("[Parser] Answer marker not found.") # Debug print
+
+            # Extract Explanation
+            explanation = ""
+            if explanation_start_index != -1 and explanation_start_index < len(lines) - 1:
+                # Join lines *after* the explanation marker (lines are already stripped)
+                explanation = '\n'.join(lines[explanation_start_index+1:]).strip() # Re-join stripped lines
+                print(f"[Parser] Explanation Found (len: {len(explanation)}): '{explanation[:50]}...'" )# Debug print
+            elif explanation_start_index != -1:
+                 print("[Parser] Explanation marker found, but no text after it.") # Debug print
+            else:
+                 print("[Parser] Explanation marker not found.") # Debug print
+
+            # Final Validation
+            valid_question = bool(question_text)
+            valid_options = len(options_dict) == 4
+            valid_answer = bool(correct_answer)
+            valid_explanation = bool(explanation)
+
+            if valid_question and valid_options and valid_answer and valid_explanation:
+                questions.append({
+                    "question": question_text,
+                    "options": options_dict,
+                    "answer": correct_answer,
+                    "explanation": explanation
+                })
+                print(f"[Parser] -> Block {i+1} Added.") # Debug print
+            else:
+                # More detailed validation failure log (prints to terminal)
+                fail_reasons = []
+                if not valid_question: fail_reasons.append("Missing Question Text")
+                if not valid_options: fail_reasons.append(f"Incorrect Option Count ({len(options_dict)}) ")
+                if not valid_answer: fail_reasons.append("Missing Answer")
+                if not valid_explanation: fail_reasons.append("Missing Explanation")
+                print(f"[Parser] -> Block {i+1} Failed Validation: {', '.join(fail_reasons)}") # Debug print
+
+        except Exception as e:
+            print(f"[Parser] -> EXCEPTION parsing block {i+1}: {e}") # Debug print
+            print(traceback.format_exc()) # Print full traceback to terminal
+            continue
+
+    print(f"[Parser] Finished. Total questions parsed successfully: {len(questions)}") #Debug print
+    return questions
+
+
+# Outputs the single-pass parser once got wrong; always part of the identical-output check
+EDGE_CASES = [
+    # An explanation line that looks like an answer marker
+    "Question: Which organelle makes ATP?\nOptions:\nA. Nucleus\nB. Mitochondrion\nC. Ribosome\n"
+    "D. Golgi body\nAnswer:\nB\nExplanation:\nCorrect answer: B is right because mitochondria respire.\n"
+    "The nucleus only stores DNA.",
+]
+
+
+def load_corpus(history_db, corpus_dir):
+    corpus = list(EDGE_CASES)
+    if history_db and os.path.exists(history_db):
+        with sqlite3.connect(history_db) as connection:
+            corpus.extend(row[0] for row in connection.execute("SELECT quiz FROM quizzes") if row[0])
+    if corpus_dir:
+        for path in sorted(glob.glob(os.path.join(corpus_dir, "*.txt"))):
+            with open(path, "r", encoding="utf-8") as file:
+                corpus.append(file.read())
+    if len(corpus) == len(EDGE_CASES):
+        corpus += [make_quiz_text(count, seed) for seed in range(50) for count in (2, 5, 10)]
+    return corpus
+
+
+def throughput(parse, corpus, repeats):
+    best = float("inf")
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for text in corpus:
+                parse(text)
+            best = min(best, time.perf_counter() - start)
+    return len(corpus) / best, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--history-db", default=os.path.join(ROOT, "quiz_history.sqlite3"))
+    parser.add_argument("--corpus-dir")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        from app import parse_quiz
+
+    corpus = load_corpus(args.history_db, args.corpus_dir)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        old_results = [legacy_parse_quiz(text) for text in corpus]
+        new_results = [parse_quiz(text) for text in corpus]
+    identical = sum(old == new for old, new in zip(old_results, new_results))
+    recovered = sum(len(new) > len(old) for old, new in zip(old_results, new_results))
+
+    old_rate, old_time = throughput(legacy_parse_quiz, corpus, args.repeats)
+    new_rate, new_time = throughput(parse_quiz, corpus, args.repeats)
+
+    print(f"Corpus: {len(corpus)} raw outputs, {sum(len(r) for r in old_results)} questions (legacy parser)")
+    print(f"{'parser':<16} {'outputs/s':>12} {'total s':>9}")
+    print(f"{'legacy':<16} {old_rate:>12.0f} {old_time:>9.4f}")
+    print(f"{'single-pass':<16} {new_rate:>12.0f} {new_time:>9.4f}")
+    print(f"Speedup: {new_rate / old_rate:.1f}x")
+    print(f"Identical output: {identical}/{len(corpus)}; outputs where more questions were recovered: {recovered}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Per-click benchmark: server time and CPU spent on each answer and "Next Question" click.
+
+Takes quizzes through Streamlit's AppTest against the local stub, with a synthetic PDF as the
+upload, and reads the app's own histograms back: script_run_* for full script runs and
+quiz_view_* for the question fragment. A click inside the fragment only re-runs the fragment
+on a real server. AppTest always re-runs the whole script, so this also counts the full runs
+each click triggered.
+
+Usage: python benchmarks/bench_quiz_clicks.py [--quizzes 2] [--questions 5] [--pages 30]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import textwrap
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stub_server import StubServer  # noqa: E402
+
+# The app with st.file_uploader answering with a synthetic PDF (AppTest can't upload files)
+WRAPPER = """
+import io, runpy, sys
+import streamlit as st
+sys.path.insert(0, {root!r}); sys.path.insert(0, {benchmarks!r})
+from synthetic_pdf import make_pdf
+
+class Upload(io.BytesIO):
+    def __init__(self, data, name):
+        super().__init__(data)
+        self.name, self.size, self.file_id = name, len(data), name
+
+UPLOADS = [Upload(make_pdf({pages}), "benchmark.pdf")]
+st.file_uploader = lambda *args, **kwargs: list(UPLOADS) if kwargs.get("accept_multiple_files") else UPLOADS[0]
+runpy.run_path({app!r}, run_name="__main__")
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quizzes", type=int, default=2)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--pages", type=int, default=30, help="pages of the synthetic PDF")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir, StubServer(latency=0.01) as server:
+        os.environ.update({
+            "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+            "OPENAI_BASE_URL": server.base_url,
+            "QUIZ_HISTORY_DB": os.path.join(workdir, "history.sqlite3"),
+            "QUIZ_HISTORY_JSON": os.path.join(workdir, "history.json"),
+            "PDF_CACHE_DIR": os.path.join(workdir, "pdf_text"),
+            "INDEX_CACHE_DIR": os.path.join(workdir, "chunk_index"),
+            "DOC_STORE_DIR": os.path.join(workdir, "documents"),
+            "RESPONSE_CACHE": "off",
+            "PREGENERATE_BUFFER": "0",
+            "QUESTION_BANK_PATH": "",
+            "METRICS_PORT": "0",
+            "METRICS_DUMP_PATH": "",
+        })
+        wrapper = os.path.join(workdir, "bench_app.py")
+        with open(wrapper, "w") as file:
+            file.write(textwrap.dedent(WRAPPER).format(
+                root=ROOT, benchmarks=os.path.dirname(os.path.abspath(__file__)),
+                app=os.path.join(ROOT, "app.py"), pages=args.pages
+            ))
+
+        from streamlit.testing.v1 import AppTest
+        from instrumentation import metrics
+
+        at = AppTest.from_file(wrapper, default_timeout=60)
+        at.run()
+        at.sidebar.slider(key="num_questions").set_value(args.questions).run()
+
+        clicks, walls, totals = 0, [], {}
+        for _ in range(args.quizzes):
+            at.sidebar.button[0].click().run()
+            at.session_state.quiz_job.wait_for(args.questions + 1, timeout=60)  # Until it's done
+            at.run()
+            # Only the clicks inside the quiz are counted
+            before = metrics.snapshot()["histograms"]
+            for index in range(len(at.session_state.quiz_questions)):
+                answer = at.session_state.quiz_questions[index]["answer"]
+                for key in (f"q{index}_opt{answer}", f"next_q{index}"):
+                    if key.startswith("next_q") and index == len(at.session_state.quiz_questions) - 1:
+                        continue
+                    start = time.perf_counter()
+                    at.button(key=key).click().run()
+                    walls.append(time.perf_counter() - start)
+                    clicks += 1
+            after = metrics.snapshot()["histograms"]
+            for series in after:
+                total, earlier = after[series], before.get(series, {"count": 0, "sum": 0.0})
+                count, seconds = totals.get(series, (0, 0.0))
+                totals[series] = (count + total["count"] - earlier["count"], seconds + total["sum"] - earlier["sum"])
+            at.button(key=f"finish_q{len(at.session_state.quiz_questions) - 1}").click().run()
+            next(button for button in at.button if button.label.startswith("Start New Quiz")).click().run()
+        if at.exception:
+            sys.exit(f"App raised: {at.exception[0].value}")
+
+    # (runs per click, ms per click) of a histogram over the counted clicks
+    def per_click(name, **labels):
+        series = name + ("{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}" if labels else "")
+        count, seconds = totals.get(series, (0, 0.0))
+        return count / max(1, clicks), seconds / max(1, clicks) * 1000
+
+    print(f"{clicks} clicks over {args.quizzes} quizzes of {args.questions} questions")
+    print(f"{'per click':<26} {'runs':>6} {'wall ms':>9} {'cpu ms':>8}")
+    runs, wall = per_click("script_run_seconds", start="warm")
+    _, cpu = per_click("script_run_cpu_seconds", start="warm")
+    print(f"{'full script runs':<26} {runs:>6.2f} {wall:>9.2f} {cpu:>8.2f}")
+    runs, wall = per_click("quiz_view_seconds", view="question")
+    _, cpu = per_click("quiz_view_cpu_seconds", view="question")
+    print(f"{'question fragment runs':<26} {runs:>6.2f} {wall:>9.2f} {cpu:>8.2f}")
+    walls.sort()
+    print(f"AppTest round trip per click (full runs plus AppTest overhead): median {walls[len(walls) // 2] * 1000:.1f} ms")
+    print("On a server, a click in the fragment runs only the fragment: its row is the per-click cost.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Startup benchmark: cold import time of the app and the cost of each Streamlit rerun.
+
+Cold start is measured in fresh interpreters (streamlit is imported first, as the server
+already has it loaded), listing which heavy libraries the import pulled in. Reruns are driven
+through Streamlit's AppTest and read back from the app's script_setup/script_run histograms.
+
+Usage: python benchmarks/bench_startup.py [--cold-runs 5] [--reruns 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ("numpy", "pandas", "pyarrow", "pypdf", "requests", "tiktoken")
+
+COLD_IMPORT = f"""
+import json, sys, time
+sys.path.insert(0, {ROOT!r})
+import streamlit
+start = time.perf_counter()
+import app
+print(json.dumps({{"seconds": time.perf_counter() - start,
+                  "loaded": [name for name in {HEAVY_MODULES!r} if name in sys.modules]}}))
+"""
+
+
+# Throwaway storage and a dummy key, so importing the app touches nothing real
+def benchmark_environment(workdir):
+    return {
+        **os.environ,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-benchmark"),
+        "QUIZ_HISTORY_DB": os.path.join(workdir, "history.sqlite3"),
+        "QUIZ_HISTORY_JSON": os.path.join(workdir, "history.json"),
+        "PDF_CACHE_DIR": os.path.join(workdir, "pdf_text"),
+        "INDEX_CACHE_DIR": os.path.join(workdir, "chunk_index"),
+        "RESPONSE_CACHE_PATH": os.path.join(workdir, "responses.sqlite3"),
+        "DOC_STORE_DIR": os.path.join(workdir, "documents"),
+        "METRICS_PORT": "0",
+        "METRICS_DUMP_PATH": "",
+    }
+
+
+def cold_imports(runs, env):
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", COLD_IMPORT], env=env, capture_output=True, text=True,
+                                check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--cold-runs", type=int, default=5, help="fresh interpreters importing the app")
+    parser.add_argument("--reruns", type=int, default=20, help="reruns of the idle page")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = benchmark_environment(workdir)
+        cold = cold_imports(args.cold_runs, env)
+        seconds = sorted(result["seconds"] for result in cold)
+        print(f"Cold import of app (after streamlit): median {seconds[len(seconds) // 2] * 1000:.0f} ms, "
+              f"min {seconds[0] * 1000:.0f} ms over {len(seconds)} runs")
+        print(f"Heavy modules loaded by the import: {', '.join(cold[0]['loaded']) or 'none'}")
+
+        os.environ.update(env)
+        sys.path.insert(0, ROOT)
+        from streamlit.testing.v1 import AppTest
+        from instrumentation import metrics
+
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=60)
+        walls = []
+        for _ in range(args.reruns + 1):
+            start = time.perf_counter()
+            at.run()
+            walls.append(time.perf_counter() - start)
+        if at.exception:
+            sys.exit(f"App raised: {at.exception[0].value}")
+
+    histograms = metrics.snapshot()["histograms"]
+    print(f"{'script run':<12} {'n':>4} {'setup ms':>9} {'run ms':>9}")
+    for start in ("cold", "warm"):
+        setup = histograms.get(f'script_setup_seconds{{start="{start}"}}')
+        run = histograms.get(f'script_run_seconds{{start="{start}"}}')
+        if setup and run:
+            print(f"{start:<12} {run['count']:>4} {setup['mean'] * 1000:>9.2f} {run['mean'] * 1000:>9.2f}")
+    reruns = sorted(walls[1:])
+    if reruns:
+        print(f"AppTest rerun wall time (incl. Streamlit overhead): median {reruns[len(reruns) // 2] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""Local OpenAI-compatible chat completions stub for benchmarks.
+
+Answers POST /v1/chat/completions with well-formed quiz text in the format the app asks
+for, either as one JSON response or as server-sent events when the request sets "stream".
+A configurable fraction of responses is malformed, to exercise the parser's failure paths,
+and an optional requests-per-minute limit answers 429 with Retry-After like the real API.
+
+Usage: python benchmarks/stub_server.py [--port 8765] [--latency 0.5] [--malformed-rate 0.1] [--rpm 60]
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import math
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUESTION_COUNT_RE = re.compile(r"generate (\d+) question")
+
+
+# Words and question stems, so questions differ the way real ones do rather than by a number
+CONCEPT_WORDS = (
+    "osmosis", "entropy", "catalyst", "gradient", "membrane", "inertia", "lattice", "equilibrium",
+    "photon", "enzyme", "torque", "isotope", "vector", "mitosis", "friction", "polymer", "orbital",
+    "spectrum", "nucleus", "voltage", "density", "ligand", "momentum", "tissue", "receptor",
+)
+STEMS = (
+    "Which statement about {} is correct?", "What best explains {}?", "Why does {} matter?",
+    "How is {} usually measured?", "What limits {}?", "Which example shows {}?",
+)
+
+
+def make_quiz_text(count, seed=0):
+    rng = random.Random(f"quiz-{seed}")
+    blocks = []
+    for number in range(1, count + 1):
+        concept, cause, effect = rng.sample(CONCEPT_WORDS, 3)
+        blocks.append(
+            f"Question: {number}. {rng.choice(STEMS).format(f'{concept} {cause}')}\n"
+            "Options:\n"
+            f"A. It is unrelated to {effect}\n"
+            f"B. {cause.capitalize()} drives {effect}\n"
+            f"C. It only appears in the appendix\n"
+            f"D. It contradicts section {number}\n"
+            "Answer:\n"
+            f"B. {cause.capitalize()} drives {effect}\n"
+            "Explanation:\n"
+            f"Section {number} shows how {cause} in {concept} drives {effect}.\n"
+        )
+    return "\n".join(blocks)
+
+
+# Damage quiz text the way models do: a question missing its answer, output cut off
+# mid-question, or prose with no markers at all
+def malform_quiz_text(text, rng):
+    kind = rng.choice(("missing_answer", "truncated", "prose"))
+    if kind == "missing_answer":
+        return re.sub(r"Answer:\n[^\n]*\n", "", text, count=1)
+    if kind == "truncated":
+        return text[:rng.randrange(1, max(2, len(text)))]
+    return "Sure! Here are some questions about the text. " + " ".join(text.split())[:400]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so pooled clients can reuse connections
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+    def _stream(self, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        # Split into line-sized deltas, like a model emitting tokens
+        pieces = content.splitlines(keepends=True)
+        delay = self.server.stream_latency / max(1, len(pieces))
+        for piece in pieces:
+            event = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            self._send_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            if delay:
+                time.sleep(delay)
+        self._send_chunk(b"data: [DONE]\n\n")
+        self._send_chunk(b"")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            request = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body"}})
+            return
+
+        with self.server.counter_lock:
+            self.server.request_count += 1
+            seed = self.server.request_count
+            retry_after = self.server.rate_limit()
+        if retry_after:
+            body = json.dumps({"error": {"message": "Rate limit reached for requests"}}).encode("utf-8")
+            self.send_response(429)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Retry-After", str(retry_after))
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        prompt = " ".join(message.get("content", "") for message in request.get("messages", []))
+        match = QUESTION_COUNT_RE.search(prompt)
+        content = make_quiz_text(int(match.group(1)) if match else 5, seed)
+        rng = random.Random(seed)
+        if rng.random() < self.server.malformed_rate:
+            content = malform_quiz_text(content, rng)
+            with self.server.counter_lock:
+                self.server.malformed_count += 1
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if request.get("stream"):
+            self._stream(content)
+        else:
+            self._send_json(200, {
+                "id": f"stub-{seed}",
+                "object": "chat.completion",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"total_tokens": (len(prompt) + len(content)) // 4},
+            })
+
+
+# Run the stub on a background thread; use as a context manager
+class StubServer:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, stream_latency=0.0, malformed_rate=0.0, rpm=0):
+        self.httpd = ThreadingHTTPServer((host, port), StubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.latency = latency
+        self.httpd.stream_latency = stream_latency
+        self.httpd.malformed_rate = malformed_rate
+        self.httpd.request_count = 0
+        self.httpd.malformed_count = 0
+        self.httpd.rate_limited_count = 0
+        self.httpd.counter_lock = threading.Lock()
+        self.httpd.rate_limit = self._rate_limit
+        self.rpm = rpm
+        self.admitted = deque()  # times of requests admitted in the last minute
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    @property
+    def request_count(self):
+        return self.httpd.request_count
+
+    @property
+    def malformed_count(self):
+        return self.httpd.malformed_count
+
+    @property
+    def rate_limited_count(self):
+        return self.httpd.rate_limited_count
+
+    # Sliding one-minute window: 0 to admit a request, else whole seconds until a slot frees
+    # (called with counter_lock held)
+    def _rate_limit(self):
+        if not self.rpm:
+            return 0
+        now = time.monotonic()
+        while self.admitted and now - self.admitted[0] >= 60:
+            self.admitted.popleft()
+        if len(self.admitted) < self.rpm:
+            self.admitted.append(now)
+            return 0
+        self.httpd.rate_limited_count += 1
+        return max(1, math.ceil(60 - (now - self.admitted[0])))
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="seconds before the first byte")
+    parser.add_argument("--stream-latency", type=float, default=1.0, help="seconds spread across streamed deltas")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of responses to damage")
+    parser.add_argument("--rpm", type=int, default=0, help="requests per minute before answering 429 (0: no limit)")
+    args = parser.parse_args()
+    with StubServer(port=args.port, latency=args.latency, stream_latency=args.stream_latency,
+                    malformed_rate=args.malformed_rate, rpm=args.rpm) as server:
+        print(f"Stub listening on {server.base_url} (set OPENAI_BASE_URL to this)")
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
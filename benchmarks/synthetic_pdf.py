@@ -0,0 +1,77 @@
+"""Generate synthetic text PDFs of a given page count for benchmarks (no extra dependencies)."""
+import random
+
+WORDS = (
+    "cell membrane protein energy enzyme reaction molecule structure function system "
+    "process theory model equation variable force motion mass velocity acceleration "
+    "market price supply demand capital labour policy history empire revolution trade "
+    "algorithm data memory network signal analysis probability distribution sample"
+).split()
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+# Build a page of pseudo-random sentences; page 1 gets a title line like a real textbook
+def _page_lines(rng, page_number, lines_per_page):
+    lines = [f"Chapter {page_number // 20 + 1}: Synthetic Textbook Section {page_number}"]
+    for _ in range(lines_per_page - 1):
+        lines.append(" ".join(rng.choice(WORDS) for _ in range(12)).capitalize() + ".")
+    return lines
+
+
+# Return the bytes of a valid PDF with page_count pages of extractable text
+def make_pdf(page_count, lines_per_page=45, seed=0):
+    rng = random.Random(seed)
+    objects = []  # object bodies, index i is object number i + 1
+
+    def add(body):
+        objects.append(body)
+        return len(objects)
+
+    catalog_id = add(None)
+    pages_id = add(None)
+    font_id = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    page_ids = []
+    for page_number in range(1, page_count + 1):
+        text_ops = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in _page_lines(rng, page_number, lines_per_page):
+            text_ops.append(f"({_escape(line)}) Tj T*")
+        text_ops.append("ET")
+        stream = "\n".join(text_ops).encode("latin-1")
+        content_id = add(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        page_ids.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_id, font_id, content_id)
+        ))
+
+    objects[catalog_id - 1] = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[pages_id - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_id, xref_offset
+    )
+    return bytes(out)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write a synthetic text PDF")
+    parser.add_argument("pages", type=int)
+    parser.add_argument("output")
+    args = parser.parse_args()
+    with open(args.output, "wb") as file:
+        file.write(make_pdf(args.pages))
@@ -0,0 +1,156 @@
+"""Build the offline question bank: generate questions for every chunk of every PDF in a directory at each difficulty level.
+
+Runs the app's own prompt, request and parsing code headlessly, a few chunks at a time (the
+app's scheduler still applies the account's rate limits). Each finished (document, chunk,
+difficulty) unit is checkpointed as its own Parquet part, so an interrupted build resumes
+where it stopped; the parts are then compacted into the bank the app serves quizzes from.
+
+Usage: python build_question_bank.py PDF_DIR [--bank question_bank/bank.parquet] [--questions 5]
+                                     [--workers 4] [--chunk-chars 6000] [--difficulties Beginner ...]
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+import app
+from pdf_extraction import document_title, extract_outline, heading_outline, load_pdf_pages, read_pdf_bytes
+from question_bank import BANK_PATH, COLUMNS, question_rows, write_parquet
+
+LEVELS = [level for level in app.DIFFICULTY_OPTIONS if level != app.ADAPTIVE]
+
+
+# Consecutive pages grouped into chunks of at most max_chars (a longer page is a chunk of its
+# own and is cut down by the prompt budget); blank pages are skipped. [(first, last, text)]
+def page_chunks(pages, max_chars):
+    chunks = []
+    first = last = None
+    parts, size = [], 0
+    for number, text in enumerate(pages, start=1):
+        if not text.strip():
+            continue
+        if parts and size + len(text) > max_chars:
+            chunks.append((first, last, "".join(parts)))
+            parts, size = [], 0
+        if not parts:
+            first = number
+        parts.append(text)
+        size += len(text)
+        last = number
+    if parts:
+        chunks.append((first, last, "".join(parts)))
+    return chunks
+
+
+# Pages, title and outline of one PDF, as the app's document store would see them
+def load_document(path):
+    pdf_bytes = read_pdf_bytes(path)
+    doc_id, pages = load_pdf_pages(pdf_bytes)
+    entries = extract_outline(pdf_bytes) or heading_outline(pages)
+    outline = {
+        "title": document_title(pdf_bytes) or os.path.splitext(os.path.basename(path))[0],
+        "entries": [list(entry) for entry in entries],
+    }
+    return doc_id, pages, outline
+
+
+def part_path(parts_dir, doc_id, difficulty, chunk):
+    return os.path.join(parts_dir, doc_id, f"{difficulty.lower()}-{chunk:05d}.parquet")
+
+
+# Generate one unit's questions and checkpoint them; returns (question count, errors)
+def build_unit(unit, num_questions):
+    app.current_session.set("bank-builder")  # Pool threads don't inherit the main thread's context
+    questions, _, errors = app.generate_quiz_batched(unit["text"], unit["difficulty"], num_questions)
+    if questions:
+        frame = question_rows(
+            unit["doc_id"], unit["document"], unit["chunk"], unit["first_page"], unit["last_page"],
+            unit["topic"], unit["difficulty"], questions
+        )
+        os.makedirs(os.path.dirname(unit["path"]), exist_ok=True)
+        write_parquet(frame, unit["path"])
+    return len(questions), errors
+
+
+# Merge every checkpointed part into the bank (atomically replacing the previous one)
+def compact(parts_dir, bank_path):
+    paths = sorted(glob.glob(os.path.join(parts_dir, "*", "*.parquet")))
+    if not paths:
+        return 0
+    frame = pd.concat([pd.read_parquet(path, columns=COLUMNS) for path in paths], ignore_index=True)
+    for column in frame.select_dtypes("category"):
+        frame[column] = frame[column].astype(str)  # Parts have different category sets
+    write_parquet(frame, bank_path)
+    return len(frame)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("pdf_dir", help="Directory of PDFs (searched recursively)")
+    parser.add_argument("--bank", default=BANK_PATH or os.path.join("question_bank", "bank.parquet"),
+                        help="Bank to write; parts are checkpointed next to it (default: QUESTION_BANK_PATH)")
+    parser.add_argument("--questions", type=int, default=5, help="Questions per chunk and difficulty")
+    parser.add_argument("--workers", type=int, default=4, help="Chunks generated at once")
+    parser.add_argument("--chunk-chars", type=int, default=6000, help="Text per chunk (capped by the prompt budget)")
+    parser.add_argument("--difficulties", nargs="+", choices=LEVELS, default=LEVELS)
+    args = parser.parse_args()
+
+    parts_dir = os.path.join(os.path.dirname(os.path.abspath(args.bank)), "parts")
+    chunk_chars = max(1, min(args.chunk_chars, app.prompt_budget().content_chars()))
+
+    pdf_paths = sorted(glob.glob(os.path.join(args.pdf_dir, "**", "*.pdf"), recursive=True))
+    if not pdf_paths:
+        sys.exit(f"No PDFs found in {args.pdf_dir}")
+
+    units, done = [], 0
+    for path in pdf_paths:
+        try:
+            doc_id, pages, outline = load_document(path)
+        except Exception as e:
+            print(f"skipping {path}: {e}", file=sys.stderr)
+            continue
+        for chunk, (first_page, last_page, text) in enumerate(page_chunks(pages, chunk_chars)):
+            for difficulty in args.difficulties:
+                unit_path = part_path(parts_dir, doc_id, difficulty, chunk)
+                if os.path.exists(unit_path):
+                    done += 1
+                    continue
+                units.append({
+                    "path": unit_path, "doc_id": doc_id, "document": os.path.basename(path), "chunk": chunk,
+                    "first_page": first_page, "last_page": last_page,
+                    "topic": app.outline_topic(outline, first_page)[:80], "difficulty": difficulty, "text": text,
+                })
+    print(f"{len(pdf_paths)} PDFs: {len(units) + done} units, {done} already built, {len(units)} to generate")
+
+    start = time.perf_counter()
+    finished = failed = questions = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as pool:
+        futures = {pool.submit(build_unit, unit, args.questions): unit for unit in units}
+        for future in as_completed(futures):
+            unit = futures[future]
+            try:
+                count, errors = future.result()
+            except Exception as e:
+                count, errors = 0, [e]
+            finished += 1
+            questions += count
+            failed += int(not count)
+            label = f"{unit['document']} p.{unit['first_page']}-{unit['last_page']} {unit['difficulty']}"
+            status = f"{count} questions" + (f", {len(errors)} failed requests" if errors else "")
+            print(f"[{finished}/{len(units)}] {label}: {status}", flush=True)
+            for error in errors:
+                print(f"    {app.describe_generation_error(error)}", file=sys.stderr)
+
+    total = compact(parts_dir, args.bank)
+    print(
+        f"Generated {questions} questions in {time.perf_counter() - start:.1f}s; {failed} units left for the next run. "
+        f"Bank: {total} questions in {args.bank}"
+    )
+
+
+if __name__ == "__main__":
+    main()
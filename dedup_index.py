@@ -0,0 +1,158 @@
+"""Near-duplicate detection for quiz questions: per-learner, per-topic MinHash signatures in NumPy arrays."""
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+# Estimated Jaccard similarity (of character shingles) at which a question counts as a repeat
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.6"))
+NUM_HASHES = 64
+SHINGLE_CHARS = 5
+# (learner, topic) signature sets kept in memory; evicted ones are rebuilt from the history
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "1024"))
+
+# Hash family h(x) = (a * x + b) mod p over 32-bit shingle hashes, with uint64 arithmetic
+# wrapping as in the usual MinHash implementations; a fixed seed keeps signatures stable
+# across processes
+_PRIME = np.uint64((1 << 61) - 1)
+_seed = np.random.default_rng(0x5EED)
+_A = _seed.integers(1, (1 << 61) - 1, NUM_HASHES, dtype=np.uint64)
+_B = _seed.integers(0, (1 << 61) - 1, NUM_HASHES, dtype=np.uint64)
+
+NON_WORD_RE = re.compile(r"[^a-z0-9]+")
+
+
+# Lowercase letters and digits only, so spacing and punctuation changes don't matter
+def normalize(text):
+    return NON_WORD_RE.sub("", text.lower())
+
+
+# The part of a question that makes it the same question: its text and its correct answer
+def question_fingerprint_text(question):
+    return f"{question['question']} {question['options'].get(question['answer'], '')}"
+
+
+# MinHash signature (uint32[NUM_HASHES]) of the character shingles of a text
+def signature(text):
+    text = normalize(text)
+    if len(text) <= SHINGLE_CHARS:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_CHARS] for i in range(len(text) - SHINGLE_CHARS + 1)}
+    hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    mixed = (hashes[:, None] * _A + _B) % _PRIME
+    return (mixed.min(axis=0) & np.uint64(0xFFFFFFFF)).astype(np.uint32)
+
+
+# Signatures of one learner's questions on a topic in a growable (n, NUM_HASHES) array
+class TopicSignatures:
+    def __init__(self, signatures=None):
+        self.data = np.zeros((16, NUM_HASHES), dtype=np.uint32)
+        self.count = 0
+        for item in signatures if signatures is not None else []:
+            self.add(item)
+
+    def add(self, item):
+        if self.count == len(self.data):
+            self.data = np.concatenate([self.data, np.zeros_like(self.data)])
+        self.data[self.count] = item
+        self.count += 1
+
+    def copy(self):
+        copied = TopicSignatures()
+        copied.data = self.data[:max(self.count, 16)].copy()
+        copied.count = self.count
+        return copied
+
+    # Highest estimated Jaccard similarity to any stored question (0.0 when empty)
+    def max_similarity(self, item):
+        if not self.count:
+            return 0.0
+        return float((self.data[:self.count] == item).mean(axis=1).max())
+
+
+# One quiz's view of a learner's topic: the questions they have already been shown, plus those
+# the quiz itself takes. A snapshot, so a quiz that is cancelled or never shown leaves no trace.
+class DedupView:
+    def __init__(self, signatures, threshold):
+        self.signatures = signatures
+        self.threshold = threshold
+        self._lock = threading.Lock()
+
+    def _repeats(self, item):
+        return self.signatures.max_similarity(item) >= self.threshold
+
+    # How many of `questions` nearly repeat one already seen or taken (none are taken)
+    def repeats(self, questions):
+        items = [signature(question_fingerprint_text(question)) for question in questions]
+        with self._lock:
+            return sum(self._repeats(item) for item in items)
+
+    # Take a question unless it nearly repeats one already seen or taken; returns whether it was
+    # taken. Atomic, so concurrent sub-requests can't both take the same question.
+    def check_and_add(self, question):
+        item = signature(question_fingerprint_text(question))
+        with self._lock:
+            if self._repeats(item):
+                return False
+            self.signatures.add(item)
+            return True
+
+
+class DedupIndex:
+    def __init__(self, load_questions, threshold=DEDUP_THRESHOLD, max_entries=DEDUP_MAX_ENTRIES):
+        self.load_questions = load_questions
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (learner, topic) -> TopicSignatures, least recently used first
+        self._lock = threading.Lock()
+
+    # Built from the learner's saved questions on the topic the first time they are needed (and
+    # again after eviction); called with the lock held
+    def _signatures(self, learner, topic):
+        key = (learner, topic)
+        signatures = self._entries.get(key)
+        if signatures is None:
+            signatures = TopicSignatures(
+                signature(question_fingerprint_text(question)) for question in self.load_questions(learner, topic)
+            )
+            self._entries[key] = signatures
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        self._entries.move_to_end(key)
+        return signatures
+
+    # A view for one quiz: the learner's shown questions on the topic plus `seen` (e.g. a quiz
+    # being taken that isn't saved yet)
+    def view(self, learner, topic, seen=()):
+        with self._lock:
+            signatures = self._signatures(learner, topic).copy()
+        for question in seen:
+            signatures.add(signature(question_fingerprint_text(question)))
+        return DedupView(signatures, self.threshold)
+
+    # Record questions a learner has been shown (once the quiz is saved to their history)
+    def record(self, learner, topic, questions):
+        items = [signature(question_fingerprint_text(question)) for question in questions]
+        with self._lock:
+            # An entry not in memory is loaded from the history, which already holds them
+            signatures = self._entries.get((learner, topic))
+            for item in items if signatures is not None else []:
+                signatures.add(item)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+# Process-wide index; load_questions(learner, topic) returns the learner's saved questions on the topic
+def get_dedup_index(load_questions):
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = DedupIndex(load_questions)
+        return _index
@@ -0,0 +1,278 @@
+"""Disk-backed store for uploaded PDFs and their page text, bounded per session and cleaned up when idle."""
+import json
+import mmap
+import os
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+from pdf_extraction import (
+    document_key, document_title, extract_outline, heading_outline, load_pdf_pages, read_pdf_bytes
+)
+
+STORE_DIR = os.getenv("DOC_STORE_DIR", os.path.join(tempfile.gettempdir(), "quiz_documents"))
+# Documents not used for this long are deleted from disk
+IDLE_SECONDS = float(os.getenv("DOC_IDLE_MINUTES", "30")) * 60
+# Disk (and so page-cache) footprint allowed per session; older documents are released first
+SESSION_MAX_BYTES = int(os.getenv("DOC_SESSION_MAX_MB", "256")) * 1024 * 1024
+CLEANUP_INTERVAL = 60
+
+
+# Raised when a single document is larger than the per-session limit
+class DocumentTooLargeError(Exception):
+    pass
+
+
+# Read-only page sequence over pages.bin (UTF-8 page texts back to back) and pages.idx
+# (int64 byte offsets). Pages are decoded on access from a memory map.
+class PageText:
+    def __init__(self, directory):
+        self.offsets = array("q")
+        with open(os.path.join(directory, "pages.idx"), "rb") as file:
+            self.offsets.frombytes(file.read())
+        with open(os.path.join(directory, "pages.bin"), "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size != (self.offsets[-1] if self.offsets else 0):
+                raise ValueError("Page text size mismatch")
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+
+    def __len__(self):
+        return max(0, len(self.offsets) - 1)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.data[self.offsets[index]:self.offsets[index + 1]].decode("utf-8")
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+
+def _write_atomic(path, data):
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(data)
+    os.replace(f"{path}.tmp", path)
+
+
+def _directory_size(directory):
+    try:
+        return sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+    except OSError:
+        return 0
+
+
+class DocumentStore:
+    def __init__(self, root=STORE_DIR, idle_seconds=IDLE_SECONDS, session_max_bytes=SESSION_MAX_BYTES):
+        self.root = root
+        self.idle_seconds = idle_seconds
+        self.session_max_bytes = session_max_bytes
+        self._lock = threading.Lock()
+        self._doc_locks = {}
+        self._sessions = {}  # session id -> OrderedDict(doc id -> None), least recently used first
+        self._last_cleanup = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    def _dir(self, doc_id):
+        return os.path.join(self.root, doc_id)
+
+    def _doc_lock(self, doc_id):
+        with self._lock:
+            return self._doc_locks.setdefault(doc_id, threading.RLock())
+
+    # Mark a document as used now (idle cleanup goes by the directory's mtime)
+    def touch(self, doc_id):
+        try:
+            os.utime(self._dir(doc_id))
+        except OSError:
+            pass
+        self._maybe_cleanup()
+
+    # Spill an upload (file-like, path or bytes) to disk and register it with the session.
+    # Only the returned document id needs to be kept; the bytes are not retained in memory.
+    # Documents in `keep` (e.g. the rest of a course pack) are never released to make room.
+    def add(self, source, session_id, name=None, keep=()):
+        name = name or getattr(source, "name", None)
+        pdf_bytes = read_pdf_bytes(source)
+        if len(pdf_bytes) > self.session_max_bytes:
+            raise DocumentTooLargeError(
+                f"The PDF is {len(pdf_bytes) / 1e6:.0f} MB; the limit is {self.session_max_bytes / 1e6:.0f} MB"
+            )
+        doc_id = document_key(pdf_bytes)
+        with self._doc_lock(doc_id):
+            directory = self._dir(doc_id)
+            os.makedirs(directory, exist_ok=True)
+            if not os.path.exists(os.path.join(directory, "source.pdf")):
+                _write_atomic(os.path.join(directory, "meta.json"), json.dumps({"name": name}).encode("utf-8"))
+                _write_atomic(os.path.join(directory, "source.pdf"), pdf_bytes)
+        del pdf_bytes
+
+        with self._lock:
+            documents = self._sessions.setdefault(session_id, OrderedDict())
+            documents[doc_id] = None
+            documents.move_to_end(doc_id)
+        if not self._enforce_session_limit(session_id, set(keep) | {doc_id}):
+            self.release(session_id, doc_id)
+            raise DocumentTooLargeError(
+                f"The session's documents would exceed {self.session_max_bytes / 1e6:.0f} MB"
+            )
+        self.touch(doc_id)
+        return doc_id
+
+    def exists(self, doc_id):
+        return os.path.exists(os.path.join(self._dir(doc_id), "source.pdf"))
+
+    def pdf_bytes(self, doc_id):
+        self.touch(doc_id)
+        with open(os.path.join(self._dir(doc_id), "source.pdf"), "rb") as file:
+            return file.read()
+
+    # Page text if it has already been spilled, else None (so callers can stay lazy)
+    def open_pages(self, doc_id):
+        self.touch(doc_id)
+        try:
+            return PageText(self._dir(doc_id))
+        except (OSError, ValueError):
+            return None
+
+    # Page text, extracting and spilling it to disk on first use
+    def pages(self, doc_id):
+        pages = self.open_pages(doc_id)
+        if pages is not None:
+            return pages
+        with self._doc_lock(doc_id):
+            pages = self.open_pages(doc_id)
+            if pages is None:
+                _, texts = load_pdf_pages(self.pdf_bytes(doc_id))
+                offsets = array("q", [0])
+                directory = self._dir(doc_id)
+                with open(os.path.join(directory, "pages.bin.tmp"), "wb") as file:
+                    for text in texts:
+                        encoded = text.encode("utf-8")
+                        file.write(encoded)
+                        offsets.append(offsets[-1] + len(encoded))
+                del texts
+                os.replace(os.path.join(directory, "pages.bin.tmp"), os.path.join(directory, "pages.bin"))
+                _write_atomic(os.path.join(directory, "pages.idx"), offsets.tobytes())
+                pages = PageText(directory)
+        return pages
+
+    # File name the document was uploaded as
+    def name(self, doc_id):
+        try:
+            with open(os.path.join(self._dir(doc_id), "meta.json"), "r") as file:
+                name = json.load(file).get("name")
+        except (OSError, ValueError):
+            name = None
+        return name or doc_id[:12]
+
+    # {"title", "page_count", "source", "entries": [[title, first page, level], ...]} from the
+    # PDF's bookmarks, or from page headings when it has none; computed once per document
+    def outline(self, doc_id):
+        path = os.path.join(self._dir(doc_id), "outline.json")
+        try:
+            with open(path, "r") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            pass
+
+        with self._doc_lock(doc_id):
+            pdf_bytes = self.pdf_bytes(doc_id)
+            pages = self.pages(doc_id)
+            entries, source = extract_outline(pdf_bytes), "bookmarks"
+            if not entries:
+                entries, source = heading_outline(pages), "headings"
+            outline = {
+                "title": document_title(pdf_bytes) or os.path.splitext(self.name(doc_id))[0],
+                "page_count": len(pages),
+                "source": source,
+                "entries": [list(entry) for entry in entries],
+            }
+            _write_atomic(path, json.dumps(outline).encode("utf-8"))
+        return outline
+
+    # Forget a session's documents (all of them, or one); files go once no session uses them
+    def release(self, session_id, doc_id=None):
+        with self._lock:
+            documents = self._sessions.get(session_id, OrderedDict())
+            released = list(documents) if doc_id is None else [doc_id] if doc_id in documents else []
+            for released_id in released:
+                documents.pop(released_id, None)
+            if not documents:
+                self._sessions.pop(session_id, None)
+            orphans = [
+                released_id for released_id in released
+                if not any(released_id in other for other in self._sessions.values())
+            ]
+        for orphan in orphans:
+            self._delete(orphan)
+
+    # Release the session's least recently used documents outside `keep` until it fits;
+    # returns whether it does
+    def _enforce_session_limit(self, session_id, keep):
+        with self._lock:
+            documents = list(self._sessions.get(session_id, ()))
+        sizes = {doc_id: _directory_size(self._dir(doc_id)) for doc_id in documents}
+        total = sum(sizes.values())
+        for doc_id in documents:
+            if total <= self.session_max_bytes:
+                break
+            if doc_id not in keep:
+                self.release(session_id, doc_id)
+                total -= sizes[doc_id]
+        return total <= self.session_max_bytes
+
+    def _delete(self, doc_id):
+        with self._doc_lock(doc_id):
+            shutil.rmtree(self._dir(doc_id), ignore_errors=True)
+        with self._lock:
+            self._doc_locks.pop(doc_id, None)
+
+    # Delete documents idle for longer than idle_seconds (at most once per CLEANUP_INTERVAL)
+    def _maybe_cleanup(self):
+        now = time.time()
+        with self._lock:
+            if now - self._last_cleanup < CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+        self.cleanup(now)
+
+    def cleanup(self, now=None):
+        cutoff = (now or time.time()) - self.idle_seconds
+        removed = []
+        try:
+            entries = list(os.scandir(self.root))
+        except OSError:
+            return removed
+        for entry in entries:
+            try:
+                idle = entry.is_dir() and entry.stat().st_mtime < cutoff
+            except OSError:
+                continue
+            if idle:
+                with self._lock:
+                    for documents in self._sessions.values():
+                        documents.pop(entry.name, None)
+                self._delete(entry.name)
+                removed.append(entry.name)
+        return removed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Process-wide document store
+def get_document_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocumentStore()
+        return _store
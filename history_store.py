@@ -0,0 +1,231 @@
+"""Append-only quiz history in SQLite (WAL mode), indexed by learner, topic and timestamp."""
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+HISTORY_DB_PATH = os.getenv("QUIZ_HISTORY_DB", "quiz_history.sqlite3")
+LEGACY_JSON_PATH = os.getenv("QUIZ_HISTORY_JSON", "quiz_history.json")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS quizzes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    difficulty TEXT NOT NULL,
+    quiz TEXT NOT NULL,
+    learner TEXT
+);
+CREATE INDEX IF NOT EXISTS quizzes_topic ON quizzes (topic, id);
+CREATE INDEX IF NOT EXISTS quizzes_timestamp ON quizzes (timestamp);
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    quiz_id INTEGER NOT NULL REFERENCES quizzes (id),
+    topic TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    question TEXT NOT NULL,
+    options TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    explanation TEXT NOT NULL,
+    selected TEXT,
+    correct INTEGER,
+    summary TEXT NOT NULL,
+    attempts INTEGER,
+    learner TEXT
+);
+CREATE INDEX IF NOT EXISTS questions_topic ON questions (topic, id);
+CREATE INDEX IF NOT EXISTS questions_quiz ON questions (quiz_id);
+CREATE TABLE IF NOT EXISTS meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# Created once the learner column is sure to exist (older databases gain it on open)
+LEARNER_INDEX = "CREATE INDEX IF NOT EXISTS questions_learner_topic ON questions (learner, topic, id)"
+
+
+# Compact one-line summary used in prompts, computed once when the question is saved
+def summarize_question(question, answer_info=None):
+    answer = question["answer"]
+    summary = f"Q: {question['question']} A: {answer}. {question['options'].get(answer, '')}".strip()
+    if answer_info is not None:
+        summary += " (student answered correctly)" if answer_info.get("correct") else " (student answered incorrectly)"
+    return summary
+
+
+def _question_rows(quiz_id, topic, questions, user_answers, learner=None):
+    rows = []
+    for position, question in enumerate(questions):
+        answer_info = user_answers.get(position)
+        rows.append((
+            quiz_id, topic, position, question["question"], json.dumps(question["options"]),
+            question["answer"], question["explanation"],
+            answer_info.get("selected") if answer_info else None,
+            int(bool(answer_info.get("correct"))) if answer_info else None,
+            summarize_question(question, answer_info),
+            answer_info.get("attempts") if answer_info else None,
+            learner,
+        ))
+    return rows
+
+
+class HistoryStore:
+    def __init__(self, path=HISTORY_DB_PATH, legacy_json_path=LEGACY_JSON_PATH, parse_legacy=None):
+        self.path = path
+        self._local = threading.local()
+        self._connection().executescript(SCHEMA)
+        self._add_missing_columns()
+        self._connection().execute(LEARNER_INDEX)
+        if legacy_json_path:
+            self.migrate_json(legacy_json_path)
+        if parse_legacy is not None:
+            self.backfill_questions(parse_legacy)
+
+    # One connection per thread; WAL lets readers run alongside the single writer and
+    # busy_timeout makes concurrent writers queue instead of failing
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # Databases created before answers recorded their attempt count, or quizzes their learner.
+    # Quizzes saved before then have no learner and belong to nobody's history.
+    def _add_missing_columns(self):
+        connection = self._connection()
+        for table, column, definition in (("questions", "attempts", "INTEGER"), ("quizzes", "learner", "TEXT"),
+                                          ("questions", "learner", "TEXT")):
+            columns = {row[1] for row in connection.execute(f"PRAGMA table_info({table})")}
+            if column not in columns:
+                try:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                except sqlite3.OperationalError:  # added concurrently by another process
+                    pass
+
+    # O(1) append: one quiz row plus its parsed questions, no read-modify-write of the history.
+    # user_answers maps question position -> {"selected": letter, "correct": bool, "attempts": tries used};
+    # learner is who took the quiz.
+    def append(self, topic, difficulty, quiz, timestamp=None, questions=None, user_answers=None, learner=None):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            quiz_id = connection.execute(
+                "INSERT INTO quizzes (timestamp, topic, difficulty, quiz, learner) VALUES (?, ?, ?, ?, ?)",
+                (timestamp or datetime.now().isoformat(), topic, difficulty, quiz, learner)
+            ).lastrowid
+            if questions:
+                connection.executemany(
+                    "INSERT INTO questions (quiz_id, topic, position, question, options, answer, explanation, "
+                    "selected, correct, summary, attempts, learner) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    _question_rows(quiz_id, topic, questions, user_answers or {}, learner)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return quiz_id
+
+    # Structured question records of one learner on a topic, oldest first (an index range scan)
+    def questions(self, learner, topic):
+        rows = self._connection().execute(
+            "SELECT topic, question, options, answer, explanation, selected, correct FROM questions "
+            "WHERE learner = ? AND topic = ? ORDER BY id", (learner, topic)
+        ).fetchall()
+        return [
+            {"topic": row[0], "question": row[1], "options": json.loads(row[2]), "answer": row[3],
+             "explanation": row[4], "selected": row[5], "correct": None if row[6] is None else bool(row[6])}
+            for row in rows
+        ]
+
+    # Every answered question of a known learner as (learner, topic, difficulty, correct, attempts),
+    # in the order answered; attempts is None for answers saved before it was recorded
+    def answers(self):
+        return self._connection().execute(
+            "SELECT questions.learner, questions.topic, quizzes.difficulty, questions.correct, questions.attempts "
+            "FROM questions JOIN quizzes ON quizzes.id = questions.quiz_id "
+            "WHERE questions.correct IS NOT NULL AND questions.learner IS NOT NULL ORDER BY questions.id"
+        ).fetchall()
+
+    # One-time import of the old quiz_history.json; the file is renamed once imported
+    def migrate_json(self, json_path):
+        if not os.path.exists(json_path):
+            return 0
+        try:
+            with open(json_path, "r") as file:
+                entries = json.load(file).get("history", [])
+        except (OSError, json.JSONDecodeError, AttributeError):
+            return 0
+
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")  # serialise concurrent migrations
+        try:
+            done = connection.execute("SELECT 1 FROM meta WHERE name = 'legacy_json_migrated'").fetchone()
+            if not done:
+                connection.executemany(
+                    "INSERT INTO quizzes (timestamp, topic, difficulty, quiz) VALUES (?, ?, ?, ?)",
+                    [
+                        (entry.get("timestamp") or datetime.now().isoformat(), entry.get("topic") or "General",
+                         entry.get("difficulty") or "Beginner", entry.get("quiz") or "")
+                        for entry in entries
+                    ]
+                )
+                connection.execute(
+                    "INSERT INTO meta (name, value) VALUES ('legacy_json_migrated', ?)", (datetime.now().isoformat(),)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+        try:
+            os.replace(json_path, f"{json_path}.migrated")
+        except OSError:
+            pass
+        return 0 if done else len(entries)
+
+
+    # One-time: parse quizzes saved as raw text only (older history) into question records
+    def backfill_questions(self, parse):
+        connection = self._connection()
+        if connection.execute("SELECT 1 FROM meta WHERE name = 'questions_backfilled'").fetchone():
+            return 0
+        legacy = connection.execute(
+            "SELECT id, topic, quiz FROM quizzes WHERE id NOT IN (SELECT DISTINCT quiz_id FROM questions)"
+        ).fetchall()
+        rows = []
+        for quiz_id, topic, quiz in legacy:
+            rows.extend(_question_rows(quiz_id, topic, parse(quiz), {}))
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if not connection.execute("SELECT 1 FROM meta WHERE name = 'questions_backfilled'").fetchone():
+                connection.executemany(
+                    "INSERT INTO questions (quiz_id, topic, position, question, options, answer, explanation, "
+                    "selected, correct, summary, attempts, learner) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows
+                )
+                connection.execute(
+                    "INSERT INTO meta (name, value) VALUES ('questions_backfilled', ?)", (datetime.now().isoformat(),)
+                )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return len(rows)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Process-wide store (opened, migrated and backfilled if needed, on first use)
+def get_history_store(parse_legacy=None):
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = HistoryStore(parse_legacy=parse_legacy)
+        return _store
@@ -0,0 +1,252 @@
+"""Structured logging, hot-path timers and counters/histograms exported as Prometheus text or JSON."""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "WARNING").strip().upper()
+# Port for a Prometheus text endpoint at /metrics (0 disables it)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+# File rewritten every METRICS_DUMP_INTERVAL seconds with a JSON snapshot (empty disables it)
+METRICS_DUMP_PATH = os.getenv("METRICS_DUMP_PATH", "")
+METRICS_DUMP_INTERVAL = float(os.getenv("METRICS_DUMP_INTERVAL", "60"))
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+# One JSON object per line: time, level, logger, event and the event's fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+_root = logging.getLogger("quiz")
+if not _root.handlers:
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(JsonFormatter())
+    _root.addHandler(_handler)
+    _root.setLevel(getattr(logging, LOG_LEVEL, logging.WARNING))
+    _root.propagate = False
+
+
+def get_logger(name):
+    return _root.getChild(name)
+
+
+# Log an event with structured fields; the fields are only serialised if the level is enabled
+def log_event(logger, level, event, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, extra={"fields": fields})
+
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+
+# Thread-safe counters and fixed-bucket histograms, keyed by name and sorted label pairs
+class Metrics:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def increment(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # Per-bucket counts (last one is +Inf), then sum and count
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: list(values) for key, values in self._histograms.items()}
+        return {
+            "counters": {_series(name, labels): value for (name, labels), value in sorted(counters.items())},
+            "histograms": {
+                _series(name, labels): {
+                    "count": values[-1],
+                    "sum": round(values[-2], 6),
+                    "mean": round(values[-2] / values[-1], 6) if values[-1] else 0.0,
+                    "buckets": dict(zip([*map(str, self.buckets), "+Inf"], values[:-2])),
+                }
+                for (name, labels), values in sorted(histograms.items())
+            },
+        }
+
+    # Prometheus text exposition format (version 0.0.4)
+    def render_prometheus(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, list(values)) for key, values in self._histograms.items())
+        lines = []
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{_series(name, labels)} {value}")
+        for (name, labels), values in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            cumulative = 0
+            for bound, count in zip([*map(str, self.buckets), "+Inf"], values[:-2]):
+                cumulative += count
+                lines.append(f"{_series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{_series(name + '_sum', labels)} {values[-2]}")
+            lines.append(f"{_series(name + '_count', labels)} {values[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+_timer_log = get_logger("timing")
+
+
+# Time a block into the `<name>_seconds` histogram; failures also count `<name>_errors_total`
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.increment(f"{name}_errors_total", **labels)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe(f"{name}_seconds", elapsed, **labels)
+        log_event(_timer_log, logging.DEBUG, name, seconds=round(elapsed, 6), **labels)
+
+
+# Decorator form of timer()
+def timed(name, **labels):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Time a block into `<name>_seconds` and its thread's CPU time into `<name>_cpu_seconds`, e.g. a
+# Streamlit fragment run (a run executes on one thread, so this is the server CPU it costs).
+# Also usable as a decorator.
+@contextmanager
+def run_timer(name, **labels):
+    start, cpu_start = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu_start
+        metrics.observe(f"{name}_seconds", elapsed, **labels)
+        metrics.observe(f"{name}_cpu_seconds", cpu, **labels)
+        log_event(_timer_log, logging.DEBUG, name, seconds=round(elapsed, 6), cpu_seconds=round(cpu, 6), **labels)
+
+
+_script_runs = 0
+_script_runs_lock = threading.Lock()
+
+
+# Time one run of the Streamlit script (which re-runs top to bottom on every interaction outside
+# a fragment) into `script_setup_seconds` (imports and module-level setup), `script_run_seconds`
+# (the whole run) and `script_run_cpu_seconds`. The process's first run is labelled
+# start="cold", since only it pays for the imports.
+def record_script_run(started, setup_done, cpu_started):
+    global _script_runs
+    finished, cpu = time.perf_counter(), time.thread_time() - cpu_started
+    with _script_runs_lock:
+        start = "cold" if not _script_runs else "warm"
+        _script_runs += 1
+    metrics.observe("script_setup_seconds", setup_done - started, start=start)
+    metrics.observe("script_run_seconds", finished - started, start=start)
+    metrics.observe("script_run_cpu_seconds", cpu, start=start)
+    log_event(_timer_log, logging.DEBUG, "script_run", start=start, setup_seconds=round(setup_done - started, 6),
+              seconds=round(finished - started, 6), cpu_seconds=round(cpu, 6))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def _dump_loop(path, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            temporary = f"{path}.tmp"
+            with open(temporary, "w") as file:
+                json.dump({"ts": time.time(), **metrics.snapshot()}, file)
+            os.replace(temporary, path)
+        except OSError as e:
+            log_event(get_logger("metrics"), logging.WARNING, "metrics_dump_failed", path=path, error=str(e))
+
+
+_exporters_started = False
+_exporters_lock = threading.Lock()
+
+
+# Start the configured exporters once per process (the endpoint and/or the periodic dump)
+def start_exporters(port=METRICS_PORT, dump_path=METRICS_DUMP_PATH, dump_interval=METRICS_DUMP_INTERVAL):
+    global _exporters_started
+    with _exporters_lock:
+        if _exporters_started:
+            return
+        _exporters_started = True
+    log = get_logger("metrics")
+    if port:
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+            log_event(log, logging.INFO, "metrics_endpoint_started", port=port)
+        except OSError as e:
+            log_event(log, logging.WARNING, "metrics_endpoint_failed", port=port, error=str(e))
+    if dump_path:
+        threading.Thread(
+            target=_dump_loop, args=(dump_path, max(1.0, dump_interval)), name="metrics-dump", daemon=True
+        ).start()
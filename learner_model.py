@@ -0,0 +1,173 @@
+"""Per-learner, per-topic ability (an Elo-style Rasch model) used to pick the next quiz's difficulty and chapter."""
+import json
+import math
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+from history_store import HISTORY_DB_PATH
+
+# Step size of each rating update; larger values adapt faster but are noisier
+LEARNER_K = float(os.getenv("LEARNER_K", "0.4"))
+# Chance of answering correctly on the first try that adaptive quizzes aim for
+TARGET_SUCCESS = float(os.getenv("LEARNER_TARGET_SUCCESS", "0.7"))
+# Item difficulty of each level, on the same logit scale as abilities (new topics start at 0)
+LEVEL_DIFFICULTY = {"Beginner": -1.0, "Intermediate": 0.0, "Advanced": 1.0}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS abilities (
+    learner TEXT NOT NULL,
+    topic TEXT NOT NULL,
+    ability REAL NOT NULL,
+    answers INTEGER NOT NULL,
+    PRIMARY KEY (learner, topic)
+);
+CREATE TABLE IF NOT EXISTS learner_meta (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+# Credit for one answer: full marks on the first try, less for each retry, none if never right
+def answer_score(correct, attempts=None):
+    if not correct:
+        return 0.0
+    return 1.0 / max(1, attempts or 1)
+
+
+# Chance that a learner of `ability` answers an item of `difficulty` (Rasch model)
+def expected_score(ability, difficulty):
+    return 1.0 / (1.0 + math.exp(difficulty - ability))
+
+
+class LearnerModel:
+    def __init__(self, path=HISTORY_DB_PATH, load_answers=None, k=LEARNER_K, levels=LEVEL_DIFFICULTY,
+                 target=TARGET_SUCCESS):
+        self.path = path
+        self.k = k
+        self.levels = dict(levels)
+        self.target = target
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connection().executescript(SCHEMA)
+        # (learner, topic) -> [ability, answer count]; a few dozen bytes each, so kept in memory
+        self._abilities = {
+            (learner, topic): [ability, answers]
+            for learner, topic, ability, answers in self._connection().execute(
+                "SELECT learner, topic, ability, answers FROM abilities"
+            )
+        }
+        if load_answers is not None and self._stored_params() != self._params():
+            self.recompute(load_answers())
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _params(self):
+        return json.dumps({"k": self.k, "levels": self.levels}, sort_keys=True)
+
+    def _stored_params(self):
+        row = self._connection().execute("SELECT value FROM learner_meta WHERE name = 'params'").fetchone()
+        return row[0] if row else None
+
+    def ability(self, learner, topic):
+        return self._abilities.get((learner, topic), (0.0, 0))[0]
+
+    def answer_count(self, learner, topic):
+        return self._abilities.get((learner, topic), (0.0, 0))[1]
+
+    # O(1) update per answer: move the learner's ability on the topic by k times the surprise
+    def record(self, learner, topic, difficulty, correct, attempts=None):
+        score = answer_score(correct, attempts)
+        with self._lock:
+            entry = self._abilities.setdefault((learner, topic), [0.0, 0])
+            entry[0] += self.k * (score - expected_score(entry[0], self.levels.get(difficulty, 0.0)))
+            entry[1] += 1
+            ability, answers = entry
+        self._connection().execute(
+            "INSERT OR REPLACE INTO abilities (learner, topic, ability, answers) VALUES (?, ?, ?, ?)",
+            (learner, topic, ability, answers)
+        )
+
+    # Level whose expected first-try success is closest to the target
+    def recommend_difficulty(self, learner, topic):
+        ability = self.ability(learner, topic)
+        return min(self.levels, key=lambda level: abs(expected_score(ability, self.levels[level]) - self.target))
+
+    # Index of the chapter (by title) the learner should practise next: the weakest one,
+    # unpractised ones first on ties
+    def weakest(self, learner, titles):
+        if not titles:
+            return None
+        return min(range(len(titles)),
+                   key=lambda i: (self.ability(learner, titles[i]), self.answer_count(learner, titles[i])))
+
+    # Rebuild every ability from the stored answers (learner, topic, difficulty, correct, attempts),
+    # oldest first, e.g. after the model parameters change. The replay is vectorised across
+    # learner-topic pairs: step i applies every pair's i-th answer at once, so it takes as many
+    # NumPy steps as the longest history, giving the same ratings as recording the answers one by one.
+    def recompute(self, answers):
+        answers = list(answers)
+        keys = {}
+        codes = np.array([keys.setdefault((answer[0], answer[1]), len(keys)) for answer in answers], dtype=np.int64)
+        pairs = list(keys)
+        difficulty = np.array([self.levels.get(answer[2], 0.0) for answer in answers], dtype=np.float64)
+        scores = np.array([answer_score(answer[3], answer[4]) for answer in answers], dtype=np.float64)
+
+        # Position of each answer within its learner-topic history
+        order = np.argsort(codes, kind="stable")
+        counts = np.bincount(codes, minlength=len(pairs))
+        starts = np.cumsum(counts) - counts
+        rank = np.empty(len(answers), dtype=np.int64)
+        rank[order] = np.arange(len(answers)) - np.repeat(starts, counts)
+
+        abilities = np.zeros(len(pairs))
+        by_rank = np.argsort(rank, kind="stable")
+        bounds = np.searchsorted(rank[by_rank], np.arange(counts.max() + 1 if len(counts) else 1))
+        for step in range(len(bounds) - 1):
+            batch = by_rank[bounds[step]:bounds[step + 1]]
+            current = abilities[codes[batch]]
+            abilities[codes[batch]] = current + self.k * (scores[batch] - 1.0 / (1.0 + np.exp(difficulty[batch] - current)))
+
+        rows = [
+            (str(learner), str(topic), float(ability), int(count))
+            for (learner, topic), ability, count in zip(pairs, abilities, counts)
+        ]
+        connection = self._connection()
+        with self._lock:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.execute("DELETE FROM abilities")
+                connection.executemany(
+                    "INSERT INTO abilities (learner, topic, ability, answers) VALUES (?, ?, ?, ?)", rows
+                )
+                connection.execute("INSERT OR REPLACE INTO learner_meta (name, value) VALUES ('params', ?)", (self._params(),))
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            self._abilities = {(learner, topic): [ability, count] for learner, topic, ability, count in rows}
+        return len(rows)
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+# Process-wide model; load_answers() returns the stored answers for a recompute when the
+# parameters have changed since the ratings were last built
+def get_learner_model(load_answers=None):
+    global _model
+    with _model_lock:
+        if _model is None:
+            _model = LearnerModel(load_answers=load_answers)
+        return _model
@@ -0,0 +1,74 @@
+"""Shared HTTP transport for the OpenAI-compatible chat completions endpoint."""
+import os
+import sys
+import threading
+
+# Endpoint (override to point at a proxy or a local stub server)
+BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
+COMPLETIONS_URL = f"{BASE_URL}/chat/completions"
+
+# Connection pool and retry policy
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "32"))
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.5"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+REQUEST_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+
+
+# Retry 429/5xx with jittered exponential backoff, waiting for Retry-After when the server
+# sends one. Read errors are not retried: a timed-out generation would just time out again.
+# backoff_jitter needs urllib3 2, which requirements.txt pins.
+def build_retry():
+    from urllib3.util.retry import Retry
+    return Retry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=0,
+        status=MAX_RETRIES,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"POST"}),
+        backoff_factor=BACKOFF_FACTOR,
+        backoff_jitter=BACKOFF_JITTER,
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+# Build a keep-alive session whose pool can hold a connection per concurrent request.
+# requests is imported here, with the first session, so script runs that make no API call
+# (the first page render) don't wait for it.
+def create_session(pool_size=POOL_SIZE):
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=build_retry())
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+# One session per process, shared by every Streamlit session and worker thread, so
+# requests reuse warm TCP+TLS connections instead of handshaking every time
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = create_session()
+        return _session
+
+
+# POST a chat completion request through the shared session
+def post_chat_completion(data, headers, stream=False, timeout=REQUEST_TIMEOUT):
+    return get_session().post(COMPLETIONS_URL, headers=headers, json=data, timeout=timeout, stream=stream)
+
+
+# Whether an exception came from the HTTP transport (connection errors, timeouts, ...)
+def is_transport_error(error):
+    requests = sys.modules.get("requests")
+    return requests is not None and isinstance(error, requests.exceptions.RequestException)
@@ -0,0 +1,462 @@
+"""PDF text extraction with a persistent, content-addressed cache of per-page text, and an OCR fallback for scanned pages."""
+import hashlib
+import importlib.util
+import io
+import json
+import math
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from instrumentation import metrics
+
+# Cache location and size bound (shared by every session on this machine)
+CACHE_DIR = os.getenv("PDF_CACHE_DIR", os.path.join(".cache", "pdf_text"))
+CACHE_MAX_BYTES = int(os.getenv("PDF_CACHE_MAX_MB", "512")) * 1024 * 1024
+
+# Parallel extraction: worker processes, and the page count below which serial is faster
+EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "40"))
+
+# OCR of pages without a text layer (scans): "auto" when pytesseract, Pillow and the tesseract
+# binary are installed, "off" to disable. Runs in its own process pool so scanned books don't
+# hold up other uploads' extraction.
+OCR_MODE = os.getenv("PDF_OCR", "auto").strip().lower()
+OCR_WORKERS = int(os.getenv("PDF_OCR_WORKERS", "2"))
+OCR_PAGE_TIMEOUT = float(os.getenv("PDF_OCR_PAGE_TIMEOUT", "60"))
+OCR_LANGUAGE = os.getenv("PDF_OCR_LANG", "eng")
+# Recognised text per page image, so a page is only OCR'd once whatever document it comes in
+OCR_CACHE_DIR = os.getenv("PDF_OCR_CACHE_DIR", os.path.join(".cache", "ocr_text"))
+
+
+# pypdf is imported when the first PDF is opened rather than with this module, so the app's
+# first page render (before anything is uploaded) doesn't wait for it
+def open_pdf(pdf_bytes):
+    from pypdf import PdfReader
+    return PdfReader(io.BytesIO(pdf_bytes))
+
+
+def pypdf_version():
+    from pypdf import __version__
+    return __version__
+
+
+# Read the raw bytes of an upload (Streamlit UploadedFile, file object or path)
+def read_pdf_bytes(pdf_file):
+    if isinstance(pdf_file, (bytes, bytearray)):
+        return bytes(pdf_file)
+    if isinstance(pdf_file, (str, os.PathLike)):
+        with open(pdf_file, "rb") as file:
+            return file.read()
+    if hasattr(pdf_file, "getvalue"):
+        return pdf_file.getvalue()
+    pdf_file.seek(0)
+    return pdf_file.read()
+
+
+# Cache key: SHA-256 of the PDF bytes plus the pypdf version, so upgrading pypdf
+# (which can change extraction output) never serves text from the old version
+def document_key(pdf_bytes):
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    return f"{digest}-pypdf{pypdf_version()}"
+
+
+# On-disk cache of extracted pages, one JSON file per document, LRU-evicted by total size
+class ExtractionCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                pages = json.load(file)["pages"]
+        except (OSError, json.JSONDecodeError, KeyError):
+            return None
+        # Bump the mtime so eviction treats this entry as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return pages
+
+    def put(self, key, pages):
+        # Write to a temp file and rename so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump({"pypdf": pypdf_version(), "pages": pages}, file)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    # Drop least recently used entries until the cache fits in max_bytes
+    def evict(self):
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Process-wide cache instance (this module is imported once, so it survives Streamlit reruns)
+def get_extraction_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ExtractionCache()
+        return _cache
+
+
+# Start method for worker processes. Streamlit serves sessions from many threads, and forking a
+# multithreaded process can copy locks held by other threads into the child; forkserver (or
+# spawn where it doesn't exist) starts workers from a clean single-threaded process instead.
+def pool_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+# Process pools are created lazily and reused, one per worker count
+def get_extraction_pool(workers):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=pool_context())
+            _pools[workers] = pool
+        return pool
+
+
+def _discard_extraction_pool(workers):
+    with _pools_lock:
+        pool = _pools.pop(workers, None)
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Worker entry point: each process parses the PDF itself and extracts pages [start, stop)
+def _extract_page_range(pdf_bytes, start, stop):
+    pdf_reader = open_pdf(pdf_bytes)
+    return [pdf_reader.pages[index].extract_text() or "" for index in range(start, stop)]
+
+
+# Split page_count pages into at most shard_count contiguous (start, stop) ranges
+def shard_page_ranges(page_count, shard_count):
+    shard_size = max(1, math.ceil(page_count / max(1, shard_count)))
+    return [(start, min(start + shard_size, page_count)) for start in range(0, page_count, shard_size)]
+
+
+# Shard page ranges across the process pool and join the results back in page order
+def extract_pages_parallel(pdf_bytes, page_count, workers):
+    pool = get_extraction_pool(workers)
+    futures = [
+        pool.submit(_extract_page_range, pdf_bytes, start, stop)
+        for start, stop in shard_page_ranges(page_count, workers)
+    ]
+    pages = []
+    for future in futures:
+        pages.extend(future.result())
+    return pages
+
+
+# Extract the text of every page, in order. Small documents (or workers <= 1) are
+# extracted serially, since process start-up and pickling would dominate.
+def extract_pages(pdf_bytes, workers=None):
+    workers = EXTRACT_WORKERS if workers is None else workers
+    pdf_reader = open_pdf(pdf_bytes)
+    page_count = len(pdf_reader.pages)
+    if workers > 1 and page_count >= PARALLEL_MIN_PAGES:
+        try:
+            return extract_pages_parallel(pdf_bytes, page_count, workers)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); drop the pool and fall back to serial
+            _discard_extraction_pool(workers)
+    return [page.extract_text() or "" for page in pdf_reader.pages]
+
+
+# Yield page texts one at a time, parsing each page only when the consumer asks for it.
+# Cached documents are served from the cache; a complete pass populates it.
+def iter_pdf_pages(pdf_bytes, cache=None):
+    cache = cache or get_extraction_cache()
+    key = document_key(pdf_bytes)
+    pages = cache.get(key)
+    if pages is not None:
+        yield from pages
+        return
+
+    pdf_reader = open_pdf(pdf_bytes)
+    extracted = []
+    for page in pdf_reader.pages:
+        text = page.extract_text() or ""
+        if not text.strip() and ocr_available():
+            text = recognise_pages({0: page_images(page)}).get(0, text)
+        extracted.append(text)
+        yield text
+    cache.put(key, extracted)
+
+
+# Consume pages until more than max_chars of text has been read, then stop extracting.
+# The result is capped at max_chars + 1 so callers can still tell the text was cut.
+def read_text_budget(pages, max_chars):
+    parts = []
+    total = 0
+    for text in pages:
+        parts.append(text)
+        total += len(text)
+        if total > max_chars:
+            break
+    return "".join(parts)[:max_chars + 1]
+
+
+# Return (document key, list of page texts), extracting only on a cache miss. Pages without
+# text are OCR'd; cached documents get another try too, in case OCR was unavailable (or timed
+# out) when they were cached.
+def load_pdf_pages(pdf_bytes, cache=None, workers=None):
+    cache = cache or get_extraction_cache()
+    key = document_key(pdf_bytes)
+    pages = cache.get(key)
+    extracted = pages is None
+    if extracted:
+        pages = extract_pages(pdf_bytes, workers=workers)
+    if ocr_empty_pages(pdf_bytes, pages) or extracted:
+        cache.put(key, pages)
+    return key, pages
+
+
+_ocr_available = None
+_ocr_cache = None
+_ocr_pool = None
+_ocr_lock = threading.Lock()
+
+
+# pytesseract and Pillow are optional: without them, or without the tesseract
+# binary, pages without a text layer stay empty
+def ocr_available():
+    global _ocr_available
+    with _ocr_lock:
+        if _ocr_available is None:
+            _ocr_available = False
+            if OCR_MODE != "off":
+                try:
+                    import pytesseract
+                    pytesseract.get_tesseract_version()
+                    # Pillow is only needed by the workers, so it is looked up rather than imported
+                    _ocr_available = importlib.util.find_spec("PIL") is not None
+                except Exception:
+                    pass
+        return _ocr_available
+
+
+def get_ocr_cache():
+    global _ocr_cache
+    with _ocr_lock:
+        if _ocr_cache is None:
+            _ocr_cache = ExtractionCache(OCR_CACHE_DIR)
+        return _ocr_cache
+
+
+def get_ocr_pool():
+    global _ocr_pool
+    with _ocr_lock:
+        if _ocr_pool is None:
+            _ocr_pool = ProcessPoolExecutor(max_workers=max(1, OCR_WORKERS), mp_context=pool_context())
+        return _ocr_pool
+
+
+def _discard_ocr_pool(pool):
+    global _ocr_pool
+    with _ocr_lock:
+        if _ocr_pool is pool:
+            _ocr_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+# Encoded images drawn on a page (a scanned page is usually one full-page image)
+def page_images(page):
+    try:
+        return [image.data for image in page.images]
+    except Exception:
+        return []
+
+
+# Worker entry point: Tesseract over each image of one page. Tesseract runs as a subprocess
+# that pytesseract kills once `timeout` seconds have passed.
+def _ocr_images(images, language, timeout):
+    import pytesseract
+    from PIL import Image
+
+    texts = []
+    for data in images:
+        with Image.open(io.BytesIO(data)) as image:
+            texts.append(pytesseract.image_to_string(image, lang=language, timeout=timeout).strip())
+    return "\n".join(text for text in texts if text)
+
+
+# Cache key of one page's OCR: the page's images and the OCR language
+def ocr_key(images, language=OCR_LANGUAGE):
+    digest = hashlib.sha256(language.encode("utf-8"))
+    for data in images:
+        digest.update(hashlib.sha256(data).digest())
+    return f"{digest.hexdigest()}-ocr"
+
+
+# OCR pages given as {index: [encoded images]}; returns {index: text} for the pages recognised.
+# At most `window` of one call's pages are in the shared pool at once, so concurrent scanned
+# uploads take turns instead of queueing behind a whole book. Pages that time out or fail are
+# left out (and retried on a later load).
+def recognise_pages(images_by_page, window=None, timeout=OCR_PAGE_TIMEOUT):
+    cache = get_ocr_cache()
+    recognised = {}
+    pending = []
+    for index, images in images_by_page.items():
+        if not images:
+            continue
+        key = ocr_key(images)
+        cached = cache.get(key)
+        if cached is not None:
+            recognised[index] = cached[0]
+            metrics.increment("pdf_ocr_pages_total", result="cached")
+        else:
+            pending.append((index, key, images))
+    if not pending:
+        return recognised
+
+    pool = get_ocr_pool()
+    window = max(1, window or OCR_WORKERS)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < window:
+                index, key, images = pending.pop(0)
+                in_flight[pool.submit(_ocr_images, images, OCR_LANGUAGE, timeout)] = (index, key, time.monotonic())
+            # Each image is bounded by Tesseract's own timeout; a page taking far longer than
+            # that means a stuck worker
+            done, _ = wait(in_flight, timeout=timeout * 2 + 10, return_when=FIRST_COMPLETED)
+            if not done:
+                raise TimeoutError("OCR workers stopped making progress")
+            for future in done:
+                index, key, started = in_flight.pop(future)
+                try:
+                    text = future.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    # pytesseract reports its timeout as a RuntimeError
+                    result = "timeout" if "timeout" in str(e).lower() else "failed"
+                    metrics.increment("pdf_ocr_pages_total", result=result)
+                    continue
+                metrics.increment("pdf_ocr_pages_total", result="ok")
+                metrics.observe("pdf_ocr_page_seconds", time.monotonic() - started)
+                cache.put(key, [text])
+                recognised[index] = text
+    except (BrokenProcessPool, TimeoutError):
+        # A worker died or hung; replace the pool and leave the remaining pages empty
+        metrics.increment("pdf_ocr_pages_total", len(pending) + len(in_flight), result="failed")
+        _discard_ocr_pool(pool)
+    return recognised
+
+
+# Fill in pages that have no text by OCR, in place; returns how many were filled
+def ocr_empty_pages(pdf_bytes, pages):
+    empty = [index for index, text in enumerate(pages) if not text.strip()]
+    if not empty or not ocr_available():
+        return 0
+    reader = open_pdf(pdf_bytes)
+    recognised = recognise_pages({index: page_images(reader.pages[index]) for index in empty})
+    filled = 0
+    for index, text in recognised.items():
+        if text.strip():
+            pages[index] = text
+            filled += 1
+    return filled
+
+
+# Bookmarks as [(title, first page (1-based), nesting level)] in page order; [] if there are none
+def extract_outline(pdf_bytes):
+    reader = open_pdf(pdf_bytes)
+    entries = []
+
+    def walk(items, level):
+        for item in items:
+            if isinstance(item, list):
+                walk(item, level + 1)
+                continue
+            try:
+                page = reader.get_destination_page_number(item)
+            except Exception:
+                continue
+            title = " ".join((getattr(item, "title", None) or "").split())
+            if title and page is not None and page >= 0:
+                entries.append((title[:120], page + 1, level))
+
+    try:
+        walk(reader.outline, 0)
+    except Exception:
+        return []
+    entries.sort(key=lambda entry: entry[1])
+    return entries
+
+
+# Title from the PDF metadata, or None
+def document_title(pdf_bytes):
+    try:
+        metadata = open_pdf(pdf_bytes).metadata
+        title = " ".join((metadata.title or "").split()) if metadata else ""
+    except Exception:
+        return None
+    return title or None
+
+
+HEADING_RE = re.compile(
+    r"^(?:chapter|section|part|unit|lesson|module)\s+(?:\d+|[ivxlc]+)\b(?:[.:\s-]+\w.{0,100})?$", re.IGNORECASE
+)
+
+
+# Outline for PDFs without bookmarks: pages whose first lines carry a "Chapter 3 ..." style heading
+def heading_outline(pages, max_lines=3):
+    entries = []
+    for number, text in enumerate(pages, start=1):
+        for line in text.splitlines()[:max_lines]:
+            line = " ".join(line.split())
+            if HEADING_RE.match(line):
+                entries.append((line[:120], number, 0))
+                break
+    return entries
@@ -0,0 +1,141 @@
+"""Token counting and per-request prompt budgets (tiktoken when installed, a character heuristic otherwise)."""
+import functools
+import logging
+import math
+import os
+
+from instrumentation import get_logger, log_event
+
+log = get_logger("prompt_budget")
+
+# Tokens allowed for the whole prompt (system message, instructions, textbook content and questions to avoid)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+# Share of the variable part of the budget a regeneration may spend listing near-duplicate
+# questions to avoid; whatever the list doesn't use goes to content
+AVOID_TOKEN_SHARE = float(os.getenv("AVOID_TOKEN_SHARE", "0.1"))
+# Expected completion tokens per generated question, and the completion cap per request
+TOKENS_PER_QUESTION = int(os.getenv("TOKENS_PER_QUESTION", "180"))
+MAX_OUTPUT_TOKENS = int(os.getenv("MAX_OUTPUT_TOKENS", "2048"))
+# Overrides the context window looked up from MODEL_CONTEXT_TOKENS
+CONTEXT_TOKENS = int(os.getenv("MODEL_CONTEXT_TOKENS", "0"))
+
+# Context windows by model name prefix (longest match wins)
+MODEL_CONTEXT_TOKENS = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4.1": 1047576,
+    "o1": 200000,
+    "o3": 200000,
+}
+DEFAULT_CONTEXT_TOKENS = 8192
+
+# Characters per token for English prose, used when tiktoken isn't installed
+CHARS_PER_TOKEN = 4.0
+
+
+def context_window(model):
+    if CONTEXT_TOKENS:
+        return CONTEXT_TOKENS
+    matches = [prefix for prefix in MODEL_CONTEXT_TOKENS if model.startswith(prefix)]
+    return MODEL_CONTEXT_TOKENS[max(matches, key=len)] if matches else DEFAULT_CONTEXT_TOKENS
+
+
+# tiktoken is imported when the first tokenizer is built rather than with this module, so
+# importing the app doesn't wait for it (or for its encoding files); None when not installed
+def load_tiktoken():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken
+
+
+class Tokenizer:
+    def __init__(self, model):
+        self.encoding = None
+        tiktoken = load_tiktoken()
+        if tiktoken is not None:
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding("cl100k_base")
+        # Short strings such as rejected questions and fixed notes recur across requests
+        self.count_cached = functools.lru_cache(maxsize=4096)(self.count)
+
+    def count(self, text):
+        if self.encoding is not None:
+            return len(self.encoding.encode(text, disallowed_special=()))
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    # Return (text cut to at most max_tokens, whether anything was cut)
+    def truncate(self, text, max_tokens):
+        max_tokens = max(0, max_tokens)
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text, disallowed_special=())
+            if len(tokens) <= max_tokens:
+                return text, False
+            return self.encoding.decode(tokens[:max_tokens]), True
+        limit = int(max_tokens * CHARS_PER_TOKEN)
+        return text[:limit], len(text) > limit
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(model):
+    tokenizer = Tokenizer(model)
+    if tokenizer.encoding is None:
+        log_event(log, logging.WARNING, "tokenizer_fallback", model=model, chars_per_token=CHARS_PER_TOKEN)
+    return tokenizer
+
+
+# Splits a model's token budget between the fixed prompt, textbook content, questions to avoid and output
+class PromptBudget:
+    def __init__(self, model, prompt_tokens=PROMPT_TOKEN_BUDGET, avoid_share=AVOID_TOKEN_SHARE,
+                 tokens_per_question=TOKENS_PER_QUESTION, max_output_tokens=MAX_OUTPUT_TOKENS):
+        self.tokenizer = get_tokenizer(model)
+        window = context_window(model)
+        # Always leave room for at least one question's worth of output
+        self.prompt_tokens = max(256, min(prompt_tokens, window - tokens_per_question))
+        self.output_tokens = max(tokens_per_question, min(max_output_tokens, window - self.prompt_tokens))
+        self.avoid_share = min(max(avoid_share, 0.0), 1.0)
+        self.tokens_per_question = max(1, tokens_per_question)
+
+    def count(self, text):
+        return self.tokenizer.count(text)
+
+    def truncate(self, text, max_tokens):
+        return self.tokenizer.truncate(text, max_tokens)
+
+    # Return (avoid-list tokens, content tokens) left once `fixed_tokens` are spent
+    def allocate(self, fixed_tokens):
+        available = max(0, self.prompt_tokens - fixed_tokens)
+        avoid_tokens = int(available * self.avoid_share)
+        return avoid_tokens, available - avoid_tokens
+
+    # The last lines (given oldest first) that fit in max_tokens, oldest first
+    def fit_lines(self, lines, max_tokens):
+        kept = []
+        used = 0
+        for line in reversed(lines):
+            cost = self.tokenizer.count_cached(line) + 1  # newline
+            if used + cost > max_tokens:
+                break
+            kept.append(line)
+            used += cost
+        kept.reverse()
+        return kept, used
+
+    # Questions one request can ask for without its answer outgrowing the output budget
+    def questions_per_request(self, requested):
+        return max(1, min(requested, self.output_tokens // self.tokens_per_question))
+
+    # Upper estimate of the textbook characters one prompt can use, for sizing extraction
+    def content_chars(self):
+        return int(self.prompt_tokens * CHARS_PER_TOKEN)
+
+
+# One budget per model, built on first use (with its tokenizer) and kept across reruns
+@functools.lru_cache(maxsize=None)
+def get_prompt_budget(model):
+    return PromptBudget(model)
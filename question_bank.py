@@ -0,0 +1,99 @@
+"""Offline question bank: questions pre-generated per PDF chunk and difficulty, stored as Parquet and served without API calls."""
+import json
+import os
+import threading
+
+import numpy as np
+
+from quiz_schema import OPTION_KEYS
+
+# Compacted bank written by build_question_bank.py (empty disables serving from a bank)
+BANK_PATH = os.getenv("QUESTION_BANK_PATH", os.path.join("question_bank", "bank.parquet"))
+
+COLUMNS = [
+    "doc_id", "document", "chunk", "first_page", "last_page", "topic", "difficulty",
+    "question", "option_a", "option_b", "option_c", "option_d", "answer", "explanation",
+]
+# Repeated strings are stored once per file
+CATEGORY_COLUMNS = ["doc_id", "document", "topic", "difficulty"]
+
+
+# One bank row per question of a finished (document, chunk, difficulty) unit
+def question_rows(doc_id, document, chunk, first_page, last_page, topic, difficulty, questions):
+    import pandas as pd
+    return pd.DataFrame(
+        [
+            [doc_id, document, chunk, first_page, last_page, topic, difficulty, question["question"],
+             *(question["options"].get(key, "") for key in OPTION_KEYS), question["answer"], question["explanation"]]
+            for question in questions
+        ],
+        columns=COLUMNS,
+    )
+
+
+def write_parquet(frame, path):
+    frame = frame.astype({column: "category" for column in CATEGORY_COLUMNS})
+    frame.to_parquet(f"{path}.tmp", index=False, compression="zstd")
+    os.replace(f"{path}.tmp", path)
+
+
+# Raw output saved to history for questions served from the bank (shaped like a JSON-mode response)
+def quiz_output(questions):
+    return json.dumps({"questions": questions})
+
+
+class QuestionBank:
+    def __init__(self, path=BANK_PATH):
+        self.path = path
+        self._frame = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    # The bank as a DataFrame (None if there is none), reloaded when the file is rebuilt
+    def frame(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        with self._lock:
+            if mtime != self._mtime:
+                import pandas as pd  # Only once there is a bank to load; it's slow to import
+                self._frame = pd.read_parquet(self.path, columns=COLUMNS)
+                self._mtime = mtime
+            return self._frame
+
+    # Banked questions for the documents and level in random order, optionally only from
+    # chunks overlapping page_range (first, last). A generator, so callers can stop as soon
+    # as they have enough questions that aren't repeats.
+    def draw(self, doc_ids, difficulty, page_range=None, rng=None):
+        frame = self.frame()
+        if frame is None:
+            return
+        mask = frame["doc_id"].isin(doc_ids).to_numpy() & (frame["difficulty"] == difficulty).to_numpy()
+        if page_range:
+            first, last = page_range
+            mask &= (frame["first_page"] <= last).to_numpy() & (frame["last_page"] >= first).to_numpy()
+        rows = np.flatnonzero(mask)
+        (rng or np.random.default_rng()).shuffle(rows)
+        for row in frame.iloc[rows].itertuples(index=False):
+            yield {
+                "question": row.question,
+                "options": dict(zip(OPTION_KEYS, (row.option_a, row.option_b, row.option_c, row.option_d))),
+                "answer": row.answer,
+                "explanation": row.explanation,
+            }
+
+
+_bank = None
+_bank_lock = threading.Lock()
+
+
+# Process-wide bank, or None when serving from a bank is disabled
+def get_question_bank():
+    global _bank
+    if not BANK_PATH:
+        return None
+    with _bank_lock:
+        if _bank is None:
+            _bank = QuestionBank()
+        return _bank
@@ -0,0 +1,125 @@
+"""JSON output mode for quiz generation: schema, validation/repair, and parse statistics."""
+import json
+import re
+import threading
+
+OPTION_KEYS = ("A", "B", "C", "D")
+
+# Structured-output schema sent with response_format (strict mode needs every property
+# required and additionalProperties disabled)
+QUIZ_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question": {"type": "string"},
+                    "options": {
+                        "type": "object",
+                        "properties": {key: {"type": "string"} for key in OPTION_KEYS},
+                        "required": list(OPTION_KEYS),
+                        "additionalProperties": False,
+                    },
+                    "answer": {"type": "string", "enum": list(OPTION_KEYS)},
+                    "explanation": {"type": "string"},
+                },
+                "required": ["question", "options", "answer", "explanation"],
+                "additionalProperties": False,
+            },
+        }
+    },
+    "required": ["questions"],
+    "additionalProperties": False,
+}
+
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "quiz", "strict": True, "schema": QUIZ_JSON_SCHEMA},
+}
+
+OPTION_PREFIX_RE = re.compile(r"^\(?[A-Da-d][.)]\s*")
+ANSWER_RE = re.compile(r"^\s*\(?([A-Da-d])\b")
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else ""
+
+
+# Validate one question object against the schema, repairing common near-misses
+# (options as a list, "A. " prefixes in option text, "b" or "B. text" answers).
+# Returns the question in parse_quiz's shape, or None if it can't be used.
+def validate_question(item):
+    if not isinstance(item, dict):
+        return None
+    question = _text(item.get("question"))
+    explanation = _text(item.get("explanation"))
+
+    options = item.get("options")
+    if isinstance(options, list) and len(options) == 4:
+        options = dict(zip(OPTION_KEYS, options))
+    if not isinstance(options, dict):
+        return None
+    options = {key.strip().upper(): OPTION_PREFIX_RE.sub("", _text(value)) for key, value in options.items()
+               if isinstance(key, str)}
+
+    answer_match = ANSWER_RE.match(item.get("answer") or "") if isinstance(item.get("answer"), str) else None
+    answer = answer_match.group(1).upper() if answer_match else None
+
+    if not question or not explanation or answer not in OPTION_KEYS:
+        return None
+    if sorted(options) != list(OPTION_KEYS) or not all(options.values()):
+        return None
+    return {
+        "question": question,
+        "options": {key: options[key] for key in OPTION_KEYS},
+        "answer": answer,
+        "explanation": explanation,
+    }
+
+
+# Parse a JSON quiz response into (valid questions, number of invalid items).
+# Returns None when the text isn't JSON at all, so callers can fall back to parse_quiz.
+def parse_quiz_json(text):
+    try:
+        payload = json.loads(text)
+    except (TypeError, json.JSONDecodeError):
+        # Models sometimes wrap JSON in a code fence
+        fenced = re.search(r"```(?:json)?\s*(.*?)```", text or "", re.DOTALL)
+        if not fenced:
+            return None
+        try:
+            payload = json.loads(fenced.group(1))
+        except json.JSONDecodeError:
+            return None
+
+    items = payload.get("questions") if isinstance(payload, dict) else payload
+    if not isinstance(items, list):
+        return None
+    questions = [question for question in map(validate_question, items) if question]
+    return questions, len(items) - len(questions)
+
+
+# Process-wide counters: how often responses fail to parse and what retries cost
+class GenerationStats:
+    FIELDS = ("responses", "parse_failures", "json_decode_failures", "invalid_questions", "retry_calls")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def record(self, **increments):
+        with self._lock:
+            for name, value in increments.items():
+                self.counts[name] += value
+
+    def snapshot(self):
+        with self._lock:
+            counts = dict(self.counts)
+        responses = counts["responses"]
+        counts["parse_failure_rate"] = counts["parse_failures"] / responses if responses else 0.0
+        return counts
+
+
+generation_stats = GenerationStats()
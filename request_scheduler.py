@@ -0,0 +1,222 @@
+"""Process-wide scheduler for completion requests: RPM/TPM token buckets, a fair per-session queue and merging of identical in-flight requests."""
+import contextvars
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+from instrumentation import metrics
+
+# Account limits for the configured model (0 disables a limit)
+RATE_LIMIT_RPM = float(os.getenv("RATE_LIMIT_RPM", "500"))
+RATE_LIMIT_TPM = float(os.getenv("RATE_LIMIT_TPM", "200000"))
+# Burst allowed above the steady rate, in seconds of the limit; providers enforce limits over
+# windows shorter than a minute, so a full minute's worth at once would still draw 429s
+BURST_SECONDS = float(os.getenv("RATE_LIMIT_BURST_SECONDS", "6"))
+
+# Queue that requests made in this context wait in; set per Streamlit session by the app
+current_session = contextvars.ContextVar("current_session", default="background")
+
+
+# Raised to followers when the request they joined was abandoned before it finished
+class RequestAbandoned(Exception):
+    pass
+
+
+# Holds `burst_seconds` worth of the limit and refills at the rest of it, so no 60-second
+# window admits more than rate_per_minute. Not thread-safe on its own; the scheduler's lock
+# guards it.
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst_seconds=BURST_SECONDS):
+        rate_per_minute = max(0.0, rate_per_minute)
+        self.capacity = max(1.0, rate_per_minute * min(burst_seconds, 30.0) / 60.0)
+        self.rate = max(0.0, rate_per_minute - self.capacity) / 60.0 if rate_per_minute else 0.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` can be taken. Amounts above the capacity only wait for a full
+    # bucket and then drive it negative, so the long-run rate still holds.
+    def wait_time(self, amount, now):
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        needed = min(amount, self.capacity)
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+    def take(self, amount, now):
+        if self.rate:
+            self._refill(now)
+            self.level -= amount
+
+    def give_back(self, amount, now):
+        if self.rate:
+            self._refill(now)
+            self.level = min(self.capacity, self.level + amount)
+
+
+class _Ticket:
+    __slots__ = ("session", "tokens", "created", "granted")
+
+    def __init__(self, session, tokens):
+        self.session = session
+        self.tokens = tokens
+        self.created = time.monotonic()
+        self.granted = False
+
+
+class RequestScheduler:
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self._condition = threading.Condition()
+        self._queues = OrderedDict()  # session -> deque of waiting tickets, in round-robin order
+        self._inflight = {}  # merge key -> Future of the leader's result
+        self._paused_until = 0.0
+        self._dispatcher = None
+
+    # Block until the limits admit one request estimated at `tokens`. Sessions take turns, so
+    # one session's burst of sub-requests can't starve the others. Returns the ticket to settle.
+    def acquire(self, tokens, session=None):
+        ticket = _Ticket(session or current_session.get(), tokens)
+        with self._condition:
+            self._queues.setdefault(ticket.session, deque()).append(ticket)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, name="request-scheduler", daemon=True)
+                self._dispatcher.start()
+            self._condition.notify_all()
+            self._condition.wait_for(lambda: ticket.granted)
+        metrics.observe("scheduler_wait_seconds", time.monotonic() - ticket.created)
+        return ticket
+
+    # Refund the estimate's excess once the request's real token usage is known
+    def settle(self, ticket, used_tokens):
+        with self._condition:
+            self.tokens.give_back(ticket.tokens - used_tokens, time.monotonic())
+            self._condition.notify_all()
+
+    # Admit nothing for `seconds`, e.g. when the API still answers 429 after its retries
+    def pause(self, seconds):
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        metrics.increment("scheduler_pauses_total")
+
+    # Requests from other sessions that will be admitted before this session's next one, or
+    # None when the session has nothing waiting
+    def queue_position(self, session):
+        with self._condition:
+            for position, queued in enumerate(self._queues):
+                if queued == session:
+                    return position
+        return None
+
+    def _dispatch(self):
+        with self._condition:
+            while True:
+                if not self._queues:
+                    self._condition.wait()
+                    continue
+                session, queue = next(iter(self._queues.items()))
+                ticket = queue[0]
+                now = time.monotonic()
+                wait = max(
+                    self._paused_until - now,
+                    self.requests.wait_time(1, now),
+                    self.tokens.wait_time(ticket.tokens, now),
+                )
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                queue.popleft()
+                if queue:
+                    self._queues.move_to_end(session)
+                else:
+                    del self._queues[session]
+                self.requests.take(1, now)
+                self.tokens.take(ticket.tokens, now)
+                ticket.granted = True
+                self._condition.notify_all()
+
+    # Leader for `key` (returns (True, future)) or the in-flight request to wait for (False, future)
+    def _join(self, key):
+        with self._condition:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self._inflight[key] = Future()
+                return True, future
+        metrics.increment("scheduler_merged_total")
+        return False, future
+
+    def _finish(self, key, future, result=None, error=None):
+        with self._condition:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    # Run fetch() unless an identical request (same key) is already in flight, in which case
+    # wait for it and share its result
+    def merged(self, key, fetch):
+        while True:
+            leader, future = self._join(key)
+            if leader:
+                break
+            try:
+                return future.result()
+            except RequestAbandoned:
+                continue
+        try:
+            result = fetch()
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        except BaseException:
+            self._finish(key, future, error=RequestAbandoned(key))
+            raise
+        self._finish(key, future, result)
+        return result
+
+    # Streaming form of merged(): the leader yields deltas as they arrive, followers get the
+    # leader's complete text in one piece
+    def merged_stream(self, key, open_stream):
+        while True:
+            leader, future = self._join(key)
+            if leader:
+                break
+            try:
+                result = future.result()
+            except RequestAbandoned:
+                continue
+            yield result
+            return
+        parts = []
+        try:
+            for delta in open_stream():
+                parts.append(delta)
+                yield delta
+        except Exception as e:
+            self._finish(key, future, error=e)
+            raise
+        except BaseException:
+            self._finish(key, future, error=RequestAbandoned(key))
+            raise
+        self._finish(key, future, "".join(parts))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+# Process-wide scheduler shared by every Streamlit session and worker thread
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,149 @@
+"""SQLite cache of generated completions keyed by a fingerprint of the request."""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentation import get_logger, log_event
+
+log = get_logger("response_cache")
+
+CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH", os.path.join(".cache", "responses.sqlite3"))
+# "off", "on" (serve cached responses) or "refresh" (serve cached responses while adding
+# fresh variants in the background, up to CACHE_VARIANTS per fingerprint)
+CACHE_MODE = os.getenv("RESPONSE_CACHE", "on").strip().lower()
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL_HOURS", "24")) * 3600
+CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_MB", "64")) * 1024 * 1024
+CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    content TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_key ON responses (key, created);
+CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used);
+"""
+
+
+# Hash of everything that determines the completion: final prompt, model and sampling
+# parameters. Transport-only fields such as "stream" are left out.
+def fingerprint(data):
+    relevant = {name: value for name, value in data.items() if name != "stream"}
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 max_variants=CACHE_VARIANTS, refresh=False):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_variants = max(1, max_variants)
+        self.refresh = refresh
+        self._local = threading.local()
+        self._refreshing = set()
+        self._refresh_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cache-refresh")
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connection().executescript(SCHEMA)
+
+    # One connection per thread (sqlite3 connections can't be shared across threads)
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    # Return (a random fresh variant or None, number of fresh variants)
+    def lookup(self, key):
+        connection = self._connection()
+        cutoff = time.time() - self.ttl
+        row = connection.execute(
+            "SELECT id, content FROM responses WHERE key = ? AND created >= ? ORDER BY RANDOM() LIMIT 1",
+            (key, cutoff)
+        ).fetchone()
+        if row is None:
+            return None, 0
+        connection.execute("UPDATE responses SET last_used = ? WHERE id = ?", (time.time(), row[0]))
+        variants = connection.execute(
+            "SELECT COUNT(*) FROM responses WHERE key = ? AND created >= ?", (key, cutoff)
+        ).fetchone()[0]
+        return row[1], variants
+
+    def put(self, key, content):
+        now = time.time()
+        connection = self._connection()
+        connection.execute(
+            "INSERT INTO responses (key, content, size, created, last_used) VALUES (?, ?, ?, ?, ?)",
+            (key, content, len(content.encode("utf-8")), now, now)
+        )
+        # Keep only the newest max_variants per key
+        connection.execute(
+            "DELETE FROM responses WHERE key = ? AND id NOT IN "
+            "(SELECT id FROM responses WHERE key = ? ORDER BY created DESC LIMIT ?)",
+            (key, key, self.max_variants)
+        )
+        self.evict()
+
+    # Drop expired entries, then least recently used ones until the cache fits in max_bytes
+    def evict(self):
+        connection = self._connection()
+        connection.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for row_id, size in connection.execute("SELECT id, size FROM responses ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            doomed.append((row_id,))
+            total -= size
+        connection.executemany("DELETE FROM responses WHERE id = ?", doomed)
+
+    # In refresh mode, fetch another variant in the background (at most one per key at a time)
+    def maybe_refresh(self, key, variants, fetch):
+        if not self.refresh or variants >= self.max_variants:
+            return
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def run():
+            try:
+                self.put(key, fetch())
+            except Exception as e:
+                log_event(log, logging.WARNING, "cache_refresh_failed", error=str(e))
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        self._executor.submit(run)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+# Process-wide cache, or None when RESPONSE_CACHE=off
+def get_response_cache():
+    global _cache
+    if CACHE_MODE == "off":
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(refresh=CACHE_MODE == "refresh")
+        return _cache
@@ -0,0 +1,387 @@
+"""Chunk index over extracted textbook pages with BM25 retrieval, stored in NumPy arrays."""
+import mmap
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+INDEX_DIR = os.getenv("INDEX_CACHE_DIR", os.path.join(".cache", "chunk_index"))
+# Size bound for the saved indexes (arrays plus a text copy of each book), evicted LRU by mtime
+INDEX_MAX_BYTES = int(os.getenv("INDEX_CACHE_MAX_MB", "512")) * 1024 * 1024
+INDEX_VERSION = 2
+CHUNK_CHARS = 1500
+
+# BM25 parameters
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with from "
+    "they will would there their what about which when make like than then them these some into "
+    "its also more other only such each may been were who how where does did".split()
+)
+
+
+# Lowercased word tokens, minus stopwords and single characters
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(text.lower()) if len(token) > 1 and token not in STOPWORDS]
+
+
+# Split text into ~chunk_chars pieces, preferring paragraph, then line, then word boundaries
+def chunk_bounds(text, chunk_chars=CHUNK_CHARS):
+    bounds = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            floor = start + chunk_chars // 2
+            for separator in ("\n\n", "\n", " "):
+                cut = text.rfind(separator, floor, end)
+                if cut != -1:
+                    end = cut + len(separator)
+                    break
+        if text[start:end].strip():
+            bounds.append((start, end))
+        start = end
+    return bounds
+
+
+# Parse "12-30" / "12" into a 1-based inclusive (first, last) page range; None if blank or invalid
+def parse_page_range(value):
+    match = re.fullmatch(r"\s*(\d+)\s*(?:[-–:]\s*(\d+)\s*)?", value or "")
+    if not match:
+        return None
+    first = int(match.group(1))
+    last = int(match.group(2) or first)
+    return (min(first, last), max(first, last))
+
+
+class ChunkIndex:
+    def __init__(self, text, chunk_start, chunk_end, page_first, page_last,
+                 vocab, term_ptr, post_chunk, post_tf, chunk_len):
+        self.text = text                    # UTF-8 bytes of the document (memory-mapped once saved)
+        self.chunk_start = chunk_start      # int64[n_chunks] byte offsets into text
+        self.chunk_end = chunk_end
+        self.page_first = page_first        # int32[n_chunks] 1-based page numbers
+        self.page_last = page_last
+        self.vocab = vocab                  # term -> term id
+        self.term_ptr = term_ptr            # int64[n_terms + 1] CSR offsets into the postings
+        self.post_chunk = post_chunk        # int32[n_postings] chunk id per posting
+        self.post_tf = post_tf              # float32[n_postings] term frequency per posting
+        self.chunk_len = chunk_len          # float32[n_chunks] tokens per chunk
+
+    def __len__(self):
+        return len(self.chunk_start)
+
+    # Build the index from page texts (any iterable of strings)
+    @classmethod
+    def build(cls, pages, chunk_chars=CHUNK_CHARS):
+        pages = list(pages)
+        text = "\n".join(pages)
+        page_offsets = np.zeros(len(pages), dtype=np.int64)
+        if pages:
+            page_offsets[1:] = np.cumsum([len(page) + 1 for page in pages[:-1]])
+
+        bounds = chunk_bounds(text, chunk_chars)
+        chunk_start = np.array([start for start, _ in bounds], dtype=np.int64)
+        chunk_end = np.array([end for _, end in bounds], dtype=np.int64)
+        page_first = np.searchsorted(page_offsets, chunk_start, side="right").astype(np.int32)
+        page_last = np.searchsorted(page_offsets, np.maximum(chunk_end - 1, chunk_start), side="right").astype(np.int32)
+
+        vocab = {}
+        term_ids, chunk_ids, term_freqs = [], [], []
+        chunk_len = np.zeros(len(bounds), dtype=np.float32)
+        for chunk_id, (start, end) in enumerate(bounds):
+            tokens = tokenize(text[start:end])
+            chunk_len[chunk_id] = len(tokens)
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocab.setdefault(term, len(vocab)))
+                chunk_ids.append(chunk_id)
+                term_freqs.append(count)
+
+        term_ids = np.array(term_ids, dtype=np.int64)
+        order = np.argsort(term_ids, kind="stable")
+        term_ptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocab)), out=term_ptr[1:])
+        post_chunk = np.array(chunk_ids, dtype=np.int32)[order]
+        post_tf = np.array(term_freqs, dtype=np.float32)[order]
+
+        # Chunks are addressed by byte offset into the UTF-8 text, so a saved index can
+        # serve chunk text straight from a memory map instead of holding the decoded book
+        byte_start = np.zeros(len(bounds), dtype=np.int64)
+        byte_end = np.zeros(len(bounds), dtype=np.int64)
+        position = byte_position = 0
+        for chunk_id, (start, end) in enumerate(bounds):
+            byte_position += len(text[position:start].encode("utf-8"))
+            byte_start[chunk_id] = byte_position
+            byte_position += len(text[start:end].encode("utf-8"))
+            byte_end[chunk_id] = byte_position
+            position = end
+        return cls(text.encode("utf-8"), byte_start, byte_end, page_first, page_last,
+                   vocab, term_ptr, post_chunk, post_tf, chunk_len)
+
+    def chunk_text(self, chunk_id):
+        return self.text[self.chunk_start[chunk_id]:self.chunk_end[chunk_id]].decode("utf-8", errors="replace")
+
+    # The arrays go to `path` (.npz) and the text to a sibling .txt file that load() memory-maps
+    def save(self, path):
+        text_path = _text_path(path)
+        with open(f"{text_path}.tmp", "wb") as file:
+            file.write(self.text)
+        os.replace(f"{text_path}.tmp", text_path)
+
+        terms = np.array(sorted(self.vocab, key=self.vocab.get), dtype=np.str_)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            version=np.int32(INDEX_VERSION),
+            text_bytes=np.int64(len(self.text)),
+            chunk_start=self.chunk_start, chunk_end=self.chunk_end,
+            page_first=self.page_first, page_last=self.page_last,
+            terms=terms, term_ptr=self.term_ptr,
+            post_chunk=self.post_chunk, post_tf=self.post_tf, chunk_len=self.chunk_len,
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError("Index version mismatch")
+            vocab = {str(term): term_id for term_id, term in enumerate(data["terms"])}
+            text = _map_text(_text_path(path), int(data["text_bytes"]))
+            return cls(
+                text,
+                data["chunk_start"], data["chunk_end"], data["page_first"], data["page_last"],
+                vocab, data["term_ptr"], data["post_chunk"], data["post_tf"], data["chunk_len"],
+            )
+
+
+# Several documents' chunk indexes searched as one (a course pack). BM25 statistics are taken
+# over the whole course so scores compare across documents, but each document's arrays are
+# built and cached once on their own: adding a document never re-tokenizes the others.
+# Chunk ids are global; document d's chunks follow those of documents 0..d-1.
+class CourseIndex:
+    def __init__(self, indexes):
+        self.indexes = indexes
+        sizes = [len(index) for index in indexes]
+        self.chunk_offset = np.zeros(len(indexes) + 1, dtype=np.int64)
+        np.cumsum(sizes, out=self.chunk_offset[1:])
+        self.chunk_doc = np.repeat(np.arange(len(indexes), dtype=np.int32), sizes)
+        self.page_first = _concatenate([index.page_first for index in indexes], np.int32)
+        self.page_last = _concatenate([index.page_last for index in indexes], np.int32)
+        self.chunk_size = _concatenate([index.chunk_end - index.chunk_start for index in indexes], np.int64)
+        self.chunk_len = _concatenate([index.chunk_len for index in indexes], np.float32)
+        self.avg_len = float(self.chunk_len.mean()) if len(self.chunk_len) else 0.0
+
+    def __len__(self):
+        return len(self.chunk_doc)
+
+    # (document position, local chunk id) of a global chunk id
+    def locate(self, chunk_id):
+        document = int(self.chunk_doc[chunk_id])
+        return document, int(chunk_id - self.chunk_offset[document])
+
+    def chunk_text(self, chunk_id):
+        document, local_id = self.locate(chunk_id)
+        return self.indexes[document].chunk_text(local_id)
+
+    # BM25 score of every chunk in the course, with course-wide document frequencies
+    def score(self, query):
+        scores = np.zeros(len(self), dtype=np.float32)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_len / max(self.avg_len, 1.0))
+        for term in set(tokenize(query)):
+            chunk_parts, tf_parts = [], []
+            for document, index in enumerate(self.indexes):
+                term_id = index.vocab.get(term)
+                if term_id is None:
+                    continue
+                start, end = index.term_ptr[term_id], index.term_ptr[term_id + 1]
+                chunk_parts.append(index.post_chunk[start:end] + self.chunk_offset[document])
+                tf_parts.append(index.post_tf[start:end])
+            if not chunk_parts:
+                continue
+            chunks = np.concatenate(chunk_parts)
+            tf = np.concatenate(tf_parts)
+            idf = np.log1p((len(self) - len(chunks) + 0.5) / (len(chunks) + 0.5))
+            scores[chunks] += idf * tf * (BM25_K1 + 1) / (tf + norm[chunks])
+        return scores
+
+    # Pick chunks for a prompt, optionally within one document and/or a page range of each
+    # document. With a query: top BM25 matches. Without: a contiguous run of chunks from each
+    # document, sized in proportion to the document's share of the candidates (random start,
+    # so repeated quizzes cover different parts). Returned in course order, up to max_chars.
+    def select(self, query=None, page_range=None, max_chars=15000, document=None, rng=None):
+        mask = np.ones(len(self), dtype=bool)
+        if document is not None:
+            mask &= self.chunk_doc == document
+        if page_range:
+            first, last = page_range
+            mask &= (self.page_last >= first) & (self.page_first <= last)
+        candidates = np.flatnonzero(mask)
+        if not len(candidates):
+            return []
+
+        if query and tokenize(query):
+            scores = self.score(query)[candidates]
+            order = np.argsort(-scores, kind="stable")
+            matched = candidates[order][scores[order] > 0]
+            if len(matched):
+                return self._fill(matched, max_chars)
+        return self._fill(self._sample_proportional(candidates, max_chars, rng or np.random.default_rng()), max_chars)
+
+    def _sample_proportional(self, candidates, max_chars, rng):
+        budget = int(max_chars // max(float(self.chunk_size[candidates].mean()), 1.0))
+        if budget >= len(candidates):
+            return candidates
+        documents, counts = np.unique(self.chunk_doc[candidates], return_counts=True)
+        shares = counts / counts.sum() * budget
+        quotas = np.floor(shares).astype(np.int64)
+        # Hand the chunks lost to rounding to the largest remainders
+        for position in np.argsort(-(shares - quotas), kind="stable")[:budget - int(quotas.sum())]:
+            quotas[position] += 1
+        picks = []
+        for document, quota in zip(documents, quotas):
+            if quota <= 0:
+                continue
+            in_document = candidates[self.chunk_doc[candidates] == document]
+            start = int(rng.integers(0, len(in_document) - quota + 1))
+            picks.append(in_document[start:start + quota])
+        return np.concatenate(picks) if picks else candidates[:0]
+
+    def _fill(self, ordered, max_chars):
+        selected = []
+        total = 0
+        for chunk_id in ordered:
+            size = int(self.chunk_size[chunk_id])
+            if selected and total + size > max_chars:
+                break
+            selected.append(int(chunk_id))
+            total += size
+        return sorted(selected)
+
+
+def _concatenate(arrays, dtype):
+    return np.concatenate(arrays).astype(dtype, copy=False) if arrays else np.zeros(0, dtype=dtype)
+
+
+def _text_path(path):
+    return os.path.splitext(path)[0] + ".txt"
+
+
+# Bump the mtimes of a saved index so eviction treats it as recently used
+def _touch_index(path):
+    for file_path in (path, _text_path(path)):
+        try:
+            os.utime(file_path, None)
+        except OSError:
+            pass
+
+
+_evict_lock = threading.Lock()
+
+
+# Drop least recently used saved indexes (their .npz and .txt together) until the directory
+# fits in max_bytes. Indexes still memory-mapped keep working: the OS only frees a removed
+# file once its last mapping is closed.
+def evict_indexes(index_dir=INDEX_DIR, max_bytes=INDEX_MAX_BYTES):
+    with _evict_lock:
+        entries = {}
+        total = 0
+        try:
+            scanned = list(os.scandir(index_dir))
+        except OSError:
+            return
+        for entry in scanned:
+            stem, extension = os.path.splitext(entry.name)
+            if extension not in (".npz", ".txt"):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            mtime, size, paths = entries.get(stem, (0.0, 0, []))
+            entries[stem] = (max(mtime, stat.st_mtime), size + stat.st_size, paths + [entry.path])
+            total += stat.st_size
+
+        for _, size, paths in sorted(entries.values()):
+            if total <= max_bytes:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+
+# Read-only memory map of an index's text; pages are loaded by the OS only when a chunk is read
+def _map_text(path, expected_bytes):
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size != expected_bytes:
+            raise ValueError("Index text size mismatch")
+        if expected_bytes == 0:
+            return b""
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+_memory_cache = OrderedDict()
+_memory_cache_size = 8
+_memory_lock = threading.Lock()
+
+
+# Return the index for a document, building it once and caching it in memory and on disk.
+# load_pages is only called when the index has to be built.
+def get_chunk_index(doc_key, load_pages):
+    with _memory_lock:
+        index = _memory_cache.get(doc_key)
+        if index is not None:
+            _memory_cache.move_to_end(doc_key)
+            return index
+
+    path = os.path.join(INDEX_DIR, f"{doc_key}.npz")
+    try:
+        index = ChunkIndex.load(path)
+        _touch_index(path)
+    except (OSError, ValueError, KeyError):
+        index = ChunkIndex.build(load_pages())
+        os.makedirs(INDEX_DIR, exist_ok=True)
+        index.save(path)
+        # Keep the saved copy, whose text is memory-mapped, rather than the build that holds
+        # the whole book in memory
+        try:
+            index = ChunkIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            pass
+        evict_indexes()
+
+    with _memory_lock:
+        _memory_cache[doc_key] = index
+        while len(_memory_cache) > _memory_cache_size:
+            _memory_cache.popitem(last=False)
+    return index
+
+
+_course_cache = OrderedDict()
+
+
+# Course index over the given documents (in order), from their cached per-document indexes
+def get_course_index(doc_keys, load_pages):
+    doc_keys = tuple(doc_keys)
+    indexes = [get_chunk_index(doc_key, lambda doc_key=doc_key: load_pages(doc_key)) for doc_key in doc_keys]
+    with _memory_lock:
+        course = _course_cache.get(doc_keys)
+        # Rebuilt if a member index was reloaded (e.g. evicted from the memory cache)
+        if course is not None and all(a is b for a, b in zip(course.indexes, indexes)):
+            _course_cache.move_to_end(doc_keys)
+            return course
+    course = CourseIndex(indexes)
+    with _memory_lock:
+        _course_cache[doc_keys] = course
+        while len(_course_cache) > _memory_cache_size:
+            _course_cache.popitem(last=False)
+    return course